@@ -0,0 +1,5 @@
+-- 010_run_queue.rollback.sql
+
+DROP INDEX IF EXISTS idx_run_queue_claimed_by;
+DROP INDEX IF EXISTS idx_run_queue_claimable;
+DROP TABLE IF EXISTS run_queue;
@@ -0,0 +1,18 @@
+-- 010_run_queue.sql
+-- Durable record of background graph runs so they can be resumed by any replica
+
+CREATE TABLE IF NOT EXISTS run_queue (
+    run_id UUID PRIMARY KEY,
+    thread_id TEXT NOT NULL REFERENCES threads(thread_id) ON DELETE CASCADE,
+    user_id TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claimed_by TEXT,
+    heartbeat_at TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    finished_at TIMESTAMP WITH TIME ZONE
+);
+
+-- Claimable runs are scanned oldest first; finished runs are excluded from the index
+CREATE INDEX IF NOT EXISTS idx_run_queue_claimable ON run_queue(created_at) WHERE status IN ('queued', 'running');
+CREATE INDEX IF NOT EXISTS idx_run_queue_claimed_by ON run_queue(claimed_by) WHERE status = 'running';
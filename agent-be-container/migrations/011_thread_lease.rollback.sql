@@ -0,0 +1,7 @@
+-- 011_thread_lease.rollback.sql
+
+DROP INDEX IF EXISTS idx_run_queue_claimed_by;
+CREATE INDEX IF NOT EXISTS idx_run_queue_claimed_by ON run_queue(claimed_by) WHERE status = 'running';
+
+DROP INDEX IF EXISTS idx_threads_locked_by;
+ALTER TABLE threads DROP COLUMN IF EXISTS locked_by;
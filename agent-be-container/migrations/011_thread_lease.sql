@@ -0,0 +1,10 @@
+-- 011_thread_lease.sql
+-- Record which replica holds a thread's lease so only the owner renews or releases it
+
+ALTER TABLE threads ADD COLUMN IF NOT EXISTS locked_by TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_threads_locked_by ON threads(locked_by) WHERE locked_by IS NOT NULL;
+
+-- Runs cancelled through the API stay claimed until their owner stops them
+DROP INDEX IF EXISTS idx_run_queue_claimed_by;
+CREATE INDEX IF NOT EXISTS idx_run_queue_claimed_by ON run_queue(claimed_by) WHERE status IN ('running', 'cancelled');
@@ -0,0 +1,4 @@
+-- 012_agent_definition_hash.rollback.sql
+
+DROP INDEX IF EXISTS idx_agent_definitions_name;
+ALTER TABLE agent_definitions DROP COLUMN IF EXISTS content_hash;
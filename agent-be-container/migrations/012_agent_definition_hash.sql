@@ -0,0 +1,6 @@
+-- 012_agent_definition_hash.sql
+-- Content hash of each agent definition so bulk loads can skip unchanged files
+
+ALTER TABLE agent_definitions ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_agent_definitions_name ON agent_definitions(name);
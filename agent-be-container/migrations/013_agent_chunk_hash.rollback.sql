@@ -0,0 +1,4 @@
+-- 013_agent_chunk_hash.rollback.sql
+
+DROP INDEX IF EXISTS idx_agent_definition_chunks_agent_id;
+ALTER TABLE agent_definition_chunks DROP COLUMN IF EXISTS content_hash;
@@ -0,0 +1,6 @@
+-- 013_agent_chunk_hash.sql
+-- Content hash of each chunk so updates only re-embed chunks whose text changed
+
+ALTER TABLE agent_definition_chunks ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_agent_definition_chunks_agent_id ON agent_definition_chunks(agent_id);
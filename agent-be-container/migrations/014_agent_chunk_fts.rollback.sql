@@ -0,0 +1,5 @@
+-- 014_agent_chunk_fts.rollback.sql
+
+DROP INDEX IF EXISTS idx_agent_definitions_lower_name;
+DROP INDEX IF EXISTS idx_agent_definition_chunks_tsv;
+ALTER TABLE agent_definition_chunks DROP COLUMN IF EXISTS content_tsv;
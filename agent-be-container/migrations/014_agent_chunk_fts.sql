@@ -0,0 +1,8 @@
+-- 014_agent_chunk_fts.sql
+-- Full-text index over agent chunks and lookup by agent name for hybrid retrieval
+
+ALTER TABLE agent_definition_chunks
+    ADD COLUMN IF NOT EXISTS content_tsv tsvector GENERATED ALWAYS AS (to_tsvector('english', content)) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_agent_definition_chunks_tsv ON agent_definition_chunks USING gin (content_tsv);
+CREATE INDEX IF NOT EXISTS idx_agent_definitions_lower_name ON agent_definitions (lower(name));
@@ -0,0 +1,3 @@
+-- 015_llm_response_cache.rollback.sql
+
+DROP TABLE IF EXISTS llm_response_cache;
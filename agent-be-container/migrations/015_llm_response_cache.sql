@@ -0,0 +1,18 @@
+-- 015_llm_response_cache.sql
+-- Semantic cache of main LLM answers, looked up by prompt context and question embedding
+
+CREATE TABLE IF NOT EXISTS llm_response_cache (
+    id UUID PRIMARY KEY,
+    context_hash TEXT NOT NULL,
+    agent_id UUID REFERENCES agent_definitions(id) ON DELETE CASCADE,
+    query TEXT NOT NULL,
+    embedding vector(768) NOT NULL,
+    content JSONB NOT NULL,
+    total_tokens INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_llm_response_cache_context ON llm_response_cache(context_hash, agent_id);
+CREATE INDEX IF NOT EXISTS idx_llm_response_cache_agent_id ON llm_response_cache(agent_id);
+CREATE INDEX IF NOT EXISTS idx_llm_response_cache_expires_at ON llm_response_cache(expires_at);
@@ -0,0 +1,3 @@
+-- 016_packager_cache.rollback.sql
+
+DROP TABLE IF EXISTS packager_cache;
@@ -0,0 +1,12 @@
+-- 016_packager_cache.sql
+-- Exact-match cache of packager structured outputs, shared by replicas
+
+CREATE TABLE IF NOT EXISTS packager_cache (
+    key TEXT PRIMARY KEY,
+    schema TEXT NOT NULL,
+    value JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_packager_cache_expires_at ON packager_cache(expires_at);
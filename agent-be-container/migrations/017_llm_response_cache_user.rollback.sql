@@ -0,0 +1,5 @@
+-- 017_llm_response_cache_user.rollback.sql
+
+DROP INDEX IF EXISTS idx_llm_response_cache_context;
+ALTER TABLE llm_response_cache DROP COLUMN IF EXISTS user_id;
+CREATE INDEX IF NOT EXISTS idx_llm_response_cache_context ON llm_response_cache(context_hash, agent_id);
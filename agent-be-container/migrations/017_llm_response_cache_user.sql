@@ -0,0 +1,9 @@
+-- 017_llm_response_cache_user.sql
+-- Scopes cached answers to the user they were given to; existing unscoped answers are dropped
+
+DELETE FROM llm_response_cache;
+
+ALTER TABLE llm_response_cache ADD COLUMN IF NOT EXISTS user_id TEXT NOT NULL;
+
+DROP INDEX IF EXISTS idx_llm_response_cache_context;
+CREATE INDEX IF NOT EXISTS idx_llm_response_cache_context ON llm_response_cache(context_hash, user_id, agent_id);
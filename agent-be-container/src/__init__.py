@@ -52,13 +52,14 @@ def app_init(app: web.Application, config: ServiceConfig):
     langgraph_app_create(app, config)
 
     # Add basic health endpoint to main app
-    from .main import health_check, auth_middleware
+    from .main import health_check, auth_middleware, add_cors_headers
     path_prefix = config.webservice.url.path if config.webservice.url.path and config.webservice.url.path != "/" else ""
     path_prefix = path_prefix.rstrip("/")
     app.router.add_get(f"{path_prefix}/health", health_check)
 
     # Add middleware for CORS and auth
     app.middlewares.append(auth_middleware)
+    app.on_response_prepare.append(add_cors_headers)
 
     return app
 
@@ -69,8 +70,8 @@ def langgraph_app_create(app: web.Application, config: ServiceConfig) -> web.App
     This integrates the LangGraph agent defined in main.py with the modular app structure
     """
     from .main import (
-        chat_endpoint, list_threads, get_history, get_visualizations,
-        delete_thread, update_thread, get_user_settings, update_user_settings,
+        chat_endpoint, list_threads, get_history, thread_events, get_visualizations,
+        cancel_thread, delete_thread, update_thread, get_user_settings, update_user_settings,
         on_startup, on_cleanup
     )
 
@@ -81,7 +82,9 @@ def langgraph_app_create(app: web.Application, config: ServiceConfig) -> web.App
     app.router.add_post(f"{path_prefix}/api/chat", chat_endpoint)
     app.router.add_get(f"{path_prefix}/api/threads", list_threads)
     app.router.add_get(f"{path_prefix}/api/threads/{{thread_id}}/history", get_history)
+    app.router.add_get(f"{path_prefix}/api/threads/{{thread_id}}/events", thread_events)
     app.router.add_get(f"{path_prefix}/api/threads/{{thread_id}}/visualizations", get_visualizations)
+    app.router.add_post(f"{path_prefix}/api/threads/{{thread_id}}/cancel", cancel_thread)
     app.router.add_delete(f"{path_prefix}/api/threads/{{thread_id}}", delete_thread)
     app.router.add_put(f"{path_prefix}/api/threads/{{thread_id}}", update_thread)
     app.router.add_get(f"{path_prefix}/api/user/settings", get_user_settings)
@@ -13,7 +13,9 @@ from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMe
 from langgraph.prebuilt import ToolNode, tools_condition
 from langchain_core.runnables import RunnableConfig
 from .tools import get_tools
-from .structs import MFEContent, MFEContainer, FollowUpQuestions, AgentState, PromptFeedback
+from .structs import MFEContent, MFEContainer, FollowUpQuestions, AgentState, PromptFeedback, AgentContext, HistorySummary, SpeculativeAnswer
+from .events import chunk_text
+import asyncio
 import logging
 import uuid
 
@@ -133,6 +135,15 @@ def merge_usage_metadata(m1: dict | None, m2: Any) -> dict:
 
     for key in ["input_tokens", "output_tokens", "total_tokens"]:
         res[key] = res.get(key, 0) + get_val(m2, key)
+    # Only reported by some calls, so only carried once one of them has it
+    for key in ["injected_context_tokens", "history_tokens_saved", "response_cache_tokens_saved"]:
+        if get_val(m2, key):
+            res[key] = res.get(key, 0) + get_val(m2, key)
+    # Input tokens the provider read from its prompt cache; raw responses report them in input_token_details
+    details = m2.get("input_token_details") if isinstance(m2, dict) else getattr(m2, "input_token_details", None)
+    cached = get_val(m2, "cached_tokens") or get_val(details or {}, "cache_read")
+    if cached:
+        res["cached_tokens"] = res.get("cached_tokens", 0) + cached
     return res
 
 def create_agent(main_llm: BaseChatModel, packager_llm: BaseChatModel, main_prompt: str = "", packager_prompt: str = "", checkpointer=None):
@@ -142,8 +153,9 @@ def create_agent(main_llm: BaseChatModel, packager_llm: BaseChatModel, main_prom
     tools = get_tools(builder)
     main_llm_with_tools = main_llm.bind_tools(tools)
 
-    follow_up_llm_with_schema = packager_llm.with_structured_output(FollowUpQuestions, include_raw=True)
-    learning_mode_llm_with_schema = packager_llm.with_structured_output(PromptFeedback, include_raw=True)
+    from .packager_cache import CachedStructuredOutput
+
+    learning_mode_llm_with_schema = CachedStructuredOutput(packager_llm, PromptFeedback)
 
 
     async def learning_mode_node(state: AgentState):
@@ -234,53 +246,142 @@ def create_agent(main_llm: BaseChatModel, packager_llm: BaseChatModel, main_prom
                 updated_content += "\n\n"
             updated_content += "**Visualizations pinned to panel:**\n- " + "\n- ".join(pinned_names)
 
-        # Standard metadata
+        # Standard metadata; the answer is final here, follow-up questions are attached
+        # afterwards by the post-turn job (see create_post_turn)
         updated_kwargs["timestamp"] = datetime.now(timezone.utc).isoformat()
         updated_kwargs["packaged"] = True
+        updated_kwargs["follow_ups_pending"] = True
+
+        # Accumulate usage metadata from all AIMessages in THE CURRENT TURN
+        total_usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+        for m in reversed(messages_since_human):
+            if isinstance(m, AIMessage) and m.usage_metadata:
+                total_usage = merge_usage_metadata(total_usage, m.usage_metadata)
 
         updated_msg = AIMessage(
             content=updated_content,
             id=last_ai_msg.id,
             tool_calls=getattr(last_ai_msg, "tool_calls", []),
             additional_kwargs=updated_kwargs,
-            usage_metadata=getattr(last_ai_msg, "usage_metadata", None)
+            usage_metadata=total_usage
         )
 
         return {"messages": [updated_msg]}
 
 
-    from .agent_store import search_agent_definitions
+    from .agent_store import get_agent_definition, search_agent_definitions
+    from .agent_context import assemble_agent_context, context_budget, is_on_topic
+    from .history import window_for_config
+    from .response_cache import lookup_response, store_response
 
-    async def llm_node(state: AgentState):
+    async def retrieve_agent_context(query: str, service_config) -> AgentContext | None:
+        try:
+            top_agents = await search_agent_definitions(query, service_config, limit=1)
+        except Exception as e:
+            logger.error(f"Failed to search for agent definitions: {e}")
+            return None
+        context = assemble_agent_context(
+            top_agents,
+            service_config.embedding_client.context_min_similarity,
+            context_budget(service_config),
+        )
+        context.query = query
+        if context.agent_name:
+            logger.info(f"LLM Node: Selected agent '{context.agent_name}' ({context.chunks} chunks, {context.tokens} tokens)")
+        return context
+
+    async def reload_agent_context(stored: AgentContext, service_config) -> AgentContext | None:
+        """Rebuilds a kept agent context's text from its definition, fetched by id: no search, no embedding."""
+        try:
+            definition = await get_agent_definition(stored.agent_id, stored.chunk_indexes)
+        except Exception as e:
+            logger.error(f"Failed to load agent definition {stored.agent_id}: {e}")
+            return None
+        if definition is None:
+            logger.info(f"LLM Node: Agent '{stored.agent_name}' was deleted, dropping its context")
+            return AgentContext(query=stored.query)
+        definition["similarity"] = stored.similarity
+        context = assemble_agent_context(
+            [definition],
+            service_config.embedding_client.context_min_similarity,
+            context_budget(service_config),
+        )
+        context.query = stored.query
+        return context
+
+    async def answer(state: AgentState, config: RunnableConfig) -> tuple[AIMessage, AgentContext | None]:
+        """Main LLM call for the thread; returns the response and the agent context to keep in state if it changed."""
         visualizations = state.visualizations
         viz_context = ""
         if visualizations:
             viz_list = [v.model_dump() for v in visualizations]
             viz_json = json.dumps(viz_list, indent=2)
-            viz_context = f"\n\n### Current Visualizations Pinned to Workspace (JSON):\n```json\n{viz_json}\n```"
+            # Sent as a user-role message, so it is fenced off from what the user wrote
+            viz_context = (
+                "[Workspace context supplied by the application, not written by the user]\n"
+                f"<workspace_visualizations>\n{viz_json}\n</workspace_visualizations>"
+            )
 
-        # Search for relevant agent definition based on the last user message
-        agent_context = ""
-        if state.messages and isinstance(state.messages[-1], HumanMessage):
+        # The thread's agent context is kept for tool passes and for human messages that
+        # stay on its topic, its text reloaded from the definition so that edits show;
+        # otherwise the new message is searched for
+        stored = state.agent_context
+        agent_context = None
+        retrieved = None
+        service_config = config.get("configurable", {}).get("service_config")
+        if service_config and state.messages and isinstance(state.messages[-1], HumanMessage):
             last_message_content = state.messages[-1].content
-            try:
-                top_agents = await search_agent_definitions(last_message_content, config, limit=1)
-                if top_agents:
-                    top_agent = top_agents[0]
-                    agent_context = f"\n\n### Relevant Agent Context ({top_agent['name']}):\n{top_agent['full_content']}"
-            except Exception as e:
-                logger.error(f"Failed to search for agent definitions: {e}")
-
-        final_prompt = f"{main_prompt}{viz_context}{agent_context}"
+            threshold = service_config.embedding_client.context_reuse_similarity
+            if not is_on_topic(stored, last_message_content, threshold):
+                stored = None
+                agent_context = await retrieve_agent_context(last_message_content, service_config)
+        if service_config and stored and stored.agent_id:
+            agent_context = await reload_agent_context(stored, service_config)
+        if agent_context is not None:
+            # Checkpointed without its text
+            reference = agent_context.model_copy(update={"text": "", "tokens": 0, "chunks": 0})
+            if reference != state.agent_context:
+                retrieved = reference
+        agent_context_text = agent_context.text if agent_context else ""
+
+        window = window_for_config(state.messages, state.history_summary, service_config)
+        # Stable prefix first, so providers that cache prompt prefixes (OpenAI, Azure OpenAI,
+        # Gemini implicit caching, Ollama's loaded context) reuse it: the static prompt, the
+        # agent context kept until the topic drifts and the summary that changes as turns roll
+        # out of the window, then the earlier turns. The visualizations, which tools edit
+        # mid-turn, go in their own message at the start of the current turn, after the history
+        final_prompt = f"{main_prompt}{agent_context_text}{window.summary_section}"
         system_instruction = SystemMessage(content=final_prompt)
-        messages = [system_instruction] + state.messages
-
-        logger.info(f"LLM Node: Invoking LLM with {len(messages)} messages (including System Prompt)")
+        messages = [system_instruction] + window.messages
+        if viz_context:
+            turn_start = next((i for i in range(len(messages) - 1, 0, -1) if isinstance(messages[i], HumanMessage)), len(messages))
+            messages.insert(turn_start, HumanMessage(content=viz_context))
+
+        # Repeat questions are answered from the response cache; only the first call of a
+        # turn is looked up, so a turn that has run tools never gets a cached answer
+        probe = None
+        if service_config and service_config.response_cache.enabled and isinstance(state.messages[-1], HumanMessage):
+            agent_id = agent_context.agent_id if agent_context else None
+            user_id = config.get("configurable", {}).get("user_id")
+            # Keyed without the summary of turns that left the window, which differs by thread
+            probe = await lookup_response(f"{main_prompt}{agent_context_text}{viz_context}", window.messages, agent_id, user_id, service_config)
+            if probe and probe.hit:
+                return probe.message(), retrieved
+
+        logger.info(f"LLM Node: Invoking LLM with {len(messages)} messages (including System Prompt), {window.tokens_saved} history tokens saved")
 
         response = await main_llm_with_tools.ainvoke(messages)
 
         logger.info(f"LLM Node: Response: {response}")
 
+        if agent_context_text or window.tokens_saved:
+            usage = dict(response.usage_metadata or {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0})
+            if agent_context_text:
+                usage["injected_context_tokens"] = agent_context.tokens
+            if window.tokens_saved:
+                usage["history_tokens_saved"] = window.tokens_saved
+            response.usage_metadata = usage
+
         # Coerce tool calls from content if tool_calls is empty
         if not response.tool_calls and response.content:
             content = response.content.strip()
@@ -318,68 +419,33 @@ def create_agent(main_llm: BaseChatModel, packager_llm: BaseChatModel, main_prom
                 except Exception as e:
                     logger.debug(f"LLM Node: Content looked like JSON but failed to parse: {e}")
 
-        return {"messages": [response]}
-
-
-
-    async def follow_up_node(state: AgentState):
-        logger.info("Running FollowUp Questions node")
-        # Accumulate usage metadata from all AIMessages in THE CURRENT TURN
-        total_usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
-        messages_since_human = []
-        for m in reversed(state.messages):
-            if isinstance(m, HumanMessage):
-                break
-            messages_since_human.append(m)
-
-        for m in reversed(messages_since_human):
-            if isinstance(m, AIMessage) and hasattr(m, 'usage_metadata') and m.usage_metadata:
-                total_usage = merge_usage_metadata(total_usage, m.usage_metadata)
+        if probe:
+            await store_response(probe, response, service_config)
 
-        system_instruction = SystemMessage(content="You are a helpful assistant. Generate exactly 3 highly relevant follow-up questions the user might ask next based on the conversation history.")
-        relevant_history = [
-            m for m in state.messages
-            if isinstance(m, (HumanMessage, AIMessage, ToolMessage))
-        ]
-        messages = [system_instruction] + relevant_history
+        return response, retrieved
 
-        raw_response = await follow_up_llm_with_schema.ainvoke(messages)
+    async def llm_node(state: AgentState, config: RunnableConfig):
+        response, retrieved = await answer(state, config)
+        update = {"messages": [response]}
+        if retrieved is not None:
+            update["agent_context"] = retrieved
+        return update
 
-        if isinstance(raw_response, dict) and "parsed" in raw_response:
-            response_follow_ups = raw_response["parsed"]
-            follow_up_usage = raw_response["raw"].usage_metadata if hasattr(raw_response["raw"], 'usage_metadata') else None
-            total_usage = merge_usage_metadata(total_usage, follow_up_usage)
-        else:
-            response_follow_ups = raw_response
-
-        # Find the last AIMessage to update it with the follow up questions
-        last_ai_message = None
-        for m in reversed(state.messages):
-            if isinstance(m, AIMessage):
-                last_ai_message = m
-                break
-
-        if last_ai_message:
-            updated_kwargs = last_ai_message.additional_kwargs.copy() if last_ai_message.additional_kwargs else {}
-            if hasattr(response_follow_ups, "follow_up_questions") and response_follow_ups.follow_up_questions:
-                updated_kwargs["follow_up_questions"] = response_follow_ups.follow_up_questions
-
-            updated_kwargs["packaged"] = True
-            updated_kwargs["timestamp"] = datetime.now(timezone.utc).isoformat()
-
-            # Mermaid extraction removed as per request
-
-            logger.info(f"FollowUp: Final combined usage: {total_usage}")
-            updated_msg = AIMessage(
-                content=last_ai_message.content,
-                id=last_ai_message.id,
-                tool_calls=getattr(last_ai_message, 'tool_calls', []),
-                additional_kwargs=updated_kwargs,
-                usage_metadata=total_usage
-            )
-            return {"messages": [updated_msg]}
+    async def speculative_llm_node(state: AgentState, config: RunnableConfig):
+        """Answers the prompt learning mode is reviewing, parked in the state in case the user keeps it."""
+        human = state.messages[-1]
+        response, retrieved = await answer(state, config)
+        logger.info(f"Speculative LLM: parked answer for message {human.id}")
+        update = {"speculative_answer": SpeculativeAnswer(query=human.content, human_id=human.id, message=response)}
+        if retrieved is not None:
+            update["agent_context"] = retrieved
+        return update
 
-        return {}
+    async def accept_speculation_node(state: AgentState):
+        """The user kept their original prompt: the parked answer becomes the reply, no LLM call needed."""
+        logger.info("Accepting speculative answer")
+        message = state.speculative_answer.message.model_copy(update={"id": str(uuid.uuid4())})
+        return {"messages": [message], "speculative_answer": None}
 
 
 
@@ -388,7 +454,15 @@ def create_agent(main_llm: BaseChatModel, packager_llm: BaseChatModel, main_prom
             return "tools"
         return "post_process"
 
-    def route_intent_or_learning_mode(state: AgentState, config: RunnableConfig) -> Literal["hello", "echo", "image", "llm", "learning_mode"]:
+    def accepts_speculation(state: AgentState) -> bool:
+        """True if the last message resends, unchanged, the prompt the parked answer was made for."""
+        speculation = state.speculative_answer
+        humans = [m for m in state.messages if isinstance(m, HumanMessage)]
+        if not speculation or len(humans) < 2:
+            return False
+        return humans[-2].id == speculation.human_id and humans[-1].content == speculation.query
+
+    def route_intent_or_learning_mode(state: AgentState, config: RunnableConfig) -> Literal["hello", "echo", "image", "llm", "learning_mode", "accept_speculation"] | list[str]:
         # First check standard intent routing
         intent = route_intent(state)
 
@@ -401,9 +475,15 @@ def create_agent(main_llm: BaseChatModel, packager_llm: BaseChatModel, main_prom
             if messages:
                 last_message = messages[-1]
                 if isinstance(last_message, HumanMessage) and getattr(last_message, "additional_kwargs", {}).get("learning_mode_bypass"):
+                    if accepts_speculation(state):
+                        return "accept_speculation"
                     return "llm" # user confirmed a prompt, skip learning mode and go to LLM
 
             if learning_mode_enabled:
+                service_config = config.get("configurable", {}).get("service_config")
+                if service_config and service_config.learning_mode.speculative:
+                    # Fan out: review the prompt and answer it as written at the same time
+                    return ["learning_mode", "speculative_llm"]
                 return "learning_mode"
 
         return intent
@@ -416,9 +496,10 @@ def create_agent(main_llm: BaseChatModel, packager_llm: BaseChatModel, main_prom
     builder.add_node("image", image_node)
     builder.add_node("learning_mode", learning_mode_node)
     builder.add_node("llm", llm_node)
+    builder.add_node("speculative_llm", speculative_llm_node)
+    builder.add_node("accept_speculation", accept_speculation_node)
     builder.add_node("tools", ToolNode(tools))
     builder.add_node("post_process", post_process_node)
-    builder.add_node("follow_up", follow_up_node)
 
     builder.add_edge(START, "initial")
     builder.add_edge("initial", "intent")
@@ -431,7 +512,9 @@ def create_agent(main_llm: BaseChatModel, packager_llm: BaseChatModel, main_prom
             "echo": "echo",
             "image": "image",
             "llm": "llm",
-            "learning_mode": "learning_mode"
+            "learning_mode": "learning_mode",
+            "speculative_llm": "speculative_llm",
+            "accept_speculation": "accept_speculation",
         }
     )
 
@@ -444,16 +527,118 @@ def create_agent(main_llm: BaseChatModel, packager_llm: BaseChatModel, main_prom
         }
     )
 
+    builder.add_conditional_edges(
+        "accept_speculation",
+        route_after_llm,
+        {
+            "tools": "tools",
+            "post_process": "post_process",
+        }
+    )
+
     builder.add_edge("tools", "llm")
     builder.add_edge("hello", "post_process")
     builder.add_edge("image", "post_process")
-    builder.add_edge("post_process", "follow_up")
-    builder.add_edge("follow_up", END)
+    builder.add_edge("post_process", END)
     builder.add_edge("echo", "post_process")
     builder.add_edge("learning_mode", END) # Stop graph after learning mode node
+    builder.add_edge("speculative_llm", END)
 
     return builder.compile(checkpointer=checkpointer)
 
+def create_post_turn(packager_llm: BaseChatModel):
+    """
+    Builds the job LLMHandler runs after a turn's answer is final and the thread lock is
+    released: follow-up questions for the answer and the rolling history summary, made
+    concurrently with packager_llm. The returned coroutine function takes (state, config)
+    and gives the state update to write, {} if there is none.
+    """
+    from .history import history_config, render_transcript, window_for_config, window_start
+    from .packager_cache import CachedStructuredOutput
+
+    follow_up_llm_with_schema = CachedStructuredOutput(packager_llm, FollowUpQuestions)
+
+    async def follow_ups(state: AgentState, config: RunnableConfig) -> dict:
+        last_ai_message = None
+        for m in reversed(state.messages):
+            if isinstance(m, AIMessage):
+                last_ai_message = m
+                break
+        if not last_ai_message or not last_ai_message.additional_kwargs.get("follow_ups_pending"):
+            return {}
+
+        logger.info("Generating follow-up questions")
+        window = window_for_config(state.messages, state.history_summary, config.get("configurable", {}).get("service_config"))
+        system_instruction = SystemMessage(content=f"You are a helpful assistant. Generate exactly 3 highly relevant follow-up questions the user might ask next based on the conversation history.{window.summary_section}")
+        relevant_history = [
+            m for m in window.messages
+            if isinstance(m, (HumanMessage, AIMessage, ToolMessage))
+        ]
+        messages = [system_instruction] + relevant_history
+
+        follow_up_usage = None
+        try:
+            raw_response = await follow_up_llm_with_schema.ainvoke(messages)
+        except Exception as e:
+            # The answer stands without suggestions; the pending flag is still cleared
+            logger.error(f"Failed to generate follow-up questions: {e}")
+            raw_response = None
+
+        if isinstance(raw_response, dict) and "parsed" in raw_response:
+            response_follow_ups = raw_response["parsed"]
+            follow_up_usage = raw_response["raw"].usage_metadata if hasattr(raw_response["raw"], 'usage_metadata') else None
+        else:
+            response_follow_ups = raw_response
+
+        updated_kwargs = last_ai_message.additional_kwargs.copy()
+        updated_kwargs.pop("follow_ups_pending", None)
+        if hasattr(response_follow_ups, "follow_up_questions") and response_follow_ups.follow_up_questions:
+            updated_kwargs["follow_up_questions"] = response_follow_ups.follow_up_questions
+
+        total_usage = merge_usage_metadata(last_ai_message.usage_metadata, follow_up_usage)
+        logger.info(f"FollowUp: Final combined usage: {total_usage}")
+        updated_msg = AIMessage(
+            content=last_ai_message.content,
+            id=last_ai_message.id,
+            tool_calls=getattr(last_ai_message, 'tool_calls', []),
+            additional_kwargs=updated_kwargs,
+            usage_metadata=total_usage or None
+        )
+        return {"messages": [updated_msg]}
+
+    async def summarise_history(state: AgentState, config: RunnableConfig) -> dict:
+        """Folds the turns that will leave the next call's history window into the rolling summary."""
+        history = history_config(config.get("configurable", {}).get("service_config"))
+        if not history.summarise:
+            return {}
+
+        upto = window_start(state.messages, history.keep_turns - 1)
+        covered = state.history_summary.messages if state.history_summary else 0
+        if upto <= covered:
+            return {}
+
+        logger.info(f"Summarising history messages {covered} to {upto}")
+        previous = state.history_summary.text if state.history_summary else "(none)"
+        transcript = render_transcript(state.messages[covered:upto], history.max_tool_message_tokens)
+        system_instruction = SystemMessage(content="You maintain a running summary of a conversation between a user and an AI assistant. Update the summary with the new messages, keeping the facts, figures, names, decisions and open questions the assistant may need later. Reply with the updated summary only.")
+        request = HumanMessage(content=f"Current summary:\n{previous}\n\nNew messages:\n{transcript}")
+        try:
+            response = await packager_llm.ainvoke([system_instruction, request])
+        except Exception as e:
+            # The turns stay in the window and are summarised after the next turn
+            logger.error(f"Failed to summarise history: {e}")
+            return {}
+
+        return {"history_summary": HistorySummary(text=chunk_text(response).strip(), messages=upto)}
+
+    async def post_turn(state: AgentState, config: RunnableConfig) -> dict:
+        update = {}
+        for part in await asyncio.gather(follow_ups(state, config), summarise_history(state, config)):
+            update.update(part)
+        return update
+
+    return post_turn
+
 def llm_model(config: LangchainConfig):
     httpx_client = httpx.Client(verify=config.httpx_verify_ssl)
 
@@ -464,6 +649,7 @@ def llm_model(config: LangchainConfig):
             model = ChatGoogleGenerativeAI(
                 model=config.model,
                 google_api_key=config.google_api_key.get_secret_value(),
+                disable_streaming=not config.streaming,
             )
         case "azure_openai":
             from langchain_openai import AzureChatOpenAI
@@ -475,6 +661,7 @@ def llm_model(config: LangchainConfig):
                 api_version=config.azure_api_version,
                 api_key=config.azure_api_key.get_secret_value() if config.azure_api_key else None,
                 http_client=httpx_client,
+                disable_streaming=not config.streaming,
             )
         case "ollama":
             from langchain_ollama import ChatOllama
@@ -488,6 +675,7 @@ def llm_model(config: LangchainConfig):
             model = ChatOllama(
                 model=config.model,
                 base_url=str(config.ollama_base_url),
+                disable_streaming=not config.streaming,
                 # stop=["<|im_start|>", "<|im_end|>"]
             )
         case _:
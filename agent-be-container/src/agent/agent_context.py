@@ -0,0 +1,111 @@
+import logging
+import math
+import re
+from collections import Counter
+from .agent_store import split_definition
+from .structs import AgentContext
+
+logger = logging.getLogger(__name__)
+
+# Rough characters per token for English prose; close enough to budget a prompt section
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+_WORD = re.compile(r"\w{3,}")
+_STOP_WORDS = frozenset(
+    "the and for are was were what which who whom how why when where this that these those with from "
+    "you your can could would should will about into have has had not but then than them they their "
+    "there its our out all any some more most also just please show tell give does did".split()
+)
+
+
+def _terms(text: str) -> Counter:
+    return Counter(w for w in _WORD.findall(text.casefold()) if w not in _STOP_WORDS)
+
+
+def text_similarity(a: str, b: str) -> float:
+    """Cosine similarity of the two texts' content-word counts; a topic-drift measure that needs no embedding."""
+    ta, tb = _terms(a), _terms(b)
+    if not ta or not tb:
+        return 0.0
+    dot = sum(ta[w] * tb[w] for w in ta.keys() & tb.keys())
+    return dot / math.sqrt(sum(v * v for v in ta.values()) * sum(v * v for v in tb.values()))
+
+
+def is_on_topic(context: AgentContext | None, message: str, threshold: float) -> bool:
+    """
+    True if context can be reused for message: it was retrieved for a message whose
+    text_similarity to this one is at least threshold. Drift is measured against the
+    message the context was retrieved for, not the previous one, so a conversation
+    cannot wander away one small step at a time.
+    """
+    return context is not None and text_similarity(message, context.query) >= threshold
+
+
+def context_budget(service_config) -> int:
+    """Token budget for injected agent context: a fraction of the main model's context length."""
+    fraction = service_config.embedding_client.context_budget_fraction
+    return int(service_config.main_aiclient.context_length * fraction)
+
+
+def _chunk_score(chunk: dict) -> float:
+    if chunk.get("similarity") is not None:
+        return chunk["similarity"]
+    return chunk.get("rank") or 0.0
+
+
+def assemble_agent_context(results: list[dict], min_similarity: float, token_budget: int) -> AgentContext:
+    """
+    Builds the agent context section from search results.
+
+    Only the top result is used. min_similarity is a cosine threshold, so it only applies
+    to scores from the vector search: a result found by full-text search alone (with a
+    rank but no similarity) is trusted by its place in the ranking. The matching chunks
+    are taken best first while they fit in token_budget (the heading included), then
+    emitted in document order. A result without matching chunks (an agent asked for by
+    name) offers its whole definition, chunk by chunk.
+    """
+    if not results:
+        return AgentContext()
+    top = results[0]
+    if top.get("similarity") is not None and top["similarity"] < min_similarity:
+        return AgentContext()
+
+    chunks = top.get("chunks") or [
+        {"index": index, "content": content}
+        for index, content in enumerate(split_definition(top["full_content"]))
+    ]
+
+    heading = f"\n\n### Relevant Agent Context ({top['name']}):\n"
+    used = estimate_tokens(heading)
+    selected = []
+    # Chunks of one result all come from the same search; unscored ones keep document order
+    for chunk in sorted(chunks, key=_chunk_score, reverse=True):
+        if chunk.get("similarity") is not None and chunk["similarity"] < min_similarity:
+            break
+        # One extra token for the blank line joining it to its neighbour
+        tokens = estimate_tokens(chunk["content"]) + 1
+        if used + tokens > token_budget:
+            continue
+        selected.append(chunk)
+        used += tokens
+
+    if not selected:
+        logger.info(f"No chunk of agent '{top['name']}' fits the {token_budget} token context budget")
+        return AgentContext()
+
+    selected.sort(key=lambda c: c["index"])
+    text = heading + "\n\n".join(c["content"] for c in selected)
+    return AgentContext(
+        agent_id=top["id"],
+        agent_name=top["name"],
+        similarity=top.get("similarity"),
+        chunk_indexes=[c["index"] for c in selected],
+        text=text,
+        tokens=estimate_tokens(text),
+        chunks=len(selected),
+    )
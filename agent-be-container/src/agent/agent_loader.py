@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable
+from ..config import ServiceConfig
+from ..database import get_db_pool
+from .agent_store import (
+    content_hash,
+    embed_changed_chunks,
+    get_agent_hashes,
+    get_chunk_hashes,
+    retrieval_cache,
+    write_agent_definitions,
+)
+from .embeddings import get_embedding_service
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class LoadStats:
+    scanned: int = 0
+    skipped: int = 0
+    loaded: int = 0
+    chunks: int = 0
+    embedded: int = 0
+    failed: list[str] = field(default_factory=list)
+    started: float = field(default_factory=time.perf_counter)
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def summary(self) -> str:
+        elapsed = max(self.elapsed, 1e-9)
+        return (
+            f"{self.loaded} loaded, {self.skipped} unchanged, {len(self.failed)} failed of {self.scanned} files "
+            f"in {self.elapsed:.1f}s ({self.loaded / elapsed:.1f} files/s, {self.chunks / elapsed:.1f} chunks/s, "
+            f"{self.embedded} of {self.chunks} chunks embedded)"
+        )
+
+
+class RateLimiter:
+    """Spaces calls so that at most rate start per second; rate <= 0 disables the limit."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+                now = self._next
+            self._next = now + self.interval
+
+
+async def load_agent_library(
+    directory: Path,
+    config: ServiceConfig,
+    concurrency: int = 4,
+    rate_limit: float = 0,
+    batch_size: int = 20,
+    pattern: str = "*.md",
+    progress: Callable[[LoadStats], None] | None = None,
+) -> LoadStats:
+    """
+    Loads every file matching pattern under directory as an agent definition named after the file stem.
+
+    Files whose content hash matches the stored definition are skipped. Changed files have
+    only their changed chunks embedded, concurrently (at most concurrency at once, starting at most rate_limit per
+    second) and written batch_size at a time, each batch in its own transaction. A batch
+    is committed with its hashes, so re-running after a failure resumes where it stopped.
+    """
+    stats = LoadStats()
+    existing = await get_agent_hashes()
+
+    pending = []
+    seen: dict[str, Path] = {}
+    for path in sorted(directory.rglob(pattern)):
+        if not path.is_file():
+            continue
+        stats.scanned += 1
+        name = path.stem
+        if name in seen:
+            logger.warning(f"Skipping {path}: agent name '{name}' already used by {seen[name]}")
+            stats.failed.append(str(path))
+            continue
+        seen[name] = path
+
+        content = path.read_text(encoding="utf-8")
+        digest = content_hash(content)
+        current = existing.get(name)
+        if current and current["content_hash"] == digest:
+            stats.skipped += 1
+            continue
+        pending.append({
+            "id": current["id"] if current else str(uuid.uuid4()),
+            "name": name,
+            "content": content,
+            "content_hash": digest,
+            "path": path,
+        })
+
+    logger.info(f"{len(pending)} of {stats.scanned} agent definitions need loading")
+    stored_chunks = await get_chunk_hashes([d["id"] for d in pending if d["name"] in existing])
+    embedding_service = get_embedding_service(config.embedding_client)
+    limiter = RateLimiter(rate_limit)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def embed(definition: dict) -> dict:
+        async with semaphore:
+            await limiter.wait()
+            try:
+                stats.embedded += await embed_changed_chunks(definition, stored_chunks.get(definition["id"], {}), embedding_service)
+            except Exception as e:
+                # Only this file is lost; it is picked up again on the next run
+                logger.error(f"Failed to embed {definition['path']}: {e}")
+                definition["error"] = e
+            return definition
+
+    pool = await get_db_pool()
+
+    async def write(batch: list[dict]) -> None:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await write_agent_definitions(conn, batch)
+        retrieval_cache.invalidate()
+        stats.loaded += len(batch)
+        stats.chunks += sum(len(d["chunks"]) for d in batch)
+        if progress:
+            progress(stats)
+
+    tasks = [asyncio.create_task(embed(definition)) for definition in pending]
+    batch: list[dict] = []
+    try:
+        for task in asyncio.as_completed(tasks):
+            definition = await task
+            if "error" in definition:
+                stats.failed.append(str(definition["path"]))
+                continue
+            batch.append(definition)
+            if len(batch) >= batch_size:
+                await write(batch)
+                batch = []
+        if batch:
+            await write(batch)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    return stats
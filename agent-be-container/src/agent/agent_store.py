@@ -1,70 +1,227 @@
+import hashlib
 import logging
+import re
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
 from ..database import get_db_pool
-from .embeddings import get_embeddings_model
+from .embeddings import get_embedding_service
+from .response_cache import invalidate_agents
 import uuid
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from ..config import ServiceConfig
 
 logger = logging.getLogger(__name__)
 
-async def save_agent_definition(name: str, content: str, config: ServiceConfig, agent_id: str = None) -> str:
-    """
-    Chunks, embeds, and saves an agent definition to the database.
-    If agent_id is provided, it updates the existing agent (by deleting and re-inserting chunks).
+
+def normalize_query(query: str) -> str:
+    """Normalises query text so trivially different phrasings share a cache entry."""
+    return re.sub(r"\s+", " ", query).strip().strip("?!.,;:").strip().casefold()
+
+
+class RetrievalCache:
+    """LRU cache of search_agent_definitions results with a per-entry TTL.
+
+    Keys are (normalised query, limit). Any change to the store calls invalidate(), which
+    clears the entries and bumps a generation counter so that searches already in flight
+    do not repopulate the cache with pre-change results. Other replicas only see the
+    change once their entries expire.
     """
-    logger.info(f"Splitting content into chunks for agent: {name}")
+
+    def __init__(self, max_size: int = 256, ttl: timedelta = timedelta(minutes=10)):
+        self.max_size = max_size
+        self.ttl = ttl.total_seconds()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple[str, int], tuple[float, list[dict]]] = OrderedDict()
+
+    def configure(self, max_size: int, ttl: timedelta) -> None:
+        self.max_size = max_size
+        self.ttl = ttl.total_seconds()
+        self.invalidate()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: tuple[str, int]) -> list[dict] | None:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return [dict(result) for result in entry[1]]
+
+    def put(self, key: tuple[str, int], results: list[dict], generation: int) -> None:
+        if self.max_size <= 0 or generation != self.generation:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, [dict(result) for result in results])
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self) -> None:
+        self.generation += 1
+        self._entries.clear()
+
+
+retrieval_cache = RetrievalCache()
+
+
+class RetrievalCacheCollector(Collector):
+    """Prometheus collector reporting retrieval cache effectiveness at scrape time."""
+
+    def __init__(self, cache: RetrievalCache):
+        self.cache = cache
+
+    def collect(self):
+        hits = CounterMetricFamily("agent_retrieval_cache_hits", "Agent-definition searches served from the cache")
+        hits.add_metric([], self.cache.hits)
+        misses = CounterMetricFamily("agent_retrieval_cache_misses", "Agent-definition searches that queried the store")
+        misses.add_metric([], self.cache.misses)
+        lookups = self.cache.hits + self.cache.misses
+        ratio = GaugeMetricFamily("agent_retrieval_cache_hit_ratio", "Fraction of agent-definition searches served from the cache")
+        ratio.add_metric([], self.cache.hits / lookups if lookups else 0.0)
+        entries = GaugeMetricFamily("agent_retrieval_cache_entries", "Search results currently cached")
+        entries.add_metric([], len(self.cache))
+
+        yield hits
+        yield misses
+        yield ratio
+        yield entries
+
+def split_definition(content: str) -> list[str]:
+    """Splits an agent definition into the chunks that are embedded and searched."""
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=1000,
         chunk_overlap=200,
         length_function=len,
         is_separator_regex=False,
     )
-    chunks = text_splitter.split_text(content)
-    logger.info(f"Created {len(chunks)} chunks")
+    return text_splitter.split_text(content)
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+async def get_chunk_hashes(agent_ids: list[str]) -> dict[str, dict[str, list[str]]]:
+    """Returns, per agent, the ids of its stored chunks grouped by chunk content hash."""
+    if not agent_ids:
+        return {}
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT id, agent_id, content_hash FROM agent_definition_chunks WHERE agent_id = ANY($1::uuid[]) AND content_hash IS NOT NULL",
+            agent_ids
+        )
+    existing: dict[str, dict[str, list[str]]] = {}
+    for row in rows:
+        existing.setdefault(str(row["agent_id"]), {}).setdefault(row["content_hash"], []).append(str(row["id"]))
+    return existing
+
+async def embed_changed_chunks(definition: dict, existing: dict[str, list[str]], embedding_service) -> int:
+    """
+    Chunks definition["content"] and embeds only the chunks with no identical stored chunk.
+
+    existing maps chunk content hash to the agent's stored chunk ids. Sets chunks,
+    chunk_hashes, chunk_ids (the stored row kept for each position, or None) and
+    embeddings (None for kept positions) on definition; returns the number embedded.
+    """
+    chunks = split_definition(definition["content"])
+    hashes = [content_hash(chunk) for chunk in chunks]
+
+    available = {h: list(ids) for h, ids in existing.items()}
+    chunk_ids = [available[h].pop() if available.get(h) else None for h in hashes]
 
-    embedding_model = get_embeddings_model(config.embedding_client)
-    logger.info("Generating embeddings for chunks...")
-    embeddings = embedding_model.embed_documents(chunks)
+    changed = [i for i, chunk_id in enumerate(chunk_ids) if chunk_id is None]
+    vectors = await embedding_service.embed_documents([chunks[i] for i in changed]) if changed else []
+    embeddings = [None] * len(chunks)
+    for i, vector in zip(changed, vectors):
+        embeddings[i] = vector
 
-    is_update = bool(agent_id)
+    definition.update(chunks=chunks, chunk_hashes=hashes, chunk_ids=chunk_ids, embeddings=embeddings)
+    return len(changed)
+
+async def write_agent_definitions(conn, definitions: list[dict]) -> None:
+    """
+    Upserts agent definitions and syncs their chunks using the caller's connection
+    (and transaction). Each definition is a dict prepared by embed_changed_chunks plus
+    id, name, content and content_hash. Kept chunks are only renumbered, stale ones
+    deleted and new ones copied in, and the agents' cached LLM answers are dropped; at
+    most five statements are issued per batch.
+    """
+    await conn.executemany(
+        """
+        INSERT INTO agent_definitions (id, name, content, content_hash)
+        VALUES ($1::uuid, $2, $3, $4)
+        ON CONFLICT (id) DO UPDATE
+        SET name = EXCLUDED.name, content = EXCLUDED.content, content_hash = EXCLUDED.content_hash
+        """,
+        [(d["id"], d["name"], d["content"], d["content_hash"]) for d in definitions]
+    )
+
+    kept_ids, kept_indexes, records = [], [], []
+    for d in definitions:
+        agent_uuid = uuid.UUID(d["id"])
+        for i, (chunk, chunk_hash, chunk_id, embedding) in enumerate(zip(d["chunks"], d["chunk_hashes"], d["chunk_ids"], d["embeddings"])):
+            if chunk_id:
+                kept_ids.append(uuid.UUID(chunk_id))
+                kept_indexes.append(i)
+            else:
+                records.append((uuid.uuid4(), agent_uuid, i, chunk, embedding, chunk_hash))
+
+    # Delete chunks whose text no longer appears in the updated definitions
+    await conn.execute(
+        "DELETE FROM agent_definition_chunks WHERE agent_id = ANY($1::uuid[]) AND NOT (id = ANY($2::uuid[]))",
+        [d["id"] for d in definitions], kept_ids
+    )
+
+    if kept_ids:
+        await conn.execute(
+            """
+            UPDATE agent_definition_chunks AS c SET chunk_index = kept.chunk_index
+            FROM unnest($1::uuid[], $2::int[]) AS kept(id, chunk_index)
+            WHERE c.id = kept.id AND c.chunk_index <> kept.chunk_index
+            """,
+            kept_ids, kept_indexes
+        )
+
+    # Insert new chunks with one binary COPY; embeddings use the pgvector codec registered on the pool
+    if records:
+        await conn.copy_records_to_table(
+            "agent_definition_chunks",
+            records=records,
+            columns=["id", "agent_id", "chunk_index", "content", "embedding", "content_hash"],
+        )
+
+    # Answers given with the old definitions' context are stale
+    await invalidate_agents(conn, [d["id"] for d in definitions])
+
+async def save_agent_definition(name: str, content: str, config: ServiceConfig, agent_id: str = None) -> str:
+    """
+    Chunks, embeds, and saves an agent definition to the database.
+    If agent_id is provided, it updates the existing agent, re-embedding only chunks whose text changed.
+    """
+    existing = (await get_chunk_hashes([agent_id])).get(agent_id, {}) if agent_id else {}
     if not agent_id:
         agent_id = str(uuid.uuid4())
 
+    definition = {"id": agent_id, "name": name, "content": content, "content_hash": content_hash(content)}
+    embedding_service = get_embedding_service(config.embedding_client)
+    logger.info(f"Chunking and embedding agent: {name}")
+    embedded = await embed_changed_chunks(definition, existing, embedding_service)
+    logger.info(f"Embedded {embedded} of {len(definition['chunks'])} chunks")
+
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         async with conn.transaction():
-            if is_update:
-                # Update existing record
-                await conn.execute(
-                    "UPDATE agent_definitions SET name = $1, content = $2 WHERE id = $3::uuid",
-                    name, content, agent_id
-                )
-                # Delete existing chunks to replace them
-                await conn.execute(
-                    "DELETE FROM agent_definition_chunks WHERE agent_id = $1::uuid",
-                    agent_id
-                )
-            else:
-                # Insert new record
-                await conn.execute(
-                    "INSERT INTO agent_definitions (id, name, content) VALUES ($1::uuid, $2, $3)",
-                    agent_id, name, content
-                )
-
-            # Insert chunks
-            for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-                chunk_id = str(uuid.uuid4())
-                # Format list as postgres vector string: "[1.0, 2.0, ...]"
-                embedding_str = "[" + ",".join(map(str, embedding)) + "]"
-
-                await conn.execute(
-                    """
-                    INSERT INTO agent_definition_chunks (id, agent_id, chunk_index, content, embedding)
-                    VALUES ($1::uuid, $2::uuid, $3, $4, $5::vector)
-                    """,
-                    chunk_id, agent_id, i, chunk, embedding_str
-                )
+            await write_agent_definitions(conn, [definition])
 
+    retrieval_cache.invalidate()
     logger.info(f"Successfully saved agent '{name}' with ID: {agent_id}")
     return agent_id
 
@@ -76,6 +233,7 @@ async def delete_agent_definition(agent_id: str) -> None:
             # Chunks should be deleted automatically if there's a cascade, but doing it explicitly just in case
             await conn.execute("DELETE FROM agent_definition_chunks WHERE agent_id = $1::uuid", agent_id)
             await conn.execute("DELETE FROM agent_definitions WHERE id = $1::uuid", agent_id)
+    retrieval_cache.invalidate()
 
 async def get_all_agent_definitions() -> list[dict]:
     """Retrieves all agent definitions (without chunks)."""
@@ -91,59 +249,215 @@ async def get_all_agent_definitions() -> list[dict]:
             for row in rows
         ]
 
-async def search_agent_definitions(query: str, config: ServiceConfig, limit: int = 5) -> list[dict]:
+async def get_agent_definition(agent_id: str, chunk_indexes: list[int]) -> dict | None:
     """
-    Embeds the search query and searches the agent_definition_chunks table
-    for the most relevant agent definitions using cosine similarity.
+    Fetches one agent definition by id with its stored chunks at chunk_indexes, shaped like
+    a search_agent_definitions result without scores. None if the agent no longer exists.
     """
-    logger.info(f"Searching agent definitions for query: {query}")
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow("SELECT id, name, content FROM agent_definitions WHERE id = $1::uuid", agent_id)
+        if row is None:
+            return None
+        chunks = await conn.fetch(
+            "SELECT chunk_index, content FROM agent_definition_chunks WHERE agent_id = $1::uuid AND chunk_index = ANY($2::int[]) ORDER BY chunk_index",
+            agent_id, chunk_indexes,
+        ) if chunk_indexes else []
+    return {
+        "id": str(row["id"]),
+        "name": row["name"],
+        "full_content": row["content"],
+        "chunks": [{"index": c["chunk_index"], "content": c["content"]} for c in chunks],
+    }
+
+async def get_agent_hashes() -> dict[str, dict]:
+    """Returns the id and content hash of the latest agent definition for each name."""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT DISTINCT ON (name) id, name, content_hash FROM agent_definitions ORDER BY name, created_at DESC"
+        )
+    return {row["name"]: {"id": str(row["id"]), "content_hash": row["content_hash"]} for row in rows}
+
+# Top-K nearest chunks via the HNSW index (ORDER BY distance LIMIT on the bare table),
+# then the candidate chunks grouped per agent, best first. The embedding is sent as a list
+# through the binary pgvector codec; $1::vector types the parameter.
+AGENT_SEARCH_SQL = """
+    WITH candidates AS (
+        SELECT agent_id, chunk_index, content AS chunk_content, embedding <=> $1::vector AS distance
+        FROM agent_definition_chunks
+        ORDER BY embedding <=> $1::vector
+        LIMIT $3
+    ), agent_chunks AS (
+        SELECT
+            agent_id,
+            min(distance) AS distance,
+            array_agg(chunk_index ORDER BY distance) AS chunk_indexes,
+            array_agg(chunk_content ORDER BY distance) AS chunk_contents,
+            array_agg(1 - distance ORDER BY distance) AS chunk_scores
+        FROM candidates
+        GROUP BY agent_id
+    )
+    SELECT
+        ad.id,
+        ad.name,
+        ad.content AS full_content,
+        ac.chunk_contents[1] AS top_chunk,
+        1 - ac.distance AS similarity,
+        ac.chunk_indexes,
+        ac.chunk_contents,
+        ac.chunk_scores
+    FROM agent_chunks ac
+    JOIN agent_definitions ad ON ad.id = ac.agent_id
+    ORDER BY ac.distance
+    LIMIT $2
+"""
 
-    # Get the embedding model
-    embedding_model = get_embeddings_model(config.embedding_client)
+# Agents whose name equals the normalised query ($2) or whose chunks match it as a
+# full-text query, matching chunks best first; ts_rank_cd normalisation 32 maps rank r to
+# r / (r + 1), into [0, 1), so 0.5 is a raw cover-density rank of 1
+LEXICAL_SEARCH_SQL = """
+    WITH q AS (
+        SELECT websearch_to_tsquery('english', $1) AS query
+    ), chunk_ranks AS (
+        SELECT c.agent_id, c.chunk_index, c.content, ts_rank_cd(c.content_tsv, q.query, 32) AS rank
+        FROM agent_definition_chunks c, q
+        WHERE c.content_tsv @@ q.query
+    ), chunk_hits AS (
+        SELECT
+            agent_id,
+            max(rank) AS rank,
+            array_agg(chunk_index ORDER BY rank DESC) AS chunk_indexes,
+            array_agg(content ORDER BY rank DESC) AS chunk_contents,
+            array_agg(rank ORDER BY rank DESC) AS chunk_scores
+        FROM chunk_ranks
+        GROUP BY agent_id
+    )
+    SELECT
+        ad.id,
+        ad.name,
+        ad.content AS full_content,
+        ch.chunk_contents[1] AS top_chunk,
+        COALESCE(ch.rank, 0) AS rank,
+        lower(ad.name) = $2 AS exact_name,
+        ch.chunk_indexes,
+        ch.chunk_contents,
+        ch.chunk_scores
+    FROM agent_definitions ad
+    LEFT JOIN chunk_hits ch ON ch.agent_id = ad.id
+    WHERE ch.agent_id IS NOT NULL OR lower(ad.name) = $2
+    ORDER BY exact_name DESC, rank DESC
+    LIMIT $3
+"""
+
+def _matched_chunks(row, score: str) -> list[dict]:
+    """The row's matching chunks, best first, as {index, content, <score>}."""
+    return [
+        {"index": index, "content": content, score: float(value)}
+        for index, content, value in zip(row["chunk_indexes"] or [], row["chunk_contents"] or [], row["chunk_scores"] or [])
+    ]
+
+def fuse_rankings(rankings: list[list[dict]], k: int, limit: int) -> list[dict]:
+    """
+    Reciprocal rank fusion: each agent scores sum(1 / (k + rank)) over the rankings it
+    appears in. Fields come from the first ranking that contains the agent; those it left
+    unscored (None) or empty are filled in from the later ones.
+    """
+    fused: dict[str, dict] = {}
+    for ranking in rankings:
+        for rank, result in enumerate(ranking, start=1):
+            entry = fused.get(result["id"])
+            if entry is None:
+                entry = fused[result["id"]] = {**result, "score": 0.0}
+            else:
+                for key, value in result.items():
+                    if entry.get(key) in (None, []):
+                        entry[key] = value
+            entry["score"] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda r: r["score"], reverse=True)[:limit]
+
+async def _lexical_search(conn, query: str, limit: int) -> list[dict]:
+    rows = await conn.fetch(LEXICAL_SEARCH_SQL, query, normalize_query(query), limit)
+    return [
+        {
+            "id": str(row["id"]),
+            "name": row["name"],
+            "full_content": row["full_content"],
+            "top_chunk": row["top_chunk"],
+            # Full-text rank has its own scale, so it is never reported as a cosine similarity
+            "similarity": None,
+            "rank": float(row["rank"]),
+            # An agent asked for by name is relevant as a whole, not just where the words match
+            "chunks": [] if row["exact_name"] else _matched_chunks(row, "rank"),
+            "exact_name": row["exact_name"],
+        }
+        for row in rows
+    ]
+
+async def _vector_search(conn, query_embedding: list[float], limit: int, candidates: int, ef_search: int) -> list[dict]:
+    async with conn.transaction():
+        # The index scan returns at most ef_search rows, so it must cover the candidate count;
+        # set_config(..., true) scopes the setting to this transaction
+        await conn.execute("SELECT set_config('hnsw.ef_search', $1, true)", str(max(ef_search, candidates)))
+        rows = await conn.fetch(AGENT_SEARCH_SQL, query_embedding, limit, candidates)
+    return [
+        {
+            "id": str(row["id"]),
+            "name": row["name"],
+            "full_content": row["full_content"],
+            "top_chunk": row["top_chunk"],
+            "similarity": float(row["similarity"]),
+            "rank": None,
+            "chunks": _matched_chunks(row, "similarity"),
+        }
+        for row in rows
+    ]
 
-    # Generate embedding for the query
-    query_embedding = embedding_model.embed_query(query)
+async def search_agent_definitions(query: str, config: ServiceConfig, limit: int = 5) -> list[dict]:
+    """
+    Searches agent definitions for the query, caching results per normalised query in retrieval_cache.
 
-    # Format the embedding as a string for pgvector insertion
-    embedding_str = "[" + ",".join(map(str, query_embedding)) + "]"
+    With hybrid_search, a full-text / agent-name lookup runs first; an exact name match
+    (or a full-text rank of at least lexical_skip_rank) is returned without embedding the
+    query. Otherwise the query is embedded, the nearest chunks are found by cosine
+    similarity, and both rankings are combined with reciprocal rank fusion. Each result
+    carries its matching chunks, best first, for agent_context.assemble_agent_context.
+
+    similarity is always a cosine similarity, None for an agent found only by full text or
+    name; rank is the normalised full-text rank, None if the agent matched no words; score
+    is the fusion score when both searches ran.
+    """
+    cache_key = (normalize_query(query), limit)
+    cached = retrieval_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"Agent definition search served from cache for query: {query}")
+        return cached
+    generation = retrieval_cache.generation
+
+    logger.info(f"Searching agent definitions for query: {query}")
+    search = config.embedding_client
+    candidates = max(search.search_candidates, limit)
 
-    # Search the database using cosine similarity (<=>)
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        # PostgreSQL STRICT TYPE CASTING is required for vector parameter in asyncpg ($1::vector)
-        sql_query = """
-            WITH ranked_chunks AS (
-                SELECT
-                    agent_id,
-                    content AS chunk_content,
-                    1 - (embedding <=> $1::vector) AS similarity,
-                    ROW_NUMBER() OVER(PARTITION BY agent_id ORDER BY embedding <=> $1::vector) as rn
-                FROM agent_definition_chunks
-            )
-            SELECT
-                ad.id,
-                ad.name,
-                ad.content AS full_content,
-                rc.chunk_content AS top_chunk,
-                rc.similarity
-            FROM ranked_chunks rc
-            JOIN agent_definitions ad ON ad.id = rc.agent_id
-            WHERE rc.rn = 1
-            ORDER BY rc.similarity DESC
-            LIMIT $2
-        """
+        lexical = await _lexical_search(conn, query, candidates) if search.hybrid_search else []
 
-        rows = await conn.fetch(sql_query, embedding_str, limit)
+    if lexical and (lexical[0]["exact_name"] or lexical[0]["rank"] >= search.lexical_skip_rank):
+        logger.info(f"Lexical match '{lexical[0]['name']}' is confident, skipping the embedding call")
+        results = lexical[:limit]
+    else:
+        # Generate embedding for the query; concurrent searches share a provider call
+        embedding_service = get_embedding_service(config.embedding_client)
+        query_embedding = await embedding_service.embed_query(query)
 
-        results = []
-        for row in rows:
-            results.append({
-                "id": str(row["id"]),
-                "name": row["name"],
-                "full_content": row["full_content"],
-                "top_chunk": row["top_chunk"],
-                "similarity": float(row["similarity"])
-            })
+        async with pool.acquire() as conn:
+            vector = await _vector_search(conn, query_embedding, candidates if lexical else limit, candidates, search.hnsw_ef_search)
+
+        results = fuse_rankings([vector, lexical], search.rrf_k, limit) if lexical else vector
+
+    for result in results:
+        result.pop("exact_name", None)
 
+    retrieval_cache.put(cache_key, results, generation)
     logger.info(f"Found {len(results)} matching agent definitions")
     return results
@@ -1,4 +1,13 @@
+import asyncio
+import hashlib
 import logging
+import random
+import time
+from typing import Callable
+import aiohttp
+import httpx
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, SummaryMetricFamily
+from prometheus_client.registry import Collector
 
 logger = logging.getLogger(__name__)
 
@@ -15,3 +24,235 @@ def get_embeddings_model(config):
         )
     else:
         raise ValueError(f"Unsupported embedding model provider: {model_provider}")
+
+
+# Extra arguments that make a provider's batch call embed texts as search queries
+QUERY_BATCH_KWARGS = {
+    "google_genai": {"task_type": "RETRIEVAL_QUERY"},
+}
+
+
+# Failures a retry can fix; anything else (bad credentials, invalid input) fails at once
+TRANSIENT_ERRORS = (TimeoutError, ConnectionError, aiohttp.ClientConnectionError, httpx.TimeoutException, httpx.NetworkError)
+
+
+def is_transient(error: BaseException) -> bool:
+    """
+    Whether a failed provider call may succeed when retried: a timeout, a connection error, or
+    an HTTP 408, 429 or 5xx response. Provider SDKs wrap the underlying error, so its causes
+    are checked too.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, TRANSIENT_ERRORS):
+            return True
+        for status in (getattr(error, "code", None), getattr(error, "status", None), getattr(error, "status_code", None),
+                       getattr(getattr(error, "response", None), "status_code", None)):
+            if isinstance(status, int) and (status in (408, 429) or 500 <= status < 600):
+                return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class EmbeddingService:
+    """Async front end to an embedding model shared by all requests on a replica.
+
+    Calls go through the model's aembed_* methods (LangChain runs synchronous models in a
+    thread pool), so the event loop is never blocked. Concurrent embed_query() calls made
+    within batch_window are sent as one provider call of up to max_batch_size texts.
+    Provider calls that fail transiently (see is_transient) are retried with exponential
+    backoff and jitter; other failures are raised at once.
+    """
+
+    def __init__(
+        self,
+        model,
+        max_batch_size: int = 64,
+        batch_window: float = 0.005,
+        max_retries: int = 3,
+        retry_backoff: float = 0.5,
+        query_batch_kwargs: dict | None = None,
+    ):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.query_batch_kwargs = query_batch_kwargs or {}
+
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+        # Per kind ("query"/"document"): provider calls, seconds spent, texts sent
+        self.calls: dict[str, int] = {"query": 0, "document": 0}
+        self.seconds: dict[str, float] = {"query": 0.0, "document": 0.0}
+        self.texts: dict[str, int] = {"query": 0, "document": 0}
+        self.errors = 0
+
+        # Health: provider calls that failed after all retries since the last success
+        self.consecutive_failures = 0
+        self.last_success_at: float | None = None
+
+    @classmethod
+    def from_config(cls, config) -> "EmbeddingService":
+        return cls(
+            get_embeddings_model(config),
+            max_batch_size=config.batch_size,
+            batch_window=config.batch_window.total_seconds(),
+            max_retries=config.max_retries,
+            retry_backoff=config.retry_backoff.total_seconds(),
+            query_batch_kwargs=QUERY_BATCH_KWARGS.get(config.model_provider),
+        )
+
+    async def embed_query(self, text: str) -> list[float]:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.batch_window, self._flush)
+        return await future
+
+    async def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        embeddings = []
+        for start in range(0, len(texts), self.max_batch_size):
+            batch = texts[start:start + self.max_batch_size]
+            embeddings.extend(await self._call("document", self.model.aembed_documents, batch))
+        return embeddings
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        while self._pending:
+            batch = self._pending[:self.max_batch_size]
+            self._pending = self._pending[self.max_batch_size:]
+            task = asyncio.create_task(self._run_query_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_query_batch(self, batch: list[tuple[str, asyncio.Future]]) -> None:
+        # Identical queries in the same window share one slot in the provider call
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            if len(texts) == 1:
+                vectors = [await self._call("query", self.model.aembed_query, texts[0])]
+            else:
+                vectors = await self._call("query", self._aembed_queries, texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        by_text = dict(zip(texts, vectors))
+        for text, future in batch:
+            if not future.done():
+                future.set_result(by_text[text])
+
+    async def _aembed_queries(self, texts: list[str]) -> list[list[float]]:
+        return await self.model.aembed_documents(texts, **self.query_batch_kwargs)
+
+    async def _call(self, kind: str, fn: Callable, arg):
+        size = len(arg) if isinstance(arg, list) else 1
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                result = await fn(arg)
+            except Exception as e:
+                self.errors += 1
+                if attempt >= self.max_retries or not is_transient(e):
+                    self.consecutive_failures += 1
+                    logger.error(f"Embedding {kind} call for {size} texts failed after {attempt + 1} attempts: {e}")
+                    raise
+                delay = self.retry_backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                logger.warning(f"Embedding {kind} call failed ({e}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+            else:
+                self.calls[kind] += 1
+                self.seconds[kind] += time.perf_counter() - started
+                self.texts[kind] += size
+                self.consecutive_failures = 0
+                self.last_success_at = time.time()
+                return result
+
+
+def config_key(config) -> tuple[str, str, str]:
+    """Identifies an EmbeddingConfig by provider, model and a digest of its credentials."""
+    secret = config.google_api_key.get_secret_value() if getattr(config, "google_api_key", None) else ""
+    return (config.model_provider, config.model, hashlib.sha256(secret.encode()).hexdigest()[:16])
+
+
+class EmbeddingRegistry:
+    """Process-wide EmbeddingServices, one per distinct EmbeddingConfig.
+
+    Each service owns a single provider client whose HTTP connections and credentials
+    are reused by every request on the replica. warm_up() is called from on_startup so
+    the first chat turn does not pay for client construction and the TLS/auth handshake.
+    """
+
+    def __init__(self):
+        self.services: dict[tuple[str, str, str], EmbeddingService] = {}
+
+    def get(self, config) -> EmbeddingService:
+        key = config_key(config)
+        service = self.services.get(key)
+        if service is None:
+            service = EmbeddingService.from_config(config)
+            self.services[key] = service
+        return service
+
+    async def warm_up(self, config) -> bool:
+        """Creates the client for config and makes one query call; failures are logged, not raised."""
+        service = self.get(config)
+        started = time.perf_counter()
+        try:
+            await service.embed_query("warm-up")
+        except Exception as e:
+            logger.warning(f"Embedding client for {config.model} failed to warm up: {e}")
+            return False
+        logger.info(f"Embedding client for {config.model} warmed up in {time.perf_counter() - started:.2f}s")
+        return True
+
+
+embedding_registry = EmbeddingRegistry()
+
+
+def get_embedding_service(config) -> EmbeddingService:
+    """Returns the replica's shared EmbeddingService for the given EmbeddingConfig."""
+    return embedding_registry.get(config)
+
+
+class EmbeddingServiceCollector(Collector):
+    """Prometheus collector reporting embedding latency, batch sizes, errors and client health at scrape time."""
+
+    def __init__(self, registry: EmbeddingRegistry = embedding_registry):
+        self.registry = registry
+
+    def collect(self):
+        latency = SummaryMetricFamily("embedding_latency_seconds", "Time spent in successful embedding provider calls", labels=["model", "kind"])
+        batch = SummaryMetricFamily("embedding_batch_size", "Texts sent per embedding provider call", labels=["model", "kind"])
+        errors = CounterMetricFamily("embedding_errors", "Failed embedding provider calls, including retried ones", labels=["model"])
+        up = GaugeMetricFamily("embedding_client_up", "1 if the client's last provider call succeeded", labels=["model"])
+        failures = GaugeMetricFamily("embedding_client_consecutive_failures", "Provider calls failed after all retries since the last success", labels=["model"])
+        last_success = GaugeMetricFamily("embedding_client_last_success_timestamp_seconds", "Unix time of the client's last successful provider call", labels=["model"])
+
+        for (_, model, _), service in self.registry.services.items():
+            for kind in ("query", "document"):
+                latency.add_metric([model, kind], service.calls[kind], service.seconds[kind])
+                batch.add_metric([model, kind], service.calls[kind], service.texts[kind])
+            errors.add_metric([model], service.errors)
+            up.add_metric([model], 1 if service.last_success_at is not None and service.consecutive_failures == 0 else 0)
+            failures.add_metric([model], service.consecutive_failures)
+            if service.last_success_at is not None:
+                last_success.add_metric([model], service.last_success_at)
+
+        yield latency
+        yield batch
+        yield errors
+        yield up
+        yield failures
+        yield last_success
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+def message_to_dict(m, max_tokens: int | None = None) -> dict:
+    """Serializes a LangChain message into the JSON shape served to the UI."""
+    msg_dict = {"type": m.type, "content": getattr(m, "content", "")}
+
+    if getattr(m, "id", None):
+        msg_dict["id"] = m.id
+
+    if hasattr(m, "name") and m.name:
+        msg_dict["name"] = m.name
+
+    if m.type == "tool":
+        tool_call_id = getattr(m, "tool_call_id", None)
+        if tool_call_id:
+            msg_dict["tool_call_id"] = tool_call_id
+
+    if hasattr(m, 'additional_kwargs') and m.additional_kwargs:
+        if "timestamp" in m.additional_kwargs:
+            msg_dict["created_at"] = m.additional_kwargs["timestamp"]
+        msg_dict["additional_kwargs"] = dict(m.additional_kwargs)
+
+    if m.type == "ai" and hasattr(m, "tool_calls") and m.tool_calls:
+        tool_calls = []
+        for tc in m.tool_calls:
+            tc_dict = {
+                "id": tc.get("id"),
+                "name": tc.get("name", "Unknown Tool"),
+                "args": tc.get("args", {})
+            }
+            tool_calls.append(tc_dict)
+
+        if "additional_kwargs" not in msg_dict:
+            msg_dict["additional_kwargs"] = {}
+        msg_dict["additional_kwargs"]["tool_calls"] = tool_calls
+
+    if hasattr(m, 'usage_metadata') and m.usage_metadata:
+        usage = dict(m.usage_metadata)
+        if max_tokens:
+            usage["max_tokens"] = max_tokens
+        msg_dict["usage_metadata"] = usage
+
+    return msg_dict
+
+
+def chunk_text(chunk) -> str:
+    """Extracts the text delta from an AIMessageChunk (string or content-block list)."""
+    content = getattr(chunk, "content", "")
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        parts = []
+        for block in content:
+            if isinstance(block, str):
+                parts.append(block)
+            elif isinstance(block, dict) and block.get("type") == "text":
+                parts.append(block.get("text", ""))
+        return "".join(parts)
+    return ""
+
+
+def format_sse(event: str, data: Any) -> bytes:
+    """Encodes a single Server-Sent Events frame."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n".encode("utf-8")
+
+
+class ThreadEventBroker:
+    """In-process fan-out of live graph progress events to per-thread subscribers.
+
+    Events are (event, data) tuples. A turn is bracketed by start() and finish(), which
+    comes after any post-turn job has published its follow-up questions; finish()
+    publishes a terminal "done" event so subscribers know to disconnect.
+    Token deltas of the answer being generated are also buffered per thread so that
+    late subscribers and history polls can show the partial content.
+    Only runs executing on this replica are visible here.
+    """
+
+    def __init__(self):
+        self._subscribers: dict[str, set[asyncio.Queue]] = defaultdict(set)
+        self._active: set[str] = set()
+        self._partials: dict[str, dict] = {}
+
+    def start(self, thread_id: str) -> None:
+        self._active.add(thread_id)
+
+    def is_active(self, thread_id: str) -> bool:
+        return thread_id in self._active
+
+    def subscribe(self, thread_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers[thread_id].add(queue)
+        return queue
+
+    def unsubscribe(self, thread_id: str, queue: asyncio.Queue) -> None:
+        subscribers = self._subscribers.get(thread_id)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[thread_id]
+
+    def publish(self, thread_id: str, event: str, data: dict) -> None:
+        for queue in self._subscribers.get(thread_id, ()):
+            queue.put_nowait((event, data))
+
+    def append_partial(self, thread_id: str, message_id: str, delta: str) -> None:
+        """Buffers a token delta, starting a fresh buffer when a new LLM call begins."""
+        partial = self._partials.get(thread_id)
+        if partial is None or partial["id"] != message_id:
+            partial = {"id": message_id, "chunks": []}
+            self._partials[thread_id] = partial
+        partial["chunks"].append(delta)
+
+    def get_partial(self, thread_id: str) -> dict | None:
+        partial = self._partials.get(thread_id)
+        if partial is None:
+            return None
+        return {"id": partial["id"], "content": "".join(partial["chunks"])}
+
+    def clear_partial(self, thread_id: str) -> None:
+        self._partials.pop(thread_id, None)
+
+    def finish(self, thread_id: str) -> None:
+        self._active.discard(thread_id)
+        self.clear_partial(thread_id)
+        self.publish(thread_id, "done", {"thread_id": thread_id})
@@ -1,16 +1,25 @@
 import logging
 import json
 from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
-from . import create_agent
+from . import create_agent, create_post_turn
 from typing import Optional
 from contextlib import AsyncExitStack
 import asyncio
+import os
+import socket
 import uuid
+from datetime import timedelta
 from datetime import datetime, timezone
 from psycopg_pool import AsyncConnectionPool
 from psycopg.rows import dict_row
 from langchain_core.language_models.fake_chat_models import FakeListChatModel
 from ..database import get_db_pool
+from .events import ThreadEventBroker, message_to_dict, chunk_text
+from .status import ThreadStatusBus
+from .scheduler import RunScheduler, RunSlot, RunRejected
+from .run_queue import RunQueue
+from .lease import ThreadLease
+from .structs import AgentState
 
 from langchain_core.messages import (
     HumanMessage,
@@ -35,9 +44,42 @@ class LLMHandler:
         self.packager_llm = packager_llm
 
         self.checkpointer: Optional[AsyncPostgresSaver] = None
+        self.pool: Optional[AsyncConnectionPool] = None
         self.agent = None
         self._exit_stack = AsyncExitStack()
-        self._background_tasks = set()
+        self.events = ThreadEventBroker()
+
+        flush_interval = service_config.events.statusFlushInterval.total_seconds() if service_config else 1.0
+        self.status = ThreadStatusBus(flush_interval=flush_interval)
+
+        if service_config:
+            self.scheduler = RunScheduler(
+                max_concurrent=service_config.events.maxChunks,
+                max_queued=service_config.events.maxQueued,
+                max_per_user=service_config.events.maxQueuedPerUser,
+            )
+        else:
+            self.scheduler = RunScheduler()
+
+        # Durable run tracking is enabled by initialize(), once the database is available
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.run_queue: Optional[RunQueue] = None
+        self.run_queue_interval = service_config.events.checkTime.total_seconds() if service_config else 5.0
+        self.run_lease_timeout = service_config.events.runLeaseTimeout if service_config else timedelta(seconds=30)
+        self.max_run_attempts = service_config.events.maxRunAttempts if service_config else 3
+        self.failed_run_retention = service_config.events.failedRunRetention if service_config else timedelta(days=7)
+        self._run_queue_task: Optional[asyncio.Task] = None
+
+        # Thread locks are short leases renewed by the same loop that heartbeats the run queue
+        self.lease = ThreadLease(self.worker_id, self.run_lease_timeout)
+        # Runs are tracked by run id, so a stale run can never act on a newer one's thread
+        self._runs: dict[str, asyncio.Task] = {}
+        self._thread_runs: dict[str, str] = {}
+        self._cancelled: set[str] = set()
+
+        # Follow-up questions and the history summary are made after the thread is released
+        self.post_turn = None
+        self._post_turns: dict[str, asyncio.Task] = {}
 
     async def initialize(self):
         """Initializes the checkpointer and compiles the agent exactly once."""
@@ -49,16 +91,30 @@ class LLMHandler:
             "row_factory": dict_row,
         }
 
+        # Sized from PersistenceConfig so the replica's total connections stay bounded
+        db_options = self.service_config.persistence.db if self.service_config else None
+        max_size = db_options.checkpoint_pool_size if db_options else 10
+        min_size = min(db_options.checkpoint_pool_min_size, max_size) if db_options else 1
+        timeout = db_options.acquire_timeout if db_options else 30
+
         pool = AsyncConnectionPool(
             conninfo=self.db_dsn,
-            max_size=20,
+            min_size=min_size,
+            max_size=max_size,
+            timeout=timeout,
             kwargs=pool_kwargs,
-            check=AsyncConnectionPool.check_connection
+            check=AsyncConnectionPool.check_connection,
+            open=False
         )
         await self._exit_stack.enter_async_context(pool)
+        self.pool = pool
         self.checkpointer = AsyncPostgresSaver(pool)
         await self.checkpointer.setup()
         self.agent = create_agent(self.main_llm, self.packager_llm, self.main_prompt, self.packager_prompt, self.checkpointer)
+        self.post_turn = create_post_turn(self.packager_llm)
+
+        self.run_queue = RunQueue(self.worker_id, self.run_lease_timeout, self.failed_run_retention)
+        self._run_queue_task = asyncio.create_task(self._run_queue_loop())
 
 
     # async def chat(self, thread_id: str, message: str) -> str:
@@ -69,11 +125,32 @@ class LLMHandler:
     #     agent_config = {"configurable": {"thread_id": thread_id}}
     #     final_res = await self.agent.ainvoke({"messages": [HumanMessage(content=message)]}, config=agent_config)
 
-    async def chat_async(self, thread_id: str, message: str, bypass_learning_mode: bool = False) -> None:
-        """Starts the chat agent in the background."""
+    async def chat_async(
+        self,
+        thread_id: str,
+        message: str,
+        bypass_learning_mode: bool = False,
+        user_id: str = "default-user",
+        slot: RunSlot | None = None,
+        run_id: str | None = None,
+        learning_mode_enabled: bool | None = None,
+    ) -> None:
+        """Starts the chat agent in the background.
+
+        The run is handed to the scheduler using the given slot, or a freshly reserved one;
+        RunRejected is raised if there is no capacity for it. run_id is the run queue row
+        already recorded at admission, if any. learning_mode_enabled initialises a new
+        thread's setting in the same checkpoint write as the message.
+        """
         if not self.agent:
             raise RuntimeError("LLMHandler is not initialized. Call initialize() first.")
 
+        if slot is None:
+            slot = self.scheduler.reserve(user_id)
+
+        # The previous turn's post-turn job would write over the new one's checkpoints
+        await self._cancel_post_turn(thread_id)
+
         agent_config = {
             "configurable": {
                 "thread_id": thread_id,
@@ -94,59 +171,316 @@ class LLMHandler:
         # Store the human message in the state immediately before starting background task
         # This ensures that history calls find the message even if the graph hasn't started yet.
         # We specify as_node="initial" to avoid "Ambiguous update" errors when manual updates are made.
-        await self.agent.aupdate_state(agent_config, {"messages": [msg]}, as_node="initial")
+        update = {"messages": [msg]}
+        if learning_mode_enabled is not None:
+            update["learning_mode_enabled"] = learning_mode_enabled
+        await self.agent.aupdate_state(agent_config, update, as_node="initial")
+
+        if run_id is None and self.run_queue:
+            run_id = await self.run_queue.enqueue(thread_id, user_id)
+        # Without a run queue the run still needs an id of its own
+        run_id = run_id or str(uuid.uuid4())
+
+        self.events.start(thread_id)
+        if not self.scheduler.has_free_worker():
+            self.status.set(thread_id, "Queued, waiting for capacity...")
+        self._thread_runs[thread_id] = run_id
+        slot.start(lambda: self._run_graph(thread_id, {"messages": [msg]}, run_id, user_id))
+
+    async def abandon_run(self, thread_id: str, run_id: str) -> None:
+        """Frees the lease and queue row of an admitted run that could not be started."""
+        if self._thread_runs.get(thread_id) == run_id:
+            del self._thread_runs[thread_id]
+        self.status.discard(thread_id)
+        if self.events.is_active(thread_id):
+            self.events.finish(thread_id)
+        await self._finish_run(thread_id, run_id)
+
+    async def _run_graph(self, thread_id: str, graph_input: dict | None, run_id: str, user_id: str | None = None):
+        """Executes the graph for a thread, streaming progress to subscribers.
+
+        graph_input None resumes from the last checkpoint. user_id, the user who asked, is
+        passed to the nodes in the configurable to scope what they cache. When the run is tracked in the
+        run queue it is completed at the end. If the task is cancelled by shutdown the
+        thread lease and queue row are left for another replica to resume; if it was
+        cancelled through cancel_run() both are released. A run cancelled while it was
+        still waiting for a worker returns at once: cancel_run() has already cleaned up
+        after it, and the thread may have a newer run by now.
+        """
+        if run_id in self._cancelled:
+            self._cancelled.discard(run_id)
+            return
 
-        async def _run_graph():
+        agent_config = {
+            "configurable": {
+                "thread_id": thread_id,
+                "user_id": user_id,
+                "service_config": self.service_config
+            }
+        }
+
+        def _set_status(status_msg: str | None):
+            # Held in memory and flushed to Postgres in batches by the status bus
+            self.status.set(thread_id, status_msg)
+            self.events.publish(thread_id, "status", {"status_msg": status_msg})
+
+        cancelled = False
+        completed = False
+        self._runs[run_id] = asyncio.current_task()
+        try:
+            # Use astream_events with the message to trigger the graph.
+            # De-duplication is handled by the 'add_messages' reducer because we use a fixed ID.
+            # version="v2" is the current standard for LangChain streaming
+            async for event in self.agent.astream_events(graph_input, config=agent_config, version="v2"):
+                kind = event["event"]
+                name = event.get("name", "unknown")
 
-            async def _set_status(status_msg: str | None):
-                try:
-                    pool = await get_db_pool()
-                    async with pool.acquire() as conn:
-                        await conn.execute("UPDATE threads SET status_msg = $1 WHERE thread_id = $2", status_msg, thread_id)
-                except Exception as e:
-                    logger.error(f"Failed to update status_msg for thread {thread_id}: {e}", exc_info=False)
+                if kind == "on_chat_model_stream":
+                    # Only the main answer is streamed; packager calls produce structured output
+                    if event.get("metadata", {}).get("langgraph_node") == "llm":
+                        delta = chunk_text(event["data"]["chunk"])
+                        if delta:
+                            stream_id = str(event.get("run_id"))
+                            self.events.append_partial(thread_id, stream_id, delta)
+                            self.events.publish(thread_id, "token", {"id": stream_id, "content": delta})
+                elif kind == "on_chain_start":
+                    if name == "LangGraph":
+                        logger.info(f"Thread {thread_id}: LangGraph execution started.")
+                        _set_status("Agent starting up...")
+                    else:
+                        logger.info(f"Thread {thread_id}: Node '{name}' started.")
+                        _set_status(f"Running: {name}...")
+                elif kind == "on_chain_end":
+                    if name == "LangGraph":
+                        logger.info(f"Thread {thread_id}: LangGraph execution finished.")
+                        output = event.get("data", {}).get("output")
+                        messages = output.get("messages") if isinstance(output, dict) else None
+                        if messages:
+                            max_tokens = getattr(getattr(self.service_config, "main_aiclient", None), "context_length", None)
+                            self.events.publish(thread_id, "message", message_to_dict(messages[-1], max_tokens))
+                    else:
+                        logger.info(f"Thread {thread_id}: Node '{name}' finished.")
+                        if name == "llm":
+                            # The finished AIMessage is now in the checkpoint, so drop the partial buffer
+                            self.events.clear_partial(thread_id)
+                elif kind == "on_tool_start":
+                    logger.info(f"Thread {thread_id}: Tool '{name}' started executing.")
+                    _set_status(f"Executing tool: {name}...")
+                elif kind == "on_tool_end":
+                    logger.info(f"Thread {thread_id}: Tool '{name}' finished executing.")
+            completed = True
 
+        except asyncio.CancelledError:
+            cancelled = run_id not in self._cancelled
+            if cancelled:
+                logger.info(f"Thread {thread_id}: run cancelled, leaving it for resumption.")
+            raise
+        except Exception as e:
+            logger.error(f"Error in background task for thread {thread_id}: {e}", exc_info=True)
+            err_msg = AIMessage(content=f"Oops! I encountered an error: {str(e)}", id=str(uuid.uuid4()))
+            await self.agent.aupdate_state(agent_config, {"messages": [err_msg]}, as_node="initial")
+            self.events.publish(thread_id, "message", message_to_dict(err_msg))
+        finally:
+            self._runs.pop(run_id, None)
+            self.status.discard(thread_id)
+            if run_id in self._cancelled:
+                self._cancelled.discard(run_id)
+                logger.info(f"Thread {thread_id}: run cancelled on request.")
+                self.events.publish(thread_id, "cancelled", {"thread_id": thread_id})
+            if not cancelled:
+                await self._finish_run(thread_id, run_id)
+            if self._thread_runs.get(thread_id) == run_id:
+                del self._thread_runs[thread_id]
+            if completed and self.post_turn:
+                # Subscribers stay connected for the follow-up questions; the job finishes the stream
+                self._start_post_turn(thread_id)
+            else:
+                self.events.finish(thread_id)
+
+    def _start_post_turn(self, thread_id: str) -> None:
+        task = asyncio.create_task(self._run_post_turn(thread_id))
+        self._post_turns[thread_id] = task
+
+        def _forget(t: asyncio.Task):
+            if self._post_turns.get(thread_id) is t:
+                del self._post_turns[thread_id]
+
+        task.add_done_callback(_forget)
+
+    async def _cancel_post_turn(self, thread_id: str) -> None:
+        task = self._post_turns.get(thread_id)
+        if task:
+            task.cancel()
+            await asyncio.wait({task})
+
+    async def _run_post_turn(self, thread_id: str) -> None:
+        """Generates and attaches follow-up questions (and the history summary) for a finished turn.
+
+        Runs detached, after the answer is final and the thread lease released, so it adds
+        no latency to the turn. The result is written only if the lease can be taken again
+        and no checkpoint was added since it was read; otherwise a newer turn has started
+        and the result is dropped. The turn's event stream is finished here, after the
+        updated message is published, so that subscribers receive the follow-up questions.
+        A newer turn cancels and awaits the job before starting its own stream.
+        """
+        agent_config = {
+            "configurable": {
+                "thread_id": thread_id,
+                "service_config": self.service_config
+            }
+        }
+        try:
+            state = await self.agent.aget_state(agent_config)
+            if not state.values:
+                return
+            update = await self.post_turn(AgentState(**state.values), agent_config)
+            if not update:
+                return
+
+            if not await self.lease.acquire(thread_id):
+                logger.info(f"Thread {thread_id}: busy again, dropping follow-up questions.")
+                return
             try:
-                # Use astream_events with the message to trigger the graph.
-                # De-duplication is handled by the 'add_messages' reducer because we use a fixed ID.
-                # version="v2" is the current standard for LangChain streaming
-                async for event in self.agent.astream_events({"messages": [msg]}, config=agent_config, version="v2"):
-                    kind = event["event"]
-                    name = event.get("name", "unknown")
-
-                    if kind == "on_chain_start":
-                        if name == "LangGraph":
-                            logger.info(f"Thread {thread_id}: LangGraph execution started.")
-                            await _set_status("Agent starting up...")
-                        else:
-                            logger.info(f"Thread {thread_id}: Node '{name}' started.")
-                            await _set_status(f"Running: {name}...")
-                    elif kind == "on_chain_end":
-                        if name == "LangGraph":
-                            logger.info(f"Thread {thread_id}: LangGraph execution finished.")
-                        else:
-                            logger.info(f"Thread {thread_id}: Node '{name}' finished.")
-                    elif kind == "on_tool_start":
-                        logger.info(f"Thread {thread_id}: Tool '{name}' started executing.")
-                        await _set_status(f"Executing tool: {name}...")
-                    elif kind == "on_tool_end":
-                        logger.info(f"Thread {thread_id}: Tool '{name}' finished executing.")
+                latest = await self.agent.aget_state(agent_config)
+                if latest.config != state.config:
+                    logger.info(f"Thread {thread_id}: changed since the turn finished, dropping follow-up questions.")
+                    return
+                await self.agent.aupdate_state(agent_config, update, as_node="post_process")
+            finally:
+                await self._release_thread(thread_id)
+
+            max_tokens = getattr(getattr(self.service_config, "main_aiclient", None), "context_length", None)
+            for m in update.get("messages", []):
+                self.events.publish(thread_id, "message", message_to_dict(m, max_tokens))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Post-turn job failed for thread {thread_id}: {e}", exc_info=True)
+        finally:
+            self.events.finish(thread_id)
 
+    async def _release_thread(self, thread_id: str, run_id: str | None = None) -> None:
+        """Frees the thread's lease; given a run_id, only while that run is the thread's run here."""
+        current = self._thread_runs.get(thread_id)
+        if run_id is not None and current not in (None, run_id):
+            logger.warning(f"Thread {thread_id}: run {run_id} no longer owns the lease (now run {current}), not releasing it.")
+            return
+        try:
+            await self.lease.release(thread_id)
+        except Exception as e:
+            logger.error(f"Failed to release lock and status for thread {thread_id}: {e}", exc_info=True)
+
+    async def _finish_run(self, thread_id: str, run_id: str) -> None:
+        """Releases the lease held for run_id and removes the run from the run queue."""
+        await self._release_thread(thread_id, run_id)
+        if self.run_queue:
+            try:
+                await self.run_queue.complete(run_id)
             except Exception as e:
-                logger.error(f"Error in background task for thread {thread_id}: {e}", exc_info=True)
-                err_msg = AIMessage(content=f"Oops! I encountered an error: {str(e)}", id=str(uuid.uuid4()))
+                logger.error(f"Failed to complete run {run_id} for thread {thread_id}: {e}", exc_info=True)
+
+    async def _resume_run(self, run: dict) -> None:
+        """Resumes a run claimed from the run queue from its last checkpoint."""
+        run_id, thread_id = run["run_id"], run["thread_id"]
+
+        try:
+            slot = self.scheduler.reserve(run["user_id"])
+        except RunRejected:
+            await self.run_queue.requeue(run_id)
+            return
+
+        try:
+            agent_config = {
+                "configurable": {
+                    "thread_id": thread_id,
+                    "service_config": self.service_config
+                }
+            }
+
+            if run["attempts"] > self.max_run_attempts:
+                logger.error(f"Thread {thread_id}: run {run_id} abandoned after {run['attempts'] - 1} attempts.")
+                err_msg = AIMessage(content="Oops! I was interrupted too many times while answering. Please try again.", id=str(uuid.uuid4()))
                 await self.agent.aupdate_state(agent_config, {"messages": [err_msg]}, as_node="initial")
-            finally:
-                try:
-                    pool = await get_db_pool()
-                    async with pool.acquire() as conn:
-                        await conn.execute("UPDATE threads SET locked_until = NULL, status_msg = NULL WHERE thread_id = $1", thread_id)
-                except Exception as e:
-                    logger.error(f"Failed to release lock and status for thread {thread_id}: {e}", exc_info=True)
+                await self.run_queue.fail(run_id)
+                await self._release_thread(thread_id)
+                return
+
+            state = await self.agent.aget_state(agent_config)
+            if not state.next:
+                # The graph finished before the previous owner could mark the run complete
+                await self.run_queue.complete(run_id)
+                await self._release_thread(thread_id)
+                return
+
+            await self.lease.take_over(thread_id)
+
+            logger.info(f"Thread {thread_id}: resuming run {run_id} (attempt {run['attempts']}) at {state.next}.")
+            self.events.start(thread_id)
+            self._thread_runs[thread_id] = run_id
+            slot.start(lambda: self._run_graph(thread_id, None, run_id, run["user_id"]))
+        finally:
+            slot.release()
+
+    async def cancel_run(self, thread_id: str) -> bool:
+        """Stops the thread's run, wherever it executes.
+
+        A run on this replica is cancelled (or dropped if still waiting) and its lease
+        freed before this returns. A run on another replica is flagged in the run queue;
+        its owner stops it on its next heartbeat and only then frees the lease, so the
+        thread cannot take a new message while the old run is still executing. A lease is
+        only force-released when no run of the thread is left anywhere, e.g. when its
+        only run was waiting in the queue. Returns False if the thread had nothing to cancel.
+        """
+        if await self._cancel_local(thread_id):
+            return True
+        if not self.run_queue:
+            return await self.lease.force_release(thread_id)
+
+        dropped, flagged = await self.run_queue.cancel(thread_id)
+        if dropped and not flagged:
+            await self.lease.force_release(thread_id)
+        return bool(dropped or flagged)
 
-        task = asyncio.create_task(_run_graph())
-        self._background_tasks.add(task)
-        task.add_done_callback(self._background_tasks.discard)
+    async def _cancel_local(self, thread_id: str, run_id: str | None = None) -> bool:
+        """Cancels the thread's run on this replica (only if it is run_id, when given) and waits until it has let go of the thread."""
+        current = self._thread_runs.get(thread_id)
+        if current is None or run_id not in (None, current):
+            return False
+        self._cancelled.add(current)
+        task = self._runs.get(current)
+        if task:
+            task.cancel()
+            await asyncio.wait({task})
+            return True
+
+        # Still waiting for a worker: it returns as soon as it starts, so clean up for it now
+        del self._thread_runs[thread_id]
+        self.status.discard(thread_id)
+        logger.info(f"Thread {thread_id}: waiting run cancelled on request.")
+        self.events.publish(thread_id, "cancelled", {"thread_id": thread_id})
+        self.events.finish(thread_id)
+        await self._finish_run(thread_id, current)
+        return True
+
+    async def _run_queue_loop(self):
+        """Renews this replica's leases and runs, picks up queued or abandoned runs and purges dead ones."""
+        while True:
+            try:
+                await self.lease.renew()
+                for run in await self.run_queue.heartbeat():
+                    if not await self._cancel_local(run["thread_id"], run["run_id"]):
+                        # Owner of a cancelled run that is no longer executing here
+                        await self.run_queue.complete(run["run_id"])
+                for run in await self.run_queue.claim(self.scheduler.free_workers):
+                    await self._resume_run(run)
+                purged = await self.run_queue.purge()
+                if purged:
+                    logger.info(f"Purged {purged} failed or abandoned cancelled runs from the run queue.")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Run queue poll failed: {e}", exc_info=True)
+            await asyncio.sleep(self.run_queue_interval)
 
 
     async def get_thread_state(self, thread_id: str) -> dict:
@@ -165,5 +499,23 @@ class LLMHandler:
 
 
     async def close(self):
-        """Closes the checkpointer resources."""
+        """Closes the checkpointer resources, handing in-flight runs back to the run queue."""
+        if self._run_queue_task:
+            self._run_queue_task.cancel()
+            try:
+                await self._run_queue_task
+            except asyncio.CancelledError:
+                pass
+        await self.scheduler.cancel_all()
+        post_turns = list(self._post_turns.values())
+        for task in post_turns:
+            task.cancel()
+        if post_turns:
+            await asyncio.gather(*post_turns, return_exceptions=True)
+        if self.run_queue:
+            try:
+                await self.run_queue.release_all()
+            except Exception as e:
+                logger.error(f"Failed to release runs on shutdown: {e}", exc_info=True)
+        await self.status.close()
         await self._exit_stack.aclose()
@@ -0,0 +1,142 @@
+import json
+import logging
+import sys
+from dataclasses import dataclass, field
+from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage
+from ..config import HistoryConfig
+from .agent_context import CHARS_PER_TOKEN, estimate_tokens
+from .structs import HistorySummary
+
+logger = logging.getLogger(__name__)
+
+
+def message_tokens(m: BaseMessage) -> int:
+    content = m.content if isinstance(m.content, str) else json.dumps(m.content, default=str)
+    tokens = estimate_tokens(content)
+    for tc in getattr(m, "tool_calls", None) or []:
+        tokens += estimate_tokens(json.dumps(tc.get("args", {}), default=str))
+    return tokens
+
+
+def turn_starts(messages: list[BaseMessage]) -> list[int]:
+    """Indexes of the messages that begin each turn; a turn starts at a HumanMessage."""
+    starts = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    return starts
+
+
+def window_start(messages: list[BaseMessage], keep_turns: int) -> int:
+    """Index of the first message of the last keep_turns turns (len(messages) for none)."""
+    if keep_turns <= 0:
+        return len(messages)
+    starts = turn_starts(messages)
+    return starts[-keep_turns] if len(starts) > keep_turns else 0
+
+
+def trim_tool_message(m: ToolMessage, max_tokens: int) -> ToolMessage:
+    content = m.content if isinstance(m.content, str) else json.dumps(m.content, default=str)
+    limit = max_tokens * CHARS_PER_TOKEN
+    if len(content) <= limit:
+        return m
+    return ToolMessage(
+        content=f"{content[:limit]}\n[... {len(content) - limit} characters of tool output trimmed]",
+        tool_call_id=m.tool_call_id,
+        name=m.name,
+        id=m.id,
+    )
+
+
+@dataclass
+class HistoryWindow:
+    """The part of a thread's history sent to an LLM call, with its token accounting."""
+    messages: list[BaseMessage] = field(default_factory=list)
+    summary: str = ""
+    tokens_before: int = 0
+    tokens_after: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(0, self.tokens_before - self.tokens_after)
+
+    @property
+    def summary_section(self) -> str:
+        if not self.summary:
+            return ""
+        return f"\n\n### Earlier Conversation (summary):\n{self.summary}"
+
+
+def window_history(
+    messages: list[BaseMessage],
+    summary: HistorySummary | None,
+    keep_turns: int,
+    max_tool_tokens: int,
+    token_budget: int,
+    summarised: bool = True,
+) -> HistoryWindow:
+    """
+    Selects the history to send: the last keep_turns turns verbatim plus, if older turns
+    are being summarised, any the summary does not cover yet, with tool output of earlier turns cut to
+    max_tool_tokens. The current turn is never trimmed, since the model may need its tool
+    results verbatim. If the window still exceeds token_budget, its oldest turns are
+    dropped, always keeping the current one.
+    """
+    start = window_start(messages, keep_turns)
+    if summarised:
+        start = min(start, summary.messages if summary else 0)
+
+    current = turn_starts(messages)[-1] if messages else 0
+    window = [
+        trim_tool_message(m, max_tool_tokens) if isinstance(m, ToolMessage) and start + i < current else m
+        for i, m in enumerate(messages[start:])
+    ]
+
+    summary_text = summary.text if summary else ""
+    tokens = [message_tokens(m) for m in window]
+    used = sum(tokens) + estimate_tokens(summary_text)
+    if used > token_budget:
+        starts = [s - start for s in turn_starts(messages) if start < s <= current]
+        drop = 0
+        for s in starts:
+            if used <= token_budget:
+                break
+            used -= sum(tokens[drop:s])
+            drop = s
+        if drop:
+            logger.warning(f"History over its {token_budget} token budget; dropped its oldest {drop} messages")
+            window = window[drop:]
+
+    return HistoryWindow(
+        messages=window,
+        summary=summary_text,
+        tokens_before=sum(message_tokens(m) for m in messages),
+        tokens_after=used,
+    )
+
+
+def history_config(service_config) -> HistoryConfig:
+    return service_config.history if service_config else HistoryConfig()
+
+
+def window_for_config(messages: list[BaseMessage], summary: HistorySummary | None, service_config) -> HistoryWindow:
+    """window_history with the settings of service_config (defaults and no budget without one)."""
+    history = history_config(service_config)
+    budget = int(service_config.main_aiclient.context_length * history.budget_fraction) if service_config else sys.maxsize
+    return window_history(messages, summary, history.keep_turns, history.max_tool_message_tokens, budget, history.summarise)
+
+
+def render_transcript(messages: list[BaseMessage], max_tool_tokens: int) -> str:
+    """Plain-text transcript of messages for the summariser."""
+    lines = []
+    for m in messages:
+        if isinstance(m, ToolMessage):
+            lines.append(f"Tool ({m.name or 'tool'}): {trim_tool_message(m, max_tool_tokens).content}")
+        elif isinstance(m, HumanMessage):
+            lines.append(f"User: {m.content}")
+        elif m.type == "ai":
+            calls = ", ".join(tc.get("name", "") for tc in getattr(m, "tool_calls", None) or [])
+            if m.content:
+                lines.append(f"Assistant: {m.content}")
+            if calls:
+                lines.append(f"Assistant called tools: {calls}")
+    return "\n".join(lines)
@@ -0,0 +1,135 @@
+import logging
+from datetime import timedelta
+from ..database import get_db_pool
+
+logger = logging.getLogger(__name__)
+
+
+class ThreadLease:
+    """Short-lived, owner-tagged lock on a thread while a graph run is in progress.
+
+    The lease is held in threads.locked_until/locked_by and expires after timeout unless
+    the owning replica renews it; renew() extends every lease held by this replica with a
+    single UPDATE. A crashed replica therefore blocks its threads for at most one timeout.
+    A thread also stays busy while it has an unfinished run in run_queue, so an abandoned
+    run is resumed before the thread accepts another message.
+
+    Statements in a CTE share one snapshot, so a thread created by admit() is inserted with
+    the lease already held rather than relying on the lock UPDATE seeing the new row.
+    """
+
+    def __init__(self, worker_id: str, timeout: timedelta):
+        self.worker_id = worker_id
+        self.timeout = timeout
+
+    async def admit(self, conn, thread_id: str, user_id: str, title: str, run_id: str) -> dict:
+        """Admits a chat message in a single round-trip.
+
+        Checks the user may write to the thread (owner or thread_access), creates the thread
+        if it is new, takes the lease if it is free or expired, records the run in run_queue
+        and reads the user's learning mode default. Returns a dict with "allowed", "created",
+        "locked" and "learning_mode_enabled".
+        """
+        row = await conn.fetchrow(
+            """
+            WITH existing AS (
+                SELECT user_id FROM threads WHERE thread_id = $1
+            ), access AS (
+                SELECT (
+                    NOT EXISTS (SELECT 1 FROM existing)
+                    OR EXISTS (SELECT 1 FROM existing WHERE user_id = $2)
+                    OR EXISTS (SELECT 1 FROM thread_access WHERE thread_id = $1 AND user_id = $2)
+                ) AS allowed
+            ), created AS (
+                INSERT INTO threads (thread_id, user_id, title, locked_until, locked_by)
+                SELECT $1, $2, $3, NOW() + $4::interval, $5
+                WHERE NOT EXISTS (SELECT 1 FROM existing)
+                ON CONFLICT (thread_id) DO NOTHING
+                RETURNING thread_id
+            ), locked AS (
+                UPDATE threads
+                SET locked_until = NOW() + $4::interval, locked_by = $5
+                WHERE thread_id = $1
+                  AND (SELECT allowed FROM access)
+                  AND (locked_until IS NULL OR locked_until < NOW())
+                  AND NOT EXISTS (
+                      SELECT 1 FROM run_queue
+                      WHERE run_queue.thread_id = $1 AND run_queue.status IN ('queued', 'running')
+                  )
+                RETURNING thread_id
+            ), run AS (
+                INSERT INTO run_queue (run_id, thread_id, user_id, status, attempts, claimed_by, heartbeat_at)
+                SELECT $6::uuid, $1, $2, 'running', 1, $5, NOW()
+                WHERE EXISTS (SELECT 1 FROM created) OR EXISTS (SELECT 1 FROM locked)
+                RETURNING run_id
+            )
+            SELECT
+                (SELECT allowed FROM access) AS allowed,
+                EXISTS (SELECT 1 FROM created) AS created,
+                EXISTS (SELECT 1 FROM run) AS locked,
+                COALESCE((SELECT learning_mode_enabled FROM users WHERE user_id = $2), FALSE) AS learning_mode_enabled
+            """,
+            thread_id, user_id, title, self.timeout, self.worker_id, run_id
+        )
+        return dict(row)
+
+    async def acquire(self, thread_id: str) -> bool:
+        """Takes the lease if it is free and the thread has no unfinished run, as admit() would."""
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            result = await conn.execute(
+                """
+                UPDATE threads
+                SET locked_until = NOW() + $2::interval, locked_by = $3
+                WHERE thread_id = $1
+                  AND (locked_until IS NULL OR locked_until < NOW())
+                  AND NOT EXISTS (
+                      SELECT 1 FROM run_queue
+                      WHERE run_queue.thread_id = $1 AND run_queue.status IN ('queued', 'running')
+                  )
+                """,
+                thread_id, self.timeout, self.worker_id
+            )
+        return result != "UPDATE 0"
+
+    async def take_over(self, thread_id: str) -> None:
+        """Takes the lease unconditionally, e.g. when resuming a run claimed from the queue."""
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(
+                "UPDATE threads SET locked_until = NOW() + $2::interval, locked_by = $3 WHERE thread_id = $1",
+                thread_id, self.timeout, self.worker_id
+            )
+
+    async def renew(self) -> None:
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(
+                "UPDATE threads SET locked_until = NOW() + $2::interval WHERE locked_by = $1 AND locked_until IS NOT NULL",
+                self.worker_id, self.timeout
+            )
+
+    async def release(self, thread_id: str) -> None:
+        """Frees the lease and clears the status, if this replica still owns it."""
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE threads SET locked_until = NULL, locked_by = NULL, status_msg = NULL
+                WHERE thread_id = $1 AND locked_by = $2
+                """,
+                thread_id, self.worker_id
+            )
+
+    async def force_release(self, thread_id: str) -> bool:
+        """Frees the lease whoever holds it; returns True if the thread was locked."""
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            result = await conn.execute(
+                """
+                UPDATE threads SET locked_until = NULL, locked_by = NULL, status_msg = NULL
+                WHERE thread_id = $1 AND locked_until IS NOT NULL
+                """,
+                thread_id
+            )
+        return result != "UPDATE 0"
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Type
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+from pydantic import BaseModel
+from ..database import get_db_pool
+
+logger = logging.getLogger(__name__)
+
+
+def request_key(schema: Type[BaseModel], model: dict, messages: list[BaseMessage]) -> str:
+    """Hash of a structured-output request: the schema, the model's identifying parameters and the messages."""
+    request = {
+        "schema": schema.__name__,
+        "model": model,
+        "messages": [[m.type, m.content] for m in messages],
+    }
+    return hashlib.sha256(json.dumps(request, default=str, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class PackagerCache:
+    """Exact-match cache of packager structured outputs: an LRU in memory, optionally backed by Postgres.
+
+    Entries are the parsed output's model_dump(), keyed by request_key and kept for ttl.
+    The memory LRU holds at most max_size entries (0 disables the cache). With persist,
+    memory misses fall through to the packager_cache table, so replicas share results and
+    keep them across restarts; a failing table only costs a packager call.
+    """
+
+    def __init__(self, max_size: int = 0, ttl: timedelta = timedelta(hours=1), persist: bool = False):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persist = persist
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+
+    def configure(self, max_size: int, ttl: timedelta, persist: bool) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persist = persist
+        self._entries.clear()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remember(self, key: str, value: dict, expires: float) -> None:
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> dict | None:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] >= time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if entry is not None:
+            del self._entries[key]
+
+        if self.persist:
+            try:
+                pool = await get_db_pool()
+                async with pool.acquire() as conn:
+                    row = await conn.fetchrow(
+                        "SELECT value, EXTRACT(EPOCH FROM expires_at - NOW()) AS remaining FROM packager_cache WHERE key = $1 AND expires_at > NOW()",
+                        key,
+                    )
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Packager cache lookup failed: {e}")
+                row = None
+            if row is not None:
+                value = json.loads(row["value"])
+                self._remember(key, value, time.monotonic() + float(row["remaining"]))
+                self.db_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, schema: Type[BaseModel], value: dict) -> None:
+        self._remember(key, value, time.monotonic() + self.ttl.total_seconds())
+        if not self.persist:
+            return
+        try:
+            pool = await get_db_pool()
+            async with pool.acquire() as conn:
+                await conn.execute(
+                    """
+                    INSERT INTO packager_cache (key, schema, value, expires_at)
+                    VALUES ($1, $2, $3::jsonb, NOW() + $4::interval)
+                    ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, expires_at = EXCLUDED.expires_at
+                    """,
+                    key, schema.__name__, json.dumps(value), self.ttl,
+                )
+                await conn.execute("DELETE FROM packager_cache WHERE expires_at <= NOW()")
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Failed to store packager output in cache: {e}")
+
+
+packager_cache = PackagerCache()
+
+
+class CachedStructuredOutput:
+    """
+    packager_llm.with_structured_output(schema, include_raw=True) behind packager_cache.
+
+    ainvoke(messages) answers like the wrapped runnable, {"parsed": ..., "raw": ...}. A hit
+    is rebuilt from the cache with a raw message reporting zero usage, since no tokens
+    were spent on it. Only successfully parsed outputs are cached.
+    """
+
+    def __init__(self, packager_llm: BaseChatModel, schema: Type[BaseModel], cache: PackagerCache | None = None):
+        self.runnable = packager_llm.with_structured_output(schema, include_raw=True)
+        self.schema = schema
+        self.model = getattr(packager_llm, "_identifying_params", None)
+        self.cache = cache
+
+    async def ainvoke(self, messages: list[BaseMessage]):
+        cache = self.cache if self.cache is not None else packager_cache
+        if not cache.enabled:
+            return await self.runnable.ainvoke(messages)
+
+        key = request_key(self.schema, self.model, messages)
+        value = await cache.get(key)
+        if value is not None:
+            logger.info(f"Packager {self.schema.__name__} served from cache")
+            return {
+                "parsed": self.schema.model_validate(value),
+                "raw": AIMessage(content="", usage_metadata={"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}),
+                "parsing_error": None,
+            }
+
+        result = await self.runnable.ainvoke(messages)
+        parsed = result.get("parsed") if isinstance(result, dict) else result
+        if isinstance(parsed, self.schema):
+            await cache.put(key, self.schema, parsed.model_dump())
+        return result
+
+
+class PackagerCacheCollector(Collector):
+    """Prometheus collector reporting packager cache effectiveness at scrape time."""
+
+    def __init__(self, cache: PackagerCache = packager_cache):
+        self.cache = cache
+
+    def collect(self):
+        hits = CounterMetricFamily("packager_cache_hits", "Packager structured outputs served from the cache", labels=["tier"])
+        hits.add_metric(["memory"], self.cache.hits)
+        hits.add_metric(["postgres"], self.cache.db_hits)
+        misses = CounterMetricFamily("packager_cache_misses", "Packager structured outputs requested from the model")
+        misses.add_metric([], self.cache.misses)
+        errors = CounterMetricFamily("packager_cache_errors", "Failed packager cache table lookups and writes")
+        errors.add_metric([], self.cache.errors)
+        entries = GaugeMetricFamily("packager_cache_entries", "Packager outputs held in memory")
+        entries.add_metric([], len(self.cache))
+
+        yield hits
+        yield misses
+        yield errors
+        yield entries
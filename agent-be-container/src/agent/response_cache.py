@@ -0,0 +1,180 @@
+import hashlib
+import json
+import logging
+import re
+import uuid
+from dataclasses import dataclass
+from typing import Any
+from langchain_core.messages import AIMessage, BaseMessage
+from prometheus_client.core import CounterMetricFamily
+from prometheus_client.registry import Collector
+from ..config import ServiceConfig
+from ..database import get_db_pool
+from .embeddings import get_embedding_service
+
+logger = logging.getLogger(__name__)
+
+
+# Entries are narrowed to one user's prompt context by the btree index and then ranked
+# exactly; an HNSW scan ordered by distance would apply the context filter after the
+# nearest few rows and miss entries of rarer contexts. A few candidates are returned so
+# that one naming other entities than the question does not hide one that matches.
+LOOKUP_SQL = """
+    SELECT query, content, total_tokens, 1 - (embedding <=> $4::vector) AS similarity
+    FROM llm_response_cache
+    WHERE context_hash = $1 AND user_id = $2 AND agent_id IS NOT DISTINCT FROM $3::uuid AND expires_at > NOW()
+    ORDER BY embedding <=> $4::vector
+    LIMIT 5
+"""
+
+STORE_SQL = """
+    INSERT INTO llm_response_cache (id, context_hash, user_id, agent_id, query, embedding, content, total_tokens, expires_at)
+    VALUES ($1::uuid, $2, $3, $4::uuid, $5, $6::vector, $7::jsonb, $8, NOW() + $9::interval)
+"""
+
+# Words, keeping ids, dates and amounts like INV-2026-17, 2026-01-05 or 1.5 whole
+_TOKEN = re.compile(r"\w+(?:[.-]\w+)*")
+
+
+def entities(text: str) -> set[str]:
+    """The tokens of text with a digit in them. Embeddings barely tell "order 1234" from "order 1235"."""
+    return {token.casefold() for token in _TOKEN.findall(text) if any(c.isdigit() for c in token)}
+
+
+def context_hash(system_prompt: str, history: list[BaseMessage]) -> str:
+    """Hash of what an answer depends on besides the question: the system prompt and the messages before it."""
+    context = [system_prompt] + [[m.type, m.content, getattr(m, "tool_calls", None) or []] for m in history]
+    return hashlib.sha256(json.dumps(context, default=str, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CacheProbe:
+    """A response cache lookup for one question, kept so that a miss can store the answer."""
+    context_hash: str
+    user_id: str
+    agent_id: str | None
+    query: str
+    embedding: list[float]
+    content: Any = None
+    similarity: float = 0.0
+    total_tokens: int = 0
+
+    @property
+    def hit(self) -> bool:
+        return self.content is not None
+
+    def message(self) -> AIMessage:
+        """The cached answer as a new message; it cost no tokens this time."""
+        return AIMessage(
+            content=self.content,
+            id=str(uuid.uuid4()),
+            additional_kwargs={"response_cache": {"similarity": round(self.similarity, 4)}},
+            usage_metadata={
+                "input_tokens": 0,
+                "output_tokens": 0,
+                "total_tokens": 0,
+                "response_cache_tokens_saved": self.total_tokens,
+            },
+        )
+
+
+@dataclass
+class ResponseCacheStats:
+    hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    errors: int = 0
+
+
+response_cache_stats = ResponseCacheStats()
+
+
+async def lookup_response(system_prompt: str, messages: list[BaseMessage], agent_id: str | None, user_id: str | None, config: ServiceConfig) -> CacheProbe | None:
+    """
+    Looks up a cached answer to the last of messages, a question, asked by user_id with
+    system_prompt after the other messages. Answers are only shared with the user they were
+    given to, as they may hold that user's data. The context is the prompt and the last
+    response_cache.context_turns turns before the question, not the whole conversation, so
+    the same question from the same user hits in any thread that has just said the same.
+    A hit is the closest stored question in the same context with a cosine similarity of at
+    least response_cache.min_similarity that names the same entities (see entities()).
+    Returns None if the question cannot be cached (not plain text, no user) or the cache
+    cannot be reached; a turn never fails on it.
+    """
+    query = messages[-1].content
+    if not user_id or not isinstance(query, str) or not query.strip():
+        return None
+    # history imports agent_store, which imports this module
+    from .history import window_start
+    earlier = messages[:-1]
+    key = context_hash(system_prompt, earlier[window_start(earlier, config.response_cache.context_turns):])
+    try:
+        embedding = await get_embedding_service(config.embedding_client).embed_query(query)
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(LOOKUP_SQL, key, user_id, agent_id, embedding)
+    except Exception as e:
+        response_cache_stats.errors += 1
+        logger.warning(f"Response cache lookup failed: {e}")
+        return None
+
+    probe = CacheProbe(context_hash=key, user_id=user_id, agent_id=agent_id, query=query, embedding=embedding)
+    wanted = entities(query)
+    row = next((r for r in rows if entities(r["query"]) == wanted), None)
+    if row is not None and row["similarity"] >= config.response_cache.min_similarity:
+        probe.content = json.loads(row["content"])
+        probe.similarity = row["similarity"]
+        probe.total_tokens = row["total_tokens"]
+        response_cache_stats.hits += 1
+        logger.info(f"Response cache hit (similarity {probe.similarity:.3f}) for: {query}")
+    else:
+        response_cache_stats.misses += 1
+    return probe
+
+
+async def store_response(probe: CacheProbe, response: AIMessage, config: ServiceConfig) -> None:
+    """Stores response as the answer to probe's question. Answers that call tools are not cached."""
+    if response.tool_calls or not response.content:
+        return
+    usage = response.usage_metadata or {}
+    try:
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(
+                STORE_SQL,
+                str(uuid.uuid4()), probe.context_hash, probe.user_id, probe.agent_id, probe.query, probe.embedding,
+                json.dumps(response.content), usage.get("total_tokens", 0), config.response_cache.ttl,
+            )
+            await conn.execute("DELETE FROM llm_response_cache WHERE expires_at <= NOW()")
+    except Exception as e:
+        response_cache_stats.errors += 1
+        logger.warning(f"Failed to store response in cache: {e}")
+        return
+    response_cache_stats.stores += 1
+
+
+async def invalidate_agents(conn, agent_ids: list[str]) -> None:
+    """Drops the cached answers given with these agents' context, using the caller's connection."""
+    await conn.execute("DELETE FROM llm_response_cache WHERE agent_id = ANY($1::uuid[])", agent_ids)
+
+
+class ResponseCacheCollector(Collector):
+    """Prometheus collector reporting response cache effectiveness at scrape time."""
+
+    def __init__(self, stats: ResponseCacheStats = response_cache_stats):
+        self.stats = stats
+
+    def collect(self):
+        hits = CounterMetricFamily("llm_response_cache_hits", "Questions answered from the response cache")
+        hits.add_metric([], self.stats.hits)
+        misses = CounterMetricFamily("llm_response_cache_misses", "Questions sent to the main LLM after a cache lookup")
+        misses.add_metric([], self.stats.misses)
+        stores = CounterMetricFamily("llm_response_cache_stores", "Answers written to the response cache")
+        stores.add_metric([], self.stats.stores)
+        errors = CounterMetricFamily("llm_response_cache_errors", "Failed response cache lookups and writes")
+        errors.add_metric([], self.stats.errors)
+
+        yield hits
+        yield misses
+        yield stores
+        yield errors
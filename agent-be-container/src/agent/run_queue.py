@@ -0,0 +1,158 @@
+import logging
+import uuid
+from datetime import timedelta
+from ..database import get_db_pool
+
+logger = logging.getLogger(__name__)
+
+
+class RunQueue:
+    """Postgres-backed record of background graph runs.
+
+    Every accepted chat is written to run_queue already claimed by the accepting replica.
+    Replicas refresh heartbeat_at on all their runs with a single UPDATE per interval;
+    a run whose heartbeat is older than lease_timeout (its pod died) or that was requeued
+    on shutdown can be claimed by any replica with FOR UPDATE SKIP LOCKED and resumed
+    from the last LangGraph checkpoint. Finished runs are deleted; failed runs are kept for
+    failed_retention and cancelled runs whose owner stopped heartbeating are swept by purge().
+    """
+
+    def __init__(self, worker_id: str, lease_timeout: timedelta, failed_retention: timedelta = timedelta(days=7)):
+        self.worker_id = worker_id
+        self.lease_timeout = lease_timeout
+        self.failed_retention = failed_retention
+
+    async def enqueue(self, thread_id: str, user_id: str) -> str:
+        run_id = str(uuid.uuid4())
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO run_queue (run_id, thread_id, user_id, status, attempts, claimed_by, heartbeat_at)
+                VALUES ($1::uuid, $2, $3, 'running', 1, $4, NOW())
+                """,
+                run_id, thread_id, user_id, self.worker_id
+            )
+        return run_id
+
+    async def heartbeat(self) -> list[dict]:
+        """Refreshes this replica's runs; returns those cancelled from elsewhere so they can be stopped."""
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                UPDATE run_queue SET heartbeat_at = NOW()
+                WHERE claimed_by = $1 AND status IN ('running', 'cancelled')
+                RETURNING run_id, thread_id, status
+                """,
+                self.worker_id
+            )
+        return [
+            {"run_id": str(row["run_id"]), "thread_id": row["thread_id"]}
+            for row in rows
+            if row["status"] == "cancelled"
+        ]
+
+    async def claim(self, limit: int) -> list[dict]:
+        """Claims up to limit queued or abandoned runs for this replica."""
+        if limit <= 0:
+            return []
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                UPDATE run_queue
+                SET status = 'running', claimed_by = $1, heartbeat_at = NOW(), attempts = attempts + 1
+                WHERE run_id IN (
+                    SELECT run_id FROM run_queue
+                    WHERE status = 'queued'
+                       OR (status = 'running' AND heartbeat_at < NOW() - $2::interval)
+                    ORDER BY created_at
+                    LIMIT $3
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING run_id, thread_id, user_id, attempts
+                """,
+                self.worker_id, self.lease_timeout, limit
+            )
+        return [
+            {
+                "run_id": str(row["run_id"]),
+                "thread_id": row["thread_id"],
+                "user_id": row["user_id"],
+                "attempts": row["attempts"],
+            }
+            for row in rows
+        ]
+
+    async def complete(self, run_id: str) -> None:
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM run_queue WHERE run_id = $1::uuid", run_id)
+
+    async def fail(self, run_id: str) -> None:
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(
+                "UPDATE run_queue SET status = 'failed', claimed_by = NULL, finished_at = NOW() WHERE run_id = $1::uuid",
+                run_id
+            )
+
+    async def cancel(self, thread_id: str) -> tuple[int, int]:
+        """Drops the thread's waiting runs and flags claimed ones for their owner to stop.
+
+        Returns the number of runs (dropped, flagged).
+        """
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow(
+                """
+                WITH dropped AS (
+                    DELETE FROM run_queue WHERE thread_id = $1 AND status = 'queued' RETURNING 1
+                ), flagged AS (
+                    UPDATE run_queue SET status = 'cancelled' WHERE thread_id = $1 AND status = 'running' RETURNING 1
+                )
+                SELECT (SELECT COUNT(*) FROM dropped) AS dropped, (SELECT COUNT(*) FROM flagged) AS flagged
+                """,
+                thread_id
+            )
+        return row["dropped"], row["flagged"]
+
+    async def purge(self) -> int:
+        """Deletes failed runs past failed_retention and cancelled runs left behind by a dead owner.
+
+        A cancelled run is deleted by its owner once stopped; if the owner died first its heartbeat
+        goes stale and nobody else would. Returns the number of runs deleted.
+        """
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            return await conn.fetchval(
+                """
+                WITH purged AS (
+                    DELETE FROM run_queue
+                    WHERE (status = 'failed' AND finished_at < NOW() - $1::interval)
+                       OR (status = 'cancelled' AND heartbeat_at < NOW() - $2::interval)
+                    RETURNING 1
+                )
+                SELECT COUNT(*) FROM purged
+                """,
+                self.failed_retention, self.lease_timeout
+            )
+
+    async def requeue(self, run_id: str) -> None:
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(
+                "UPDATE run_queue SET status = 'queued', claimed_by = NULL WHERE run_id = $1::uuid AND claimed_by = $2",
+                run_id, self.worker_id
+            )
+
+    async def release_all(self) -> None:
+        """Hands every run owned by this replica back to the queue, e.g. on shutdown."""
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            result = await conn.execute(
+                "UPDATE run_queue SET status = 'queued', claimed_by = NULL WHERE claimed_by = $1 AND status = 'running'",
+                self.worker_id
+            )
+        logger.info(f"Released runs owned by {self.worker_id}: {result}")
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+from collections import Counter, deque
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class RunRejected(Exception):
+    """Raised when a run cannot be admitted; status is the HTTP code to answer with."""
+
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+class RunSlot:
+    """A reserved place in the scheduler, held from admission until the run is started.
+
+    Reserving early lets callers reject before doing any work; release() gives the place
+    back if the caller bails out, and is a no-op once start() has been called.
+    """
+
+    def __init__(self, scheduler: "RunScheduler", user_id: str):
+        self.scheduler = scheduler
+        self.user_id = user_id
+        self._done = False
+
+    def start(self, run: Callable[[], Awaitable[None]]) -> None:
+        if self._done:
+            raise RuntimeError("RunSlot has already been used")
+        self._done = True
+        self.scheduler._enqueue(self, run)
+
+    def release(self) -> None:
+        if not self._done:
+            self._done = True
+            self.scheduler._finish(self)
+
+
+class RunScheduler:
+    """Bounded executor for background graph runs.
+
+    At most max_concurrent runs execute at once; up to max_queued more wait, and no user
+    may hold more than max_per_user of either. Waiting runs are dispatched round-robin
+    across users so one busy user cannot starve the others.
+    """
+
+    def __init__(self, max_concurrent: int = 10, max_queued: int = 50, max_per_user: int = 3):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.max_per_user = max_per_user
+
+        self._admitted = 0
+        self._per_user: Counter[str] = Counter()
+        self._running = 0
+        self._pending: dict[str, deque] = {}
+        self._users: deque[str] = deque()
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def waiting(self) -> int:
+        """Runs admitted but not yet executing, including reserved slots not yet started."""
+        return self._admitted - self._running
+
+    @property
+    def free_workers(self) -> int:
+        """Workers that would start a newly admitted run straight away."""
+        return max(0, self.max_concurrent - self._admitted)
+
+    def has_free_worker(self) -> bool:
+        return self._running < self.max_concurrent and not self._users
+
+    def spareCapacity(self) -> bool:
+        """True while new runs can still be admitted; used by HaMS readiness."""
+        return self._admitted < self.max_concurrent + self.max_queued
+
+    def reserve(self, user_id: str) -> RunSlot:
+        if self._per_user[user_id] >= self.max_per_user:
+            raise RunRejected("Too many requests in progress for this user.", status=429)
+        if not self.spareCapacity():
+            raise RunRejected("Server is at capacity, please retry shortly.", status=503)
+
+        self._admitted += 1
+        self._per_user[user_id] += 1
+        return RunSlot(self, user_id)
+
+    def _enqueue(self, slot: RunSlot, run: Callable[[], Awaitable[None]]) -> None:
+        if slot.user_id not in self._pending:
+            self._pending[slot.user_id] = deque()
+            self._users.append(slot.user_id)
+        self._pending[slot.user_id].append((slot, run))
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._running < self.max_concurrent and self._users:
+            user_id = self._users.popleft()
+            queue = self._pending[user_id]
+            slot, run = queue.popleft()
+            if queue:
+                self._users.append(user_id)
+            else:
+                del self._pending[user_id]
+
+            self._running += 1
+            task = asyncio.create_task(self._execute(slot, run))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, slot: RunSlot, run: Callable[[], Awaitable[None]]) -> None:
+        try:
+            await run()
+        except Exception as e:
+            logger.error(f"Scheduled run for user {slot.user_id} failed: {e}", exc_info=True)
+        finally:
+            self._running -= 1
+            self._finish(slot)
+            self._dispatch()
+
+    async def cancel_all(self) -> None:
+        """Cancels executing runs and drops waiting ones, e.g. on shutdown."""
+        self._pending.clear()
+        self._users.clear()
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _finish(self, slot: RunSlot) -> None:
+        self._admitted -= 1
+        self._per_user[slot.user_id] -= 1
+        if self._per_user[slot.user_id] <= 0:
+            del self._per_user[slot.user_id]
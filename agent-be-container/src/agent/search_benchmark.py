@@ -0,0 +1,127 @@
+import logging
+import random
+import statistics
+import time
+from .agent_store import AGENT_SEARCH_SQL
+
+logger = logging.getLogger(__name__)
+
+BENCH_SCHEMA = "agent_search_bench"
+
+# The previous search: ranks every chunk with a window function, so it cannot use the HNSW index
+FULL_SCAN_SEARCH_SQL = """
+    WITH ranked_chunks AS (
+        SELECT
+            agent_id,
+            content AS chunk_content,
+            1 - (embedding <=> $1::vector) AS similarity,
+            ROW_NUMBER() OVER(PARTITION BY agent_id ORDER BY embedding <=> $1::vector) as rn
+        FROM agent_definition_chunks
+    )
+    SELECT ad.id, ad.name, ad.content AS full_content, rc.chunk_content AS top_chunk, rc.similarity
+    FROM ranked_chunks rc
+    JOIN agent_definitions ad ON ad.id = rc.agent_id
+    WHERE rc.rn = 1
+    ORDER BY rc.similarity DESC
+    LIMIT $2
+"""
+
+
+def _percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct * (len(ordered) - 1))))]
+
+
+async def _time_query(conn, sql: str, vector: list[float], limit: int, candidates: int, ef_search: int) -> float:
+    started = time.perf_counter()
+    async with conn.transaction():
+        await conn.execute("SELECT set_config('hnsw.ef_search', $1, true)", str(max(ef_search, candidates)))
+        args = (vector, limit, candidates) if "$3" in sql else (vector, limit)
+        await conn.fetch(sql, *args)
+    return (time.perf_counter() - started) * 1000
+
+
+async def run_search_benchmark(
+    conn,
+    sizes: list[int],
+    dimensions: int = 768,
+    agents: int = 500,
+    queries: int = 50,
+    baseline_queries: int = 5,
+    candidates: int = 40,
+    ef_search: int = 100,
+    limit: int = 1,
+    keep: bool = False,
+) -> list[dict]:
+    """
+    Measures agent search latency on synthetic chunk tables of increasing size.
+
+    A scratch schema with the same tables is filled with random vectors, grown
+    to each size in turn (the HNSW index is built once and then maintained), and both the
+    index-driven AGENT_SEARCH_SQL and the old full-scan query are timed. Returns one row
+    per size and query with p50/p95 latency in milliseconds.
+    """
+    results = []
+    await conn.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+    await conn.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+    await conn.execute(f"SET search_path = {BENCH_SCHEMA}, public")
+    try:
+        await conn.execute("""
+            CREATE TABLE agent_definitions (
+                id UUID PRIMARY KEY, name TEXT NOT NULL, content TEXT NOT NULL
+            )
+        """)
+        await conn.execute(f"""
+            CREATE TABLE agent_definition_chunks (
+                id UUID PRIMARY KEY, agent_id UUID NOT NULL, chunk_index INTEGER NOT NULL,
+                content TEXT NOT NULL, embedding vector({int(dimensions)})
+            )
+        """)
+        await conn.execute(
+            "INSERT INTO agent_definitions (id, name, content) SELECT gen_random_uuid(), 'agent-' || g, 'Agent ' || g FROM generate_series(1, $1) g",
+            agents
+        )
+
+        loaded = 0
+        indexed = False
+        for size in sorted(sizes):
+            if size > loaded:
+                started = time.perf_counter()
+                # The inner generate_series references g so each row gets its own random vector
+                await conn.execute(f"""
+                    WITH a AS (SELECT array_agg(id) AS ids FROM agent_definitions)
+                    INSERT INTO agent_definition_chunks (id, agent_id, chunk_index, content, embedding)
+                    SELECT gen_random_uuid(), a.ids[1 + g % $3], g, 'chunk ' || g,
+                           (SELECT array_agg(random() + g * 0) FROM generate_series(1, {int(dimensions)}))::vector
+                    FROM generate_series($1, $2) g, a
+                """, loaded + 1, size, agents)
+                loaded = size
+                if not indexed:
+                    await conn.execute("CREATE INDEX ON agent_definition_chunks USING hnsw (embedding vector_cosine_ops)")
+                    indexed = True
+                await conn.execute("ANALYZE agent_definition_chunks")
+                logger.info(f"Loaded {size} chunks in {time.perf_counter() - started:.1f}s")
+
+            vectors = [[random.random() for _ in range(dimensions)] for _ in range(queries)]
+            for name, sql, count in (
+                ("hnsw", AGENT_SEARCH_SQL, queries),
+                ("full-scan", FULL_SCAN_SEARCH_SQL, baseline_queries),
+            ):
+                if count <= 0:
+                    continue
+                # One untimed call warms the plan cache and index pages
+                await _time_query(conn, sql, vectors[0], limit, candidates, ef_search)
+                samples = [await _time_query(conn, sql, vector, limit, candidates, ef_search) for vector in vectors[:count]]
+                results.append({
+                    "chunks": size,
+                    "query": name,
+                    "samples": len(samples),
+                    "p50_ms": statistics.median(samples),
+                    "p95_ms": _percentile(samples, 0.95),
+                })
+    finally:
+        await conn.execute("SET search_path = public")
+        if not keep:
+            await conn.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+
+    return results
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from ..database import get_db_pool
+
+logger = logging.getLogger(__name__)
+
+
+class ThreadStatusBus:
+    """Latest graph status per thread, held in memory with coalesced writes to Postgres.
+
+    set() only updates memory and schedules a flush; at most one batched UPDATE is issued
+    per flush interval, carrying the most recent status of every thread that changed.
+    The database copy exists for replicas that are not running the thread.
+    """
+
+    def __init__(self, flush_interval: float = 1.0):
+        self.flush_interval = flush_interval
+        self._latest: dict[str, tuple[str | None, datetime]] = {}
+        self._dirty: set[str] = set()
+        self._flush_task: asyncio.Task | None = None
+
+    def set(self, thread_id: str, status_msg: str | None) -> None:
+        self._latest[thread_id] = (status_msg, datetime.now(timezone.utc))
+        self._dirty.add(thread_id)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    def get(self, thread_id: str) -> tuple[str | None, datetime] | None:
+        """Returns (status_msg, updated_at) if this replica holds a live status for the thread."""
+        return self._latest.get(thread_id)
+
+    def discard(self, thread_id: str) -> None:
+        """Forgets a thread's status without flushing it, e.g. when its run has finished."""
+        self._latest.pop(thread_id, None)
+        self._dirty.discard(thread_id)
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self) -> None:
+        if not self._dirty:
+            return
+        rows = [
+            (self._latest[thread_id][0], self._latest[thread_id][1], thread_id)
+            for thread_id in self._dirty
+            if thread_id in self._latest
+        ]
+        self._dirty.clear()
+        if not rows:
+            return
+
+        try:
+            pool = await get_db_pool()
+            async with pool.acquire() as conn:
+                # Only threads that still hold the lock are updated, so a late flush cannot
+                # resurrect a status after the run has released it
+                await conn.executemany(
+                    """
+                    UPDATE threads SET status_msg = $1, status_updated_at = $2
+                    WHERE thread_id = $3 AND locked_until IS NOT NULL
+                    """,
+                    rows
+                )
+        except Exception as e:
+            logger.error(f"Failed to flush status for {len(rows)} threads: {e}", exc_info=False)
+
+    async def close(self) -> None:
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
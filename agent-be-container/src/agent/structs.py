@@ -135,7 +135,41 @@ class FollowUpQuestions(BaseModel):
     follow_up_questions: List[str] = Field(description="Exactly 3 highly contextual and relevant follow-up questions the user could ask next.")
 
 
+class AgentContext(BaseModel):
+    """
+    Agent definition context injected into the system prompt.
+
+    AgentState keeps what the search selected (query, agent, similarity and chunk indexes)
+    but not the text, which is rebuilt from the definition by id on every call, so edited
+    or deleted definitions are never served from a checkpoint.
+    """
+    query: str = Field(default="", description="The human message the context was retrieved for")
+    agent_id: str | None = Field(default=None, description="The selected agent definition, None if none matched")
+    agent_name: str | None = Field(default=None)
+    similarity: float | None = Field(default=None, description="Cosine similarity of the selected agent, None if only full-text search found it")
+    chunk_indexes: List[int] = Field(default_factory=list, description="Indexes of the definition chunks in text")
+    text: str = Field(default="", description="The system prompt section, empty if nothing is injected")
+    tokens: int = Field(default=0, description="Estimated tokens in text")
+    chunks: int = Field(default=0, description="Agent definition chunks in text")
+
+
+class HistorySummary(BaseModel):
+    """Rolling summary of the turns that have left a thread's history window."""
+    text: str = Field(default="", description="The summary")
+    messages: int = Field(default=0, description="Number of leading state messages the summary covers")
+
+
+class SpeculativeAnswer(BaseModel):
+    """Answer to a prompt under learning mode review, made while the review ran."""
+    query: str = Field(default="", description="The prompt that was answered")
+    human_id: str | None = Field(default=None, description="Id of the human message the answer is for")
+    message: AIMessage = Field(description="The answer, shown if the user keeps the prompt as written")
+
+
 class AgentState(BaseModel):
     messages: Annotated[List[BaseMessage], add_messages] = Field(default_factory=list)
     visualizations: Annotated[List[MFEContent], visualizations_reducer] = Field(default_factory=list)
     learning_mode_enabled: bool = Field(default=False)
+    agent_context: AgentContext | None = Field(default=None)
+    history_summary: HistorySummary | None = Field(default=None)
+    speculative_answer: SpeculativeAnswer | None = Field(default=None)
@@ -186,6 +186,97 @@ def load_agent(ctx, config, secrets, filepath, agent_name):
     asyncio.run(_load())
 
 
+@cli.command()
+@click.argument("directory", type=click.Path(exists=True, file_okay=False))
+@click.option("--pattern", default="*.md", show_default=True, help="Glob of agent definition files under DIRECTORY.")
+@click.option("--concurrency", default=4, show_default=True, type=int, help="Files embedded at the same time.")
+@click.option("--rate-limit", default=2.0, show_default=True, type=float, help="Max files starting embedding per second (0 for no limit).")
+@click.option("--batch-size", default=20, show_default=True, type=int, help="Agent definitions written per transaction.")
+@shared_options
+def load_agents(ctx, config, secrets, directory, pattern, concurrency, rate_limit, batch_size):
+    """Load a directory of Markdown agent definitions, skipping unchanged files"""
+    import asyncio
+    from pathlib import Path
+    from src.database import init_db_pool, close_db_pool
+    from src.agent.agent_loader import load_agent_library
+
+    configObj: ServiceConfig = ServiceConfig.from_yaml_and_secrets_dir(config.name, secrets)
+    logging.config.dictConfig(configObj.logging)
+
+    logger = logging.getLogger(__name__)
+
+    def _progress(stats):
+        click.echo(f"Committed {stats.loaded} agents ({stats.chunks} chunks) in {stats.elapsed:.1f}s")
+
+    async def _load():
+        try:
+            await init_db_pool(configObj.persistence.db)
+            return await load_agent_library(
+                Path(directory),
+                configObj,
+                concurrency=concurrency,
+                rate_limit=rate_limit,
+                batch_size=batch_size,
+                pattern=pattern,
+                progress=_progress,
+            )
+        except Exception as e:
+            logger.error(f"Failed to load agents: {e}", exc_info=True)
+            click.echo("Load stopped; committed batches are kept and unchanged files are skipped on re-run.", err=True)
+            sys.exit(1)
+        finally:
+            await close_db_pool()
+
+    stats = asyncio.run(_load())
+    click.echo(stats.summary())
+    for path in stats.failed:
+        click.echo(f"Failed: {path}", err=True)
+    if stats.failed:
+        sys.exit(1)
+
+
+@cli.command()
+@click.option("--chunks", "sizes", multiple=True, type=int, default=[10_000, 100_000, 1_000_000], show_default=True, help="Chunk table sizes to measure (repeatable).")
+@click.option("--agents", default=500, show_default=True, type=int, help="Synthetic agents the chunks belong to.")
+@click.option("--queries", default=50, show_default=True, type=int, help="Timed searches per size with the HNSW query.")
+@click.option("--baseline-queries", default=5, show_default=True, type=int, help="Timed searches per size with the old full-scan query (0 to skip).")
+@click.option("--keep/--no-keep", default=False, help="Keep the scratch schema afterwards.")
+@shared_options
+def bench_agent_search(ctx, config, secrets, sizes, agents, queries, baseline_queries, keep):
+    """Benchmark agent search latency on synthetic chunk tables in a scratch schema"""
+    import asyncio
+    from src.database import init_db_pool, close_db_pool
+    from src.agent.search_benchmark import run_search_benchmark
+
+    configObj: ServiceConfig = ServiceConfig.from_yaml_and_secrets_dir(config.name, secrets)
+    logging.config.dictConfig(configObj.logging)
+    search = configObj.embedding_client
+
+    async def _bench():
+        try:
+            pool = await init_db_pool(configObj.persistence.db)
+            async with pool.acquire() as conn:
+                return await run_search_benchmark(
+                    conn,
+                    list(sizes),
+                    agents=agents,
+                    queries=queries,
+                    baseline_queries=baseline_queries,
+                    candidates=search.search_candidates,
+                    ef_search=search.hnsw_ef_search,
+                    keep=keep,
+                )
+        finally:
+            await close_db_pool()
+
+    results = asyncio.run(_bench())
+    # A Markdown table, to paste into the README's benchmark results
+    click.echo(f"| {'chunks':>10} | {'query':>10} | {'n':>4} | {'p50 ms':>9} | {'p95 ms':>9} |")
+    click.echo(f"| {'-' * 9}: | {'-' * 10} | {'-' * 3}: | {'-' * 8}: | {'-' * 8}: |")
+    for row in results:
+        click.echo(f"| {row['chunks']:>10} | {row['query']:>10} | {row['samples']:>4} | {row['p50_ms']:>9.2f} | {row['p95_ms']:>9.2f} |")
+
+
 @cli.command()
 @shared_options
 def list_threads(ctx, config, secrets):
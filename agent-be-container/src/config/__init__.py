@@ -35,11 +35,25 @@ class DbConnectionConfig(BaseModel):
 
 
 class DbOptionsConfig(BaseModel):
+    """
+    Connection options for both database pools held by each replica: the asyncpg pool used by
+    the API and the psycopg pool used by the LangGraph checkpointer.
+    A replica opens at most pool_size + checkpoint_pool_size connections.
+    """
+
     pool_size: int = Field(description="Max size of the asyncpg pool")
+    pool_min_size: int = Field(default=1, description="Connections the asyncpg pool keeps open when idle")
+    checkpoint_pool_size: int = Field(default=10, description="Max size of the LangGraph checkpointer (psycopg) pool")
+    checkpoint_pool_min_size: int = Field(default=1, description="Connections the checkpointer pool keeps open when idle")
     automigrate: bool = Field(description="Whether to run migrations on startup")
     acquire_timeout: int = Field(description="Pool acquire timeout in seconds")
     connection: DbConnectionConfig
 
+    @property
+    def max_connections(self) -> int:
+        """Upper bound of connections a single replica can hold against the database."""
+        return self.pool_size + self.checkpoint_pool_size
+
 
 class PersistenceConfig(BaseModel):
     db: DbOptionsConfig
@@ -61,9 +75,15 @@ class EventConfig(BaseModel):
     Process costs for a given events
     """
 
-    maxChunks: int = Field(default=10, description="Max number of chunks that can be processed after which cannot take more load")
-    chunkDuration: timedelta = Field(default=timedelta(seconds=1), description="Duration of events")
-    checkTime: timedelta = Field(default=timedelta(seconds=5), description="Time between checking for new events")
+    maxChunks: int = Field(default=10, description="Max number of chunks that can be processed after which cannot take more load (concurrent graph runs)")
+    maxQueued: int = Field(default=50, description="Max number of graph runs waiting for a worker before new chats are rejected")
+    maxQueuedPerUser: int = Field(default=3, description="Max number of running or waiting graph runs per user")
+    chunkDuration: timedelta = Field(default=timedelta(seconds=1), description="Duration of events (used as the Retry-After hint when rejecting)")
+    checkTime: timedelta = Field(default=timedelta(seconds=5), description="Time between checking for new events (run queue heartbeat and claim interval)")
+    runLeaseTimeout: timedelta = Field(default=timedelta(seconds=30), description="Lease on a running thread and its run; renewed every checkTime, after which another replica may take over")
+    maxRunAttempts: int = Field(default=3, description="Max times a run is started before it is marked failed")
+    failedRunRetention: timedelta = Field(default=timedelta(days=7), description="How long failed runs stay in the run queue for inspection before they are deleted")
+    statusFlushInterval: timedelta = Field(default=timedelta(seconds=1), description="Max interval between batched thread status writes to the database")
 
 
 class AIPromptConfig(BaseModel):
@@ -143,6 +163,20 @@ class EmbeddingConfig(BaseModel):
     model_provider: Literal["google_genai"] = Field(description="Embedding model provider")
     model: str = Field(description="Embedding model name")
     google_api_key: SecretStr = Field(description="API key for authenticated access to Genai model")
+    batch_size: int = Field(default=64, description="Max texts sent in one embedding provider call")
+    batch_window: timedelta = Field(default=timedelta(milliseconds=5), description="How long a query embedding waits for others to share its provider call")
+    max_retries: int = Field(default=3, description="Retries of an embedding provider call that timed out, lost its connection or got a 408, 429 or 5xx")
+    retry_backoff: timedelta = Field(default=timedelta(milliseconds=500), description="Initial delay between embedding retries, doubled on each attempt")
+    search_candidates: int = Field(default=40, ge=1, le=1000, description="Nearest chunks fetched through the HNSW index before de-duplicating by agent")
+    hnsw_ef_search: int = Field(default=100, ge=1, le=1000, description="hnsw.ef_search for agent searches; raised to search_candidates if lower")
+    hybrid_search: bool = Field(default=True, description="Fuse full-text and vector agent search with reciprocal rank fusion")
+    rrf_k: int = Field(default=60, ge=1, description="Reciprocal rank fusion constant; larger values flatten the weight of top ranks")
+    lexical_skip_rank: float = Field(default=0.5, ge=0, le=1, description="Normalised full-text rank (r / (r + 1), always below 1) at which the embedding call is skipped; 1 never skips on rank. Exact agent-name matches always skip")
+    context_min_similarity: float = Field(default=0.5, ge=0, le=1, description="Minimum similarity of the agent and of each chunk injected into the system prompt")
+    context_budget_fraction: float = Field(default=0.2, gt=0, le=1, description="Share of main_aiclient.context_length that injected agent context may use")
+    context_reuse_similarity: float = Field(default=0.3, ge=0, le=1, description="Word-overlap similarity to the message a thread's agent context was retrieved for, below which a new message searches again")
+    retrieval_cache_size: int = Field(default=256, description="Max number of agent-definition search results cached per replica (0 disables the cache)")
+    retrieval_cache_ttl: timedelta = Field(default=timedelta(minutes=10), description="How long a cached search result is reused; bounds staleness after another replica edits the store")
 
     # model_config = ConfigDict(extra="forbid")
 
@@ -159,6 +193,42 @@ LangchainConfig = Annotated[
     Field(discriminator="model_provider")
 ]
 
+class HistoryConfig(BaseModel):
+    """
+    How much conversation history is sent with each LLM call
+    """
+    keep_turns: int = Field(default=6, ge=1, description="Most recent turns sent verbatim; older turns are replaced by a rolling summary")
+    summarise: bool = Field(default=True, description="Summarise turns that leave the window; when off they are simply dropped")
+    max_tool_message_tokens: int = Field(default=1000, ge=1, description="Tool output of earlier turns is cut to this many tokens")
+    budget_fraction: float = Field(default=0.5, gt=0, le=1, description="Share of main_aiclient.context_length the history may use; the oldest turns are dropped beyond it")
+
+
+class ResponseCacheConfig(BaseModel):
+    """
+    Semantic cache of main LLM answers to repeated questions
+    """
+    enabled: bool = Field(default=False, description="Serve a stored answer when the same user asks, in the same prompt context, a question close enough to one already answered and naming the same ids and numbers")
+    min_similarity: float = Field(default=0.95, ge=0, le=1, description="Cosine similarity of the question embeddings needed for a cached answer")
+    ttl: timedelta = Field(default=timedelta(hours=24), description="How long a cached answer is served")
+    context_turns: int = Field(default=1, ge=0, description="Earlier turns that, with the prompt, must match for a cached answer; older turns are left out so a question repeated in another thread hits")
+
+
+class PackagerCacheConfig(BaseModel):
+    """
+    Exact-match cache of packager structured outputs (learning mode feedback, follow-up questions)
+    """
+    size: int = Field(default=512, ge=0, description="Max outputs held in memory per replica (0 disables the cache)")
+    ttl: timedelta = Field(default=timedelta(hours=1), description="How long a cached output is reused")
+    persist: bool = Field(default=False, description="Also keep outputs in the packager_cache table, shared by replicas and kept across restarts")
+
+
+class LearningModeConfig(BaseModel):
+    """
+    How learning mode reviews prompts
+    """
+    speculative: bool = Field(default=False, description="Answer the original prompt alongside the review so the answer is ready if the user keeps it; costs a main LLM call when they do not")
+
+
 class ServiceConfig(BaseSettings):
     """
     Configuration for the service
@@ -174,6 +244,10 @@ class ServiceConfig(BaseSettings):
     webservice: WebServerConfig = Field(description="Web server configuration")
     persistence: PersistenceConfig = Field(description="Database persistence configuration")
     events: EventConfig = Field(default_factory=EventConfig, description="Process costs for events")
+    history: HistoryConfig = Field(default_factory=HistoryConfig, description="Conversation history windowing")
+    learning_mode: LearningModeConfig = Field(default_factory=LearningModeConfig, description="Learning mode prompt review")
+    response_cache: ResponseCacheConfig = Field(default_factory=ResponseCacheConfig, description="Semantic cache of main LLM answers")
+    packager_cache: PackagerCacheConfig = Field(default_factory=PackagerCacheConfig, description="Exact-match cache of packager structured outputs")
 
     model_config = SettingsConfigDict(
         env_prefix="APP_",
@@ -1,18 +1,34 @@
 import asyncpg
-from typing import Optional
+import logging
+from typing import Optional, Callable
+from pgvector.asyncpg import register_vector
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
 
 # Global pool instance
 pool: Optional[asyncpg.Pool] = None
 
 from src.config import DbOptionsConfig
 
+logger = logging.getLogger(__name__)
+
+async def init_connection(conn: asyncpg.Connection):
+    """Registers the binary pgvector codec, so vectors are passed as lists rather than text"""
+    try:
+        await register_vector(conn)
+    except ValueError as e:
+        # The vector extension is created by migrations; other queries still work without it
+        logger.warning(f"pgvector codec not registered: {e}")
+
 async def init_db_pool(config: DbOptionsConfig):
     """Initialize database pool with the provided DbOptionsConfig"""
     global pool
     pool = await asyncpg.create_pool(
         dsn=config.connection.dsn,
+        min_size=min(config.pool_min_size, config.pool_size),
         max_size=config.pool_size,
-        timeout=config.acquire_timeout
+        timeout=config.acquire_timeout,
+        init=init_connection
     )
     return pool
 
@@ -28,3 +44,37 @@ async def get_db_pool() -> asyncpg.Pool:
     if pool is None:
         raise Exception("Database pool not initialized")
     return pool
+
+
+class DbPoolCollector(Collector):
+    """
+    Prometheus collector reporting utilisation of the asyncpg app pool and the
+    psycopg checkpointer pool. Values are read from the live pools at scrape time.
+    """
+
+    def __init__(self, checkpoint_pool: Callable[[], object | None]):
+        self.checkpoint_pool = checkpoint_pool
+
+    def collect(self):
+        size = GaugeMetricFamily("db_pool_size", "Open connections in the pool", labels=["pool"])
+        idle = GaugeMetricFamily("db_pool_idle", "Idle connections in the pool", labels=["pool"])
+        max_size = GaugeMetricFamily("db_pool_max_size", "Configured maximum pool size", labels=["pool"])
+        waiting = GaugeMetricFamily("db_pool_requests_waiting", "Requests queued waiting for a connection", labels=["pool"])
+
+        if pool is not None:
+            size.add_metric(["app"], pool.get_size())
+            idle.add_metric(["app"], pool.get_idle_size())
+            max_size.add_metric(["app"], pool.get_max_size())
+
+        checkpoint_pool = self.checkpoint_pool()
+        if checkpoint_pool is not None:
+            stats = checkpoint_pool.get_stats()
+            size.add_metric(["checkpoint"], stats.get("pool_size", 0))
+            idle.add_metric(["checkpoint"], stats.get("pool_available", 0))
+            max_size.add_metric(["checkpoint"], checkpoint_pool.max_size)
+            waiting.add_metric(["checkpoint"], stats.get("requests_waiting", 0))
+
+        yield size
+        yield idle
+        yield max_size
+        yield waiting
@@ -132,8 +132,10 @@ class Hams:
         return True
 
     def ready(self) -> bool:
-        return True
-        return self.app[keys.events].spareCapacity()
+        events = self.app.get(keys.events)
+        if events is None:
+            return True
+        return events.spareCapacity()
 
 
 def hams_app_create(base_app: web.Application, config: HamsConfig) -> web.Application:
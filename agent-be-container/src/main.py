@@ -3,6 +3,8 @@ import warnings
 # Suppress Pydantic V1 warning on Python 3.14 until langchain-core updates
 warnings.filterwarnings("ignore", message=".*Core Pydantic V1 functionality isn't compatible with Python 3.14.*")
 
+import asyncio
+import hashlib
 import logging
 import uuid
 import json
@@ -11,7 +13,12 @@ from aiohttp import web
 from langchain_core.messages import HumanMessage
 from .agent import create_agent
 from .agent.handler import LLMHandler
-from .database import init_db_pool, close_db_pool, get_db_pool
+from .agent.scheduler import RunRejected, RunSlot
+from .agent.events import message_to_dict, format_sse
+from .database import init_db_pool, close_db_pool, get_db_pool, DbPoolCollector
+from .agent.embeddings import EmbeddingServiceCollector, embedding_registry
+from .agent.response_cache import ResponseCacheCollector
+from .agent.packager_cache import PackagerCacheCollector, packager_cache
 from . import keys
 from datetime import datetime, timezone
 
@@ -22,6 +29,8 @@ from .config import ServiceConfig
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Interval between SSE comment frames so idle proxies don't drop the stream
+SSE_KEEPALIVE_SECONDS = 15
 
 
 async def auth_middleware(app, handler):
@@ -29,9 +38,8 @@ async def auth_middleware(app, handler):
         # Handle CORS preflight
         if request.method == "OPTIONS":
             response = web.Response()
-            response.headers["Access-Control-Allow-Origin"] = "*"
             response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS, PUT, DELETE, PATCH"
-            response.headers["Access-Control-Allow-Headers"] = "Content-Type, X-User-ID, Authorization"
+            response.headers["Access-Control-Allow-Headers"] = "Content-Type, X-User-ID, Authorization, If-None-Match"
             return response
 
         # Allow health check without auth (handle prefixed case as well)
@@ -81,12 +89,20 @@ async def auth_middleware(app, handler):
              logger.error(f"Error handling request: {e}", exc_info=True)
              response = web.json_response({"error": str(e)}, status=500)
 
-        # Always add CORS headers
-        response.headers["Access-Control-Allow-Origin"] = "*"
         return response
 
     return middleware_handler
 
+async def add_cors_headers(request, response):
+    """on_response_prepare hook adding the CORS headers to every response.
+
+    Set as the headers are sent rather than in auth_middleware, so that streamed
+    responses, which are prepared inside the handler, get them as well.
+    """
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    # Lets the UI read history ETags for conditional polls
+    response.headers["Access-Control-Expose-Headers"] = "ETag"
+
 async def health_check(request):
     return web.json_response({"status": "ok"})
 
@@ -108,56 +124,52 @@ async def chat_endpoint(request):
     if not thread_id:
         thread_id = str(uuid.uuid4())
 
-    pool = await get_db_pool()
     llm_handler: LLMHandler = request.app["llm_handler"]
 
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT user_id FROM threads WHERE thread_id = $1", thread_id)
+    # Admission control: reject before touching the database when there is no capacity
+    try:
+        slot = llm_handler.scheduler.reserve(user_id)
+    except RunRejected as e:
+        retry_after = max(1, int(config.events.chunkDuration.total_seconds()))
+        return web.json_response({"error": str(e)}, status=e.status, headers={"Retry-After": str(retry_after)})
 
-        is_new_thread = False
-
-        if row:
-            if row["user_id"] != user_id:
-                # Check thread_access table for additional users
-                access_row = await conn.fetchrow("SELECT 1 FROM thread_access WHERE thread_id = $1 AND user_id = $2", thread_id, user_id)
-                if not access_row:
-                    return web.json_response({"error": "Thread access denied"}, status=403)
-        else:
-            is_new_thread = True
-            await conn.execute(
-                "INSERT INTO threads (thread_id, user_id, title) VALUES ($1, $2, $3)",
-                thread_id, user_id, message[:30]
-            )
-
-        # Attempt to acquire the lock
-        lock_query = """
-            UPDATE threads
-            SET locked_until = NOW() + INTERVAL '5 minutes'
-            WHERE thread_id = $1 AND (locked_until IS NULL OR locked_until < NOW())
-            RETURNING thread_id;
-        """
-        locked_row = await conn.fetchrow(lock_query, thread_id)
-        if not locked_row:
-            return web.json_response({"error": "Thread is busy processing a previous request."}, status=409)
+    try:
+        return await _admit_chat(config, llm_handler, slot, user_id, thread_id, message, bypass_learning_mode)
+    finally:
+        # No-op once the run has been handed to the scheduler
+        slot.release()
 
-    # For new threads, initialize the state with the user's default learning mode setting
-    if is_new_thread:
-        async with pool.acquire() as conn:
-            user_row = await conn.fetchrow("SELECT learning_mode_enabled FROM users WHERE user_id = $1", user_id)
-            user_learning_mode = user_row["learning_mode_enabled"] if user_row else False
+async def _admit_chat(config: ServiceConfig, llm_handler: LLMHandler, slot: RunSlot, user_id: str, thread_id: str, message: str, bypass_learning_mode: bool):
+    """Checks thread access, takes the thread lease and starts the run in the reserved slot.
 
-        # Initialize state with the default setting
-        agent_config = {
-            "configurable": {
-                "thread_id": thread_id,
-                "service_config": config
-            }
-        }
-        await llm_handler.agent.aupdate_state(agent_config, {"learning_mode_enabled": user_learning_mode}, as_node="initial")
+    Access, thread creation, the lease, the run queue row and the user's learning mode
+    default are all handled by one query; the new thread's defaults and the human message
+    are then written in one checkpoint.
+    """
+    pool = await get_db_pool()
+    run_id = str(uuid.uuid4())
+
+    async with pool.acquire() as conn:
+        admission = await llm_handler.lease.admit(conn, thread_id, user_id, message[:30], run_id)
 
+    if not admission["allowed"]:
+        return web.json_response({"error": "Thread access denied"}, status=403)
+    if not admission["locked"]:
+        return web.json_response({"error": "Thread is busy processing a previous request."}, status=409)
+
+    # New threads start with the user's default learning mode setting
+    learning_mode_enabled = admission["learning_mode_enabled"] if admission["created"] else None
 
     # --- Agent Logic ---
-    await llm_handler.chat_async(thread_id, message, bypass_learning_mode)
+    try:
+        await llm_handler.chat_async(
+            thread_id, message, bypass_learning_mode,
+            user_id=user_id, slot=slot, run_id=run_id, learning_mode_enabled=learning_mode_enabled
+        )
+    except Exception:
+        # The run never started; without this its lease and queue row would be renewed for as long as the replica lives
+        await llm_handler.abandon_run(thread_id, run_id)
+        raise
 
     return web.json_response(
         {
@@ -202,7 +214,7 @@ async def list_threads(request):
 
     return web.json_response({"threads": threads})
 
-from src.agent.agent_store import get_all_agent_definitions, save_agent_definition, delete_agent_definition
+from src.agent.agent_store import get_all_agent_definitions, save_agent_definition, delete_agent_definition, retrieval_cache, RetrievalCacheCollector
 
 async def get_agents(request: web.Request) -> web.Response:
     try:
@@ -292,14 +304,42 @@ async def update_user_settings(request):
         )
     return web.json_response({"status": "updated"})
 
+def history_etag(checkpoint_id: str | None, status_msg: str | None, color: str | None, partial: dict | None = None, after: str | None = None) -> str:
+    """Builds the history ETag from the latest checkpoint id plus the mutable thread row fields,
+    the size of any in-memory partial answer and the `after` cursor, which selects the messages."""
+    partial_marker = f"{partial['id']}:{len(partial['content'])}" if partial else ""
+    digest = hashlib.sha1(f"{checkpoint_id}|{status_msg}|{color}|{partial_marker}|{after or ''}".encode("utf-8")).hexdigest()
+    return f'"{digest}"'
+
 async def get_history(request):
+    """Returns the thread's messages and visualizations.
+
+    Supports `?after=<message_id>` to return only messages appended after that message, and
+    conditional requests: the ETag is keyed on the latest checkpoint id and the cursor, so a matching
+    `If-None-Match` gets a 304 without loading the checkpoint. Messages of an in-flight turn
+    are rewritten in place, so clients should use the last message of a completed turn as cursor.
+    """
     config: ServiceConfig = request.app[keys.config]
     user_id = request["user_id"]
     thread_id = request.match_info["thread_id"]
+    after = request.query.get("after")
 
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT user_id, color, status_msg, status_updated_at FROM threads WHERE thread_id = $1", thread_id)
+        # The latest checkpoint id is read alongside the thread row so unchanged polls can be answered with a 304
+        row = await conn.fetchrow(
+            """
+            SELECT t.user_id, t.color, t.status_msg, t.status_updated_at,
+                (
+                    SELECT c.checkpoint_id FROM checkpoints c
+                    WHERE c.thread_id = t.thread_id AND c.checkpoint_ns = ''
+                    ORDER BY c.checkpoint_id DESC LIMIT 1
+                ) AS checkpoint_id
+            FROM threads t
+            WHERE t.thread_id = $1
+            """,
+            thread_id
+        )
         if not row:
             return web.json_response({"thread": {"thread_id": thread_id}, "messages": []})
 
@@ -309,46 +349,33 @@ async def get_history(request):
                 return web.json_response({"thread": {"thread_id": thread_id}, "messages": []})
 
     llm_handler: LLMHandler = request.app["llm_handler"]
+    partial = llm_handler.events.get_partial(thread_id)
+
+    # Prefer the live in-memory status when this replica is running the thread
+    status_msg, status_updated_at = row["status_msg"], row["status_updated_at"]
+    live_status = llm_handler.status.get(thread_id)
+    if live_status:
+        status_msg, status_updated_at = live_status
+
+    etag = history_etag(row["checkpoint_id"], status_msg, row["color"], partial, after)
+    if request.headers.get("If-None-Match") == etag:
+        return web.Response(status=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
     state = await llm_handler.get_thread_state(thread_id)
     messages_list = []
     max_tokens = getattr(config.main_aiclient, "context_length", None)
 
+    # With a cursor only messages after it are returned; an unknown cursor falls back to the full list
+    message_ids = [getattr(m, "id", None) for m in state.values.get("messages", [])] if state.values else []
+    include_from = message_ids.index(after) + 1 if after and after in message_ids else 0
+
     if state.values and "messages" in state.values:
         last_human_timestamp = None
         ai_msg_with_tools = None
 
-        for m in state.values["messages"]:
-            msg_dict = {"type": m.type, "content": getattr(m, "content", "")}
-
-            if hasattr(m, "name") and m.name:
-                msg_dict["name"] = m.name
-
-            if m.type == "tool":
-                tool_call_id = getattr(m, "tool_call_id", None)
-                if tool_call_id:
-                    msg_dict["tool_call_id"] = tool_call_id
-
-            msg_timestamp = None
-
-            if hasattr(m, 'additional_kwargs') and m.additional_kwargs:
-                if "timestamp" in m.additional_kwargs:
-                    msg_timestamp = m.additional_kwargs["timestamp"]
-                    msg_dict["created_at"] = msg_timestamp
-                msg_dict["additional_kwargs"] = m.additional_kwargs
-
-            if m.type == "ai" and hasattr(m, "tool_calls") and m.tool_calls:
-                tool_calls = []
-                for tc in m.tool_calls:
-                    tc_dict = {
-                        "id": tc.get("id"),
-                        "name": tc.get("name", "Unknown Tool"),
-                        "args": tc.get("args", {})
-                    }
-                    tool_calls.append(tc_dict)
-
-                if "additional_kwargs" not in msg_dict:
-                    msg_dict["additional_kwargs"] = {}
-                msg_dict["additional_kwargs"]["tool_calls"] = tool_calls
+        for index, m in enumerate(state.values["messages"]):
+            msg_dict = message_to_dict(m, max_tokens)
+            msg_timestamp = msg_dict.get("created_at")
 
             if m.type == "human" and msg_timestamp:
                 try:
@@ -364,32 +391,119 @@ async def get_history(request):
                 except ValueError:
                     pass
 
-            if hasattr(m, 'usage_metadata') and m.usage_metadata:
-                usage = dict(m.usage_metadata)
-                if max_tokens:
-                    usage["max_tokens"] = max_tokens
-                msg_dict["usage_metadata"] = usage
-
-            messages_list.append(msg_dict)
+            if index >= include_from:
+                messages_list.append(msg_dict)
     visualizations_list = []
     if state.values and "visualizations" in state.values:
         for v in state.values["visualizations"]:
             v_dict = v.model_dump()
             visualizations_list.append(v_dict)
 
+    # Key the returned ETag on the checkpoint that was actually served
+    served_checkpoint_id = (state.config or {}).get("configurable", {}).get("checkpoint_id") if state else None
+    etag = history_etag(served_checkpoint_id or row["checkpoint_id"], status_msg, row["color"], partial, after)
+
     return web.json_response({
             "thread": {
                 "thread_id": thread_id,
                 "user_id": row["user_id"],
                 "color": row["color"],
-                "status_msg": row["status_msg"],
-                "status_updated_at": str(row["status_updated_at"]) if row["status_updated_at"] else None,
+                "status_msg": status_msg,
+                "status_updated_at": str(status_updated_at) if status_updated_at else None,
                 "current_server_time": datetime.now(timezone.utc).isoformat(),
                 "learning_mode_enabled": bool(state.values.get("learning_mode_enabled", False)) if state and state.values else False
             },
             "messages": messages_list,
+            "cursor": message_ids[-1] if message_ids else None,
+            "incremental": include_from > 0,
+            "partial_answer": partial,
             "visualizations": visualizations_list
-        })
+        }, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+async def thread_events(request):
+    """Streams live progress for a running thread as Server-Sent Events.
+
+    Emits "status", "token" and "message" events (preceded by a "partial" snapshot of
+    the answer so far for late subscribers) while the graph runs on this replica. The
+    answer's "message" is followed by a second one carrying its follow-up questions
+    once they are attached, then a final "done". If no run is active here an "idle" event is sent and the stream
+    closes, so clients fall back to a single history fetch.
+    """
+    user_id = request["user_id"]
+    thread_id = request.match_info["thread_id"]
+
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow("SELECT user_id FROM threads WHERE thread_id = $1", thread_id)
+        if not row:
+            return web.json_response({"error": "Not found or access denied"}, status=404)
+
+        if row["user_id"] != user_id:
+            access_row = await conn.fetchrow("SELECT 1 FROM thread_access WHERE thread_id = $1 AND user_id = $2", thread_id, user_id)
+            if not access_row:
+                return web.json_response({"error": "Not found or access denied"}, status=404)
+
+    llm_handler: LLMHandler = request.app["llm_handler"]
+    events = llm_handler.events
+
+    response = web.StreamResponse(
+        headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+        }
+    )
+    await response.prepare(request)
+
+    queue = events.subscribe(thread_id)
+    try:
+        if not events.is_active(thread_id):
+            await response.write(format_sse("idle", {"thread_id": thread_id}))
+            return response
+
+        # Catch late subscribers up on the answer generated so far
+        partial = events.get_partial(thread_id)
+        if partial:
+            await response.write(format_sse("partial", partial))
+
+        while True:
+            try:
+                event, data = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                await response.write(b": keepalive\n\n")
+                continue
+
+            await response.write(format_sse(event, data))
+            if event == "done":
+                break
+    except ConnectionResetError:
+        logger.info(f"Thread {thread_id}: event stream client disconnected.")
+    finally:
+        events.unsubscribe(thread_id, queue)
+
+    return response
+
+async def cancel_thread(request):
+    """Stops the thread's in-progress run; its lease is freed once the run has stopped."""
+    user_id = request["user_id"]
+    thread_id = request.match_info["thread_id"]
+
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow("SELECT user_id FROM threads WHERE thread_id = $1", thread_id)
+        if not row:
+            return web.json_response({"error": "Not found or access denied"}, status=404)
+
+        if row["user_id"] != user_id:
+            access_row = await conn.fetchrow("SELECT 1 FROM thread_access WHERE thread_id = $1 AND user_id = $2", thread_id, user_id)
+            if not access_row:
+                return web.json_response({"error": "Not found or access denied"}, status=404)
+
+    llm_handler: LLMHandler = request.app["llm_handler"]
+    if not await llm_handler.cancel_run(thread_id):
+        return web.json_response({"thread_id": thread_id, "status": "idle"})
+
+    return web.json_response({"thread_id": thread_id, "status": "cancelled"})
 
 async def delete_thread(request):
     config: ServiceConfig = request.app[keys.config]
@@ -520,6 +634,19 @@ async def on_startup(app):
         )
         await llm_handler.initialize()
         app["llm_handler"] = llm_handler
+        app[keys.events] = llm_handler.scheduler
+
+        # Build the shared embedding client once so chat turns reuse its connections
+        await embedding_registry.warm_up(config.embedding_client)
+        retrieval_cache.configure(config.embedding_client.retrieval_cache_size, config.embedding_client.retrieval_cache_ttl)
+        packager_cache.configure(config.packager_cache.size, config.packager_cache.ttl, config.packager_cache.persist)
+
+        if keys.metrics in app:
+            app[keys.metrics].register(DbPoolCollector(lambda: llm_handler.pool))
+            app[keys.metrics].register(RetrievalCacheCollector(retrieval_cache))
+            app[keys.metrics].register(EmbeddingServiceCollector())
+            app[keys.metrics].register(ResponseCacheCollector())
+            app[keys.metrics].register(PackagerCacheCollector())
 
         logger.info("DB initialized.")
     except Exception as e:
@@ -539,6 +666,7 @@ def create_app_with_middleware(config: ServiceConfig):
     This is mostly for backward compatibility, the preferred way is via __init__.py
     """
     app = web.Application(middlewares=[auth_middleware])
+    app.on_response_prepare.append(add_cors_headers)
     app[keys.config] = config
     path_prefix = config.webservice.url.path if config.webservice.url.path and config.webservice.url.path != "/" else ""
     path_prefix = path_prefix.rstrip("/")
@@ -547,7 +675,9 @@ def create_app_with_middleware(config: ServiceConfig):
     app.router.add_post(f"{path_prefix}/api/chat", chat_endpoint)
     app.router.add_get(f"{path_prefix}/api/threads", list_threads)
     app.router.add_get(f"{path_prefix}/api/threads/{{thread_id}}/history", get_history)
+    app.router.add_get(f"{path_prefix}/api/threads/{{thread_id}}/events", thread_events)
     app.router.add_get(f"{path_prefix}/api/threads/{{thread_id}}/visualizations", get_visualizations)
+    app.router.add_post(f"{path_prefix}/api/threads/{{thread_id}}/cancel", cancel_thread)
 
     app.router.add_delete(f"{path_prefix}/api/threads/{{thread_id}}", delete_thread)
     app.router.add_put(f"{path_prefix}/api/threads/{{thread_id}}", update_thread)
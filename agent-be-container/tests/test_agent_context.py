@@ -0,0 +1,280 @@
+"""
+Tests for assembling agent definition context into the system prompt
+"""
+import pytest
+from unittest.mock import MagicMock, AsyncMock, patch
+import sys
+import os
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.language_models import BaseChatModel
+from langgraph.checkpoint.memory import MemorySaver
+
+# Add container root to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.agent import agent_store, create_agent
+from src.agent.agent_store import AGENT_SEARCH_SQL, LEXICAL_SEARCH_SQL, RetrievalCache
+from src.agent.agent_context import assemble_agent_context, context_budget, estimate_tokens, is_on_topic, text_similarity
+from src.agent.structs import AgentContext, FollowUpQuestions
+
+
+def _chunk(index, content, similarity):
+    return {"index": index, "content": content, "similarity": similarity}
+
+
+def _result(chunks, similarity=0.9, full_content="Full"):
+    return {"id": "a1", "name": "Finance", "full_content": full_content, "top_chunk": None, "similarity": similarity, "chunks": chunks}
+
+
+def test_below_min_similarity_injects_nothing():
+    context = assemble_agent_context([_result([_chunk(0, "Budgets", 0.4)], similarity=0.4)], 0.5, 1000)
+
+    assert context.text == ""
+    assert context.tokens == 0
+
+
+def test_best_chunks_fill_budget_in_document_order():
+    chunks = [_chunk(2, "c" * 40, 0.9), _chunk(0, "a" * 40, 0.8), _chunk(1, "b" * 400, 0.7), _chunk(3, "d" * 40, 0.3)]
+
+    context = assemble_agent_context([_result(chunks)], 0.5, 50)
+
+    # The long chunk does not fit and the last one is below the threshold
+    assert context.chunks == 2
+    assert context.text.index("a" * 40) < context.text.index("c" * 40)
+    assert "b" * 400 not in context.text and "d" * 40 not in context.text
+    assert context.tokens == estimate_tokens(context.text) <= 50
+
+
+def test_agent_without_chunk_hits_offers_whole_definition():
+    context = assemble_agent_context([_result([], similarity=1.0, full_content="Plan the budget.")], 0.5, 1000)
+
+    assert context.agent_name == "Finance"
+    assert context.text.endswith("Plan the budget.")
+
+
+def test_full_text_only_hit_is_not_held_to_the_cosine_threshold():
+    chunks = [{"index": 1, "content": "Approve budgets.", "rank": 0.2}, {"index": 0, "content": "Finance team.", "rank": 0.3}]
+
+    context = assemble_agent_context([_result(chunks, similarity=None)], 0.5, 1000)
+
+    assert context.chunks == 2
+    assert context.similarity is None
+    assert context.text.index("Finance team.") < context.text.index("Approve budgets.")
+
+
+def test_budget_is_share_of_context_length(sample_config):
+    sample_config.embedding_client.context_budget_fraction = 0.25
+
+    assert context_budget(sample_config) == sample_config.main_aiclient.context_length // 4
+
+
+def test_text_similarity_ignores_case_and_stop_words():
+    assert text_similarity("What is the Q3 budget?", "show me the q3 budget") == pytest.approx(1.0)
+    assert text_similarity("Q3 budget", "draft a contract") == 0.0
+    assert text_similarity("", "anything") == 0.0
+
+
+def test_drift_is_measured_from_the_retrieval_query():
+    context = AgentContext(query="Summarise the Q3 marketing budget", agent_id="a1")
+
+    assert is_on_topic(context, "Break the Q3 marketing budget down by region", 0.3)
+    assert not is_on_topic(context, "Draft an employment contract", 0.3)
+    assert not is_on_topic(None, "Summarise the Q3 marketing budget", 0.0)
+
+
+def _llm():
+    llm = MagicMock(spec=BaseChatModel)
+    llm.bind_tools.return_value = llm
+    llm.ainvoke = AsyncMock(return_value=AIMessage(
+        content="LLM Response",
+        usage_metadata={"input_tokens": 100, "output_tokens": 10, "total_tokens": 110},
+    ))
+    structured = MagicMock()
+    structured.ainvoke = AsyncMock(return_value={
+        "parsed": FollowUpQuestions(follow_up_questions=["Q1", "Q2", "Q3"]),
+        "raw": MagicMock(usage_metadata=None),
+    })
+    llm.with_structured_output.return_value = structured
+    return llm
+
+
+@pytest.mark.asyncio
+async def test_llm_node_injects_chunks_and_reports_tokens(sample_config):
+    llm = _llm()
+    results = [_result([_chunk(0, "Approve budgets over 10k.", 0.8), _chunk(1, "Unrelated", 0.2)])]
+    with patch("src.agent.agent_store.search_agent_definitions", new=AsyncMock(return_value=results)):
+        agent = create_agent(main_llm=llm, packager_llm=llm, checkpointer=MemorySaver())
+        config = {"configurable": {"thread_id": "ctx", "service_config": sample_config}}
+        result = await agent.ainvoke({"messages": [HumanMessage(content="Who approves budgets?")]}, config=config)
+
+    prompt = llm.ainvoke.await_args.args[0][0]
+    assert isinstance(prompt, SystemMessage)
+    assert "Approve budgets over 10k." in prompt.content
+    assert "Unrelated" not in prompt.content
+
+    usage = result["messages"][-1].usage_metadata
+    assert usage["input_tokens"] == 100
+    assert usage["injected_context_tokens"] == estimate_tokens(
+        "\n\n### Relevant Agent Context (Finance):\nApprove budgets over 10k."
+    )
+
+
+def _definition(content="Approve budgets over 10k."):
+    return {"id": "a1", "name": "Finance", "full_content": content, "chunks": [{"index": 0, "content": content}]}
+
+
+@pytest.mark.asyncio
+async def test_agent_context_is_reused_until_the_topic_drifts(sample_config):
+    llm = _llm()
+    results = [_result([_chunk(0, "Approve budgets over 10k.", 0.8)])]
+    search = AsyncMock(return_value=results)
+    load = AsyncMock(return_value=_definition())
+    with patch("src.agent.agent_store.search_agent_definitions", new=search), \
+         patch("src.agent.agent_store.get_agent_definition", new=load):
+        agent = create_agent(main_llm=llm, packager_llm=llm, checkpointer=MemorySaver())
+        config = {"configurable": {"thread_id": "reuse", "service_config": sample_config}}
+        await agent.ainvoke({"messages": [HumanMessage(content="Who approves the marketing budget?")]}, config=config)
+        result = await agent.ainvoke({"messages": [HumanMessage(content="And the marketing budget for Q4?")]}, config=config)
+
+        # The follow-up keeps the topic: no new search, the kept chunks are reloaded by id
+        search.assert_awaited_once()
+        load.assert_awaited_once_with("a1", [0])
+        assert "Approve budgets over 10k." in llm.ainvoke.await_args.args[0][0].content
+        kept = result["agent_context"]
+        assert (kept.agent_id, kept.similarity, kept.chunk_indexes) == ("a1", 0.9, [0])
+        assert kept.query == "Who approves the marketing budget?"
+        # The text is never checkpointed
+        assert kept.text == ""
+
+        await agent.ainvoke({"messages": [HumanMessage(content="Draft an employment contract")]}, config=config)
+
+    assert search.await_count == 2
+    assert search.await_args.args[0] == "Draft an employment contract"
+
+
+@pytest.mark.asyncio
+async def test_reused_agent_context_reflects_definition_edits(sample_config):
+    llm = _llm()
+    search = AsyncMock(return_value=[_result([_chunk(0, "Approve budgets over 10k.", 0.8)])])
+    with patch("src.agent.agent_store.search_agent_definitions", new=search), \
+         patch("src.agent.agent_store.get_agent_definition", new=AsyncMock(return_value=_definition("Approve budgets over 50k."))):
+        agent = create_agent(main_llm=llm, packager_llm=llm, checkpointer=MemorySaver())
+        config = {"configurable": {"thread_id": "edited", "service_config": sample_config}}
+        await agent.ainvoke({"messages": [HumanMessage(content="Who approves the marketing budget?")]}, config=config)
+        await agent.ainvoke({"messages": [HumanMessage(content="And the marketing budget for Q4?")]}, config=config)
+
+    prompt = llm.ainvoke.await_args.args[0][0].content
+    assert "Approve budgets over 50k." in prompt
+    assert "10k" not in prompt
+
+
+@pytest.mark.asyncio
+async def test_deleted_agent_context_is_dropped(sample_config):
+    llm = _llm()
+    with patch("src.agent.agent_store.search_agent_definitions", new=AsyncMock(return_value=[_result([_chunk(0, "Approve budgets.", 0.8)])])), \
+         patch("src.agent.agent_store.get_agent_definition", new=AsyncMock(return_value=None)):
+        agent = create_agent(main_llm=llm, packager_llm=llm, checkpointer=MemorySaver())
+        config = {"configurable": {"thread_id": "deleted", "service_config": sample_config}}
+        await agent.ainvoke({"messages": [HumanMessage(content="Who approves the marketing budget?")]}, config=config)
+        result = await agent.ainvoke({"messages": [HumanMessage(content="And the marketing budget for Q4?")]}, config=config)
+
+    assert "Relevant Agent Context" not in llm.ainvoke.await_args.args[0][0].content
+    assert result["agent_context"].agent_id is None
+
+
+@pytest.mark.asyncio
+async def test_tool_pass_reloads_context_without_searching(sample_config):
+    llm = _llm()
+    llm.ainvoke = AsyncMock(side_effect=[
+        AIMessage(content="", tool_calls=[{"name": "browse_visualizations", "args": {}, "id": "t1", "type": "tool_call"}]),
+        AIMessage(content="LLM Response"),
+    ])
+    pool = MagicMock()
+    conn = AsyncMock()
+    searches = []
+
+    async def fetch(sql, *args):
+        if sql in (LEXICAL_SEARCH_SQL, AGENT_SEARCH_SQL):
+            searches.append(sql)
+            return [] if sql == LEXICAL_SEARCH_SQL else [{
+                "id": "a1", "name": "Finance", "full_content": "Full", "top_chunk": "Approve budgets over 10k.", "similarity": 0.9,
+                "chunk_indexes": [0], "chunk_contents": ["Approve budgets over 10k."], "chunk_scores": [0.9],
+            }]
+        return [{"chunk_index": 0, "content": "Approve budgets over 10k."}]
+
+    conn.fetch.side_effect = fetch
+    conn.transaction = MagicMock()
+    conn.fetchrow.return_value = {"id": "a1", "name": "Finance", "content": "Approve budgets over 10k."}
+    pool.acquire.return_value.__aenter__.return_value = conn
+    model = AsyncMock()
+    model.embed_query.return_value = [0.1, 0.2]
+
+    # No retrieval cache to fall back on
+    with patch.object(agent_store, "retrieval_cache", RetrievalCache(max_size=0)), \
+         patch("src.agent.agent_store.get_db_pool", new=AsyncMock(return_value=pool)), \
+         patch("src.agent.agent_store.get_embedding_service", return_value=model):
+        agent = create_agent(main_llm=llm, packager_llm=llm, checkpointer=MemorySaver())
+        config = {"configurable": {"thread_id": "tools", "service_config": sample_config}}
+        await agent.ainvoke({"messages": [HumanMessage(content="Who approves the marketing budget?")]}, config=config)
+
+    # One search and one embedding for the question; the pass after the tool loads the definition by id
+    assert llm.ainvoke.await_count == 2
+    assert len(searches) == 2
+    model.embed_query.assert_awaited_once()
+    conn.fetchrow.assert_awaited_once()
+    assert "Approve budgets over 10k." in llm.ainvoke.await_args.args[0][0].content
+
+
+@pytest.mark.asyncio
+async def test_prompt_keeps_a_stable_prefix_and_reports_cached_tokens(sample_config):
+    llm = _llm()
+    llm.ainvoke = AsyncMock(side_effect=lambda messages: AIMessage(
+        content="LLM Response",
+        usage_metadata={
+            "input_tokens": 100, "output_tokens": 10, "total_tokens": 110,
+            "input_token_details": {"cache_read": 80},
+        },
+    ))
+    results = [_result([_chunk(0, "Approve budgets over 10k.", 0.8)])]
+    with patch("src.agent.agent_store.search_agent_definitions", new=AsyncMock(return_value=results)):
+        agent = create_agent(main_llm=llm, packager_llm=llm, main_prompt="Static prompt.", checkpointer=MemorySaver())
+        config = {"configurable": {"thread_id": "prefix", "service_config": sample_config}}
+        await agent.aupdate_state(config, {"visualizations": {
+            "action": "add", "name": "sales", "title": "Sales", "description": "Sales chart",
+            "provider": "mfe1", "component": "chart", "content": {},
+        }})
+        result = await agent.ainvoke({"messages": [HumanMessage(content="Who approves budgets?")]}, config=config)
+
+    messages = llm.ainvoke.await_args.args[0]
+    # Static prompt, then agent context; the volatile visualization JSON stays out of the system prompt
+    assert messages[0].content.startswith("Static prompt.\n\n### Relevant Agent Context (Finance):")
+    assert "Approve budgets over 10k." in messages[0].content
+    assert "workspace_visualizations" not in messages[0].content
+    # It opens the current turn, after the cacheable history
+    assert messages[-2].content.startswith("[Workspace context supplied by the application, not written by the user]")
+    assert "<workspace_visualizations>" in messages[-2].content
+    assert messages[-1].content == "Who approves budgets?"
+
+    assert result["messages"][-1].usage_metadata["cached_tokens"] == 80
+
+
+@pytest.mark.asyncio
+async def test_system_prompt_is_byte_stable_while_visualizations_change(sample_config):
+    llm = _llm()
+    results = [_result([_chunk(0, "Approve budgets over 10k.", 0.8)])]
+    with patch("src.agent.agent_store.search_agent_definitions", new=AsyncMock(return_value=results)), \
+         patch("src.agent.agent_store.get_agent_definition", new=AsyncMock(return_value=_definition("Approve budgets over 10k."))):
+        agent = create_agent(main_llm=llm, packager_llm=llm, main_prompt="Static prompt.", checkpointer=MemorySaver())
+        config = {"configurable": {"thread_id": "viz", "service_config": sample_config}}
+        calls = []
+        for name in ("sales", "costs"):
+            await agent.aupdate_state(config, {"visualizations": {
+                "action": "add", "name": name, "title": name.title(), "description": f"{name} chart",
+                "provider": "mfe1", "component": "chart", "content": {},
+            }})
+            await agent.ainvoke({"messages": [HumanMessage(content="Who approves budgets?")]}, config=config)
+            calls.append(llm.ainvoke.await_args.args[0])
+
+    assert calls[0][0].content.encode() == calls[1][0].content.encode()
+    assert '"costs"' not in calls[0][-2].content
+    assert '"costs"' in calls[1][-2].content
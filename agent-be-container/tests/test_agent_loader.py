@@ -0,0 +1,105 @@
+"""
+Tests for bulk loading a directory of agent definitions
+"""
+import pytest
+import asyncio
+import time
+from unittest.mock import MagicMock, AsyncMock, patch
+import sys
+import os
+
+# Add container root to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.agent.agent_loader import load_agent_library, RateLimiter
+from src.agent.agent_store import content_hash
+
+
+@pytest.fixture
+def library(tmp_path):
+    (tmp_path / "finance.md").write_text("# Finance\nBudgets and forecasts.")
+    (tmp_path / "legal.md").write_text("# Legal\nContracts.")
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "nested" / "ops.md").write_text("# Ops\nRunbooks.")
+    (tmp_path / "notes.txt").write_text("not an agent")
+    return tmp_path
+
+
+@pytest.fixture
+def store():
+    pool = MagicMock()
+    conn = AsyncMock()
+    conn.transaction = MagicMock()
+    pool.acquire.return_value.__aenter__.return_value = conn
+    service = AsyncMock()
+    service.embed_documents.side_effect = lambda chunks: [[0.1] for _ in chunks]
+    with patch("src.agent.agent_loader.get_db_pool", new=AsyncMock(return_value=pool)), \
+         patch("src.agent.agent_loader.get_embedding_service", return_value=service), \
+         patch("src.agent.agent_loader.get_chunk_hashes", new=AsyncMock(return_value={})), \
+         patch("src.agent.agent_loader.write_agent_definitions", new_callable=AsyncMock) as write:
+        yield write, service
+
+
+@pytest.mark.asyncio
+async def test_skips_unchanged_and_batches_writes(library, store):
+    write, service = store
+    existing = {
+        "finance": {"id": "a-finance", "content_hash": content_hash("# Finance\nBudgets and forecasts.")},
+        "legal": {"id": "a-legal", "content_hash": "stale"},
+    }
+    progress = MagicMock()
+
+    with patch("src.agent.agent_loader.get_agent_hashes", new=AsyncMock(return_value=existing)):
+        stats = await load_agent_library(library, MagicMock(), batch_size=2, progress=progress)
+
+    assert (stats.scanned, stats.skipped, stats.loaded, stats.failed) == (3, 1, 2, [])
+    assert service.embed_documents.await_count == 2
+    write.assert_awaited_once()
+    written = {d["name"]: d for d in write.call_args.args[1]}
+    assert set(written) == {"legal", "ops"}
+    # Changed definitions keep their id so they are updated in place
+    assert written["legal"]["id"] == "a-legal"
+    assert written["legal"]["content_hash"] == content_hash("# Legal\nContracts.")
+    progress.assert_called_once_with(stats)
+
+
+@pytest.mark.asyncio
+async def test_failed_embedding_does_not_stop_other_files(library, store):
+    write, service = store
+
+    async def embed(chunks):
+        if "Contracts." in chunks[0]:
+            raise RuntimeError("quota exceeded")
+        return [[0.1] for _ in chunks]
+
+    service.embed_documents.side_effect = embed
+
+    with patch("src.agent.agent_loader.get_agent_hashes", new=AsyncMock(return_value={})):
+        stats = await load_agent_library(library, MagicMock(), batch_size=1)
+
+    assert stats.loaded == 2
+    assert stats.failed == [str(library / "legal.md")]
+    assert write.await_count == 2
+    assert "2 loaded" in stats.summary()
+
+
+@pytest.mark.asyncio
+async def test_write_failure_keeps_committed_batches(library, store):
+    write, service = store
+    write.side_effect = [None, RuntimeError("connection lost")]
+
+    with patch("src.agent.agent_loader.get_agent_hashes", new=AsyncMock(return_value={})):
+        with pytest.raises(RuntimeError):
+            await load_agent_library(library, MagicMock(), batch_size=1, concurrency=1)
+
+    assert write.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_spaces_calls():
+    limiter = RateLimiter(rate=50)
+    started = time.monotonic()
+
+    await asyncio.gather(*(limiter.wait() for _ in range(4)))
+
+    assert time.monotonic() - started >= 0.06
@@ -78,3 +78,9 @@ class TestConfigValidation:
             shutdownDuration="PT5S"
         )
         assert config.url.port == 8079
+
+    def test_db_pool_sizes_bound_connections(self, sample_config):
+        """Test both pools are sized from PersistenceConfig"""
+        db = sample_config.persistence.db
+        assert db.checkpoint_pool_size == 10
+        assert db.max_connections == db.pool_size + db.checkpoint_pool_size
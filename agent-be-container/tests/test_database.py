@@ -8,7 +8,7 @@ import os
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
 
-from src.database import init_db_pool, close_db_pool, get_db_pool
+from src.database import init_db_pool, close_db_pool, get_db_pool, DbPoolCollector, init_connection
 from src.config import DbOptionsConfig, DbConnectionConfig
 
 
@@ -33,14 +33,17 @@ class TestDatabasePoolLifecycle:
         mock_config = MagicMock(spec=DbOptionsConfig)
         mock_config.connection = mock_conn
         mock_config.pool_size = 10
+        mock_config.pool_min_size = 2
         mock_config.acquire_timeout = 5
 
         pool = await init_db_pool(mock_config)
 
         mock_create_pool.assert_called_once_with(
             dsn=dsn,
+            min_size=2,
             max_size=10,
-            timeout=5
+            timeout=5,
+            init=init_connection
         )
         assert pool == mock_pool
 
@@ -81,3 +84,52 @@ class TestDatabasePoolLifecycle:
 
         with pytest.raises(Exception, match="Database pool not initialized"):
             await get_db_pool()
+
+    @pytest.mark.asyncio
+    async def test_init_connection_registers_vector_codec(self):
+        """Test new connections get the binary pgvector codec"""
+        conn = AsyncMock()
+        await init_connection(conn)
+
+        assert conn.set_type_codec.await_args_list[0].args[0] == "vector"
+        assert conn.set_type_codec.await_args_list[0].kwargs["format"] == "binary"
+
+    @pytest.mark.asyncio
+    async def test_init_connection_without_vector_extension(self):
+        """Test connections still open before the vector extension exists"""
+        conn = AsyncMock()
+        conn.set_type_codec.side_effect = ValueError("unknown type: public.vector")
+
+        await init_connection(conn)
+
+
+class TestDbPoolCollector:
+    """Test pool utilisation metrics"""
+
+    def test_collects_app_and_checkpoint_pools(self):
+        import src.database as database
+        app_pool = MagicMock()
+        app_pool.get_size.return_value = 4
+        app_pool.get_idle_size.return_value = 3
+        app_pool.get_max_size.return_value = 20
+        database.pool = app_pool
+
+        checkpoint_pool = MagicMock(max_size=10)
+        checkpoint_pool.get_stats.return_value = {"pool_size": 2, "pool_available": 1, "requests_waiting": 5}
+
+        try:
+            metrics = {m.name: m for m in DbPoolCollector(lambda: checkpoint_pool).collect()}
+        finally:
+            database.pool = None
+
+        def value(name, pool_label):
+            return next(s.value for s in metrics[name].samples if s.labels["pool"] == pool_label)
+
+        assert value("db_pool_size", "app") == 4
+        assert value("db_pool_idle", "app") == 3
+        assert value("db_pool_max_size", "checkpoint") == 10
+        assert value("db_pool_requests_waiting", "checkpoint") == 5
+
+    def test_collects_nothing_before_pools_exist(self):
+        metrics = list(DbPoolCollector(lambda: None).collect())
+        assert all(not m.samples for m in metrics)
@@ -0,0 +1,214 @@
+"""
+Tests for the async, batching embedding service
+"""
+import pytest
+import asyncio
+from unittest.mock import MagicMock, AsyncMock, patch
+import threading
+from datetime import timedelta
+from langchain_core.embeddings import Embeddings
+import sys
+import os
+
+# Add container root to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.agent.embeddings import EmbeddingService, EmbeddingServiceCollector, EmbeddingRegistry, is_transient
+
+
+def _model():
+    model = AsyncMock()
+    model.aembed_query.side_effect = lambda text: [float(len(text))]
+    model.aembed_documents.side_effect = lambda texts, **kwargs: [[float(len(t))] for t in texts]
+    return model
+
+
+@pytest.mark.asyncio
+async def test_concurrent_queries_share_one_call():
+    model = _model()
+    service = EmbeddingService(model, batch_window=0.01, query_batch_kwargs={"task_type": "RETRIEVAL_QUERY"})
+
+    results = await asyncio.gather(
+        service.embed_query("a"),
+        service.embed_query("bb"),
+        service.embed_query("a"),
+    )
+
+    assert results == [[1.0], [2.0], [1.0]]
+    model.aembed_documents.assert_awaited_once_with(["a", "bb"], task_type="RETRIEVAL_QUERY")
+    model.aembed_query.assert_not_called()
+    assert (service.calls["query"], service.texts["query"]) == (1, 2)
+
+
+@pytest.mark.asyncio
+async def test_single_query_uses_query_endpoint():
+    model = _model()
+    service = EmbeddingService(model, batch_window=0.001)
+
+    assert await service.embed_query("abc") == [3.0]
+    model.aembed_query.assert_awaited_once_with("abc")
+
+
+@pytest.mark.asyncio
+async def test_full_batch_is_sent_without_waiting():
+    model = _model()
+    service = EmbeddingService(model, max_batch_size=2, batch_window=60)
+
+    results = await asyncio.wait_for(asyncio.gather(service.embed_query("a"), service.embed_query("bb")), timeout=1)
+
+    assert results == [[1.0], [2.0]]
+
+
+@pytest.mark.asyncio
+async def test_retries_with_backoff():
+    model = _model()
+    model.aembed_query.side_effect = [TimeoutError("read timed out"), [1.0]]
+    service = EmbeddingService(model, batch_window=0.001, max_retries=2, retry_backoff=0.1)
+
+    with patch("src.agent.embeddings.asyncio.sleep", new_callable=AsyncMock) as sleep:
+        assert await service.embed_query("a") == [1.0]
+
+    sleep.assert_awaited_once()
+    assert service.errors == 1
+
+
+class ProviderError(Exception):
+    """A provider SDK error carrying the HTTP status, like google.genai's APIError."""
+    def __init__(self, code: int):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+def _wrapped(error: Exception) -> Exception:
+    try:
+        raise RuntimeError("Error embedding content") from error
+    except RuntimeError as e:
+        return e
+
+
+def test_only_transient_errors_are_retryable():
+    assert is_transient(_wrapped(ProviderError(429)))
+    assert is_transient(_wrapped(ProviderError(503)))
+    assert is_transient(_wrapped(TimeoutError()))
+    assert not is_transient(_wrapped(ProviderError(401)))
+    assert not is_transient(ValueError("bad input"))
+
+
+@pytest.mark.asyncio
+async def test_permanent_errors_are_not_retried():
+    model = _model()
+    model.aembed_query.side_effect = _wrapped(ProviderError(400))
+    service = EmbeddingService(model, batch_window=0.001, max_retries=3)
+
+    with patch("src.agent.embeddings.asyncio.sleep", new_callable=AsyncMock) as sleep:
+        with pytest.raises(RuntimeError):
+            await service.embed_query("a")
+
+    sleep.assert_not_awaited()
+    assert model.aembed_query.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_exhausted_retries_fail_every_waiter():
+    model = _model()
+    model.aembed_documents.side_effect = ConnectionError("down")
+    service = EmbeddingService(model, batch_window=0.01, max_retries=1, retry_backoff=0)
+
+    results = await asyncio.gather(service.embed_query("a"), service.embed_query("b"), return_exceptions=True)
+
+    assert all(isinstance(r, ConnectionError) for r in results)
+    assert model.aembed_documents.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_documents_are_embedded_in_batches():
+    model = _model()
+    service = EmbeddingService(model, max_batch_size=2)
+
+    embeddings = await service.embed_documents(["a", "bb", "ccc"])
+
+    assert embeddings == [[1.0], [2.0], [3.0]]
+    assert model.aembed_documents.await_count == 2
+
+
+class SyncEmbeddings(Embeddings):
+    """Synchronous model recording which thread each call ran on."""
+
+    def __init__(self):
+        self.threads = []
+
+    def embed_documents(self, texts):
+        self.threads.append(threading.get_ident())
+        return [[1.0] for _ in texts]
+
+    def embed_query(self, text):
+        self.threads.append(threading.get_ident())
+        return [1.0]
+
+
+@pytest.mark.asyncio
+async def test_synchronous_model_runs_off_the_event_loop():
+    model = SyncEmbeddings()
+    service = EmbeddingService(model, batch_window=0.001)
+
+    assert await service.embed_query("hello") == [1.0]
+    assert await service.embed_documents(["a", "b"]) == [[1.0], [1.0]]
+    assert threading.get_ident() not in model.threads
+
+
+@pytest.mark.asyncio
+async def test_collector_reports_latency_and_batch_size():
+    model = _model()
+    service = EmbeddingService(model)
+    await service.embed_documents(["a", "bb"])
+
+    registry = EmbeddingRegistry()
+    registry.services[("google_genai", "m1", "k")] = service
+    collector = EmbeddingServiceCollector(registry)
+    samples = {(s.name, s.labels.get("kind")): s.value for metric in collector.collect() for s in metric.samples}
+
+    assert samples[("embedding_batch_size_count", "document")] == 1
+    assert samples[("embedding_batch_size_sum", "document")] == 2
+    assert samples[("embedding_latency_seconds_count", "document")] == 1
+    assert samples[("embedding_errors_total", None)] == 0
+    assert samples[("embedding_client_up", None)] == 1
+
+
+def _config(model="gemini-embedding-001", key="secret"):
+    config = MagicMock()
+    config.model_provider = "google_genai"
+    config.model = model
+    config.google_api_key.get_secret_value.return_value = key
+    config.batch_size = 64
+    config.batch_window = timedelta(milliseconds=1)
+    config.max_retries = 0
+    config.retry_backoff = timedelta(0)
+    return config
+
+
+def test_registry_reuses_client_per_config():
+    registry = EmbeddingRegistry()
+    with patch("src.agent.embeddings.get_embeddings_model", side_effect=lambda config: _model()) as factory:
+        first = registry.get(_config())
+        again = registry.get(_config())
+        other_key = registry.get(_config(key="other"))
+
+    assert first is again
+    assert other_key is not first
+    assert factory.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_warm_up_failure_marks_client_down():
+    registry = EmbeddingRegistry()
+    model = _model()
+    model.aembed_query.side_effect = RuntimeError("unauthenticated")
+    config = _config()
+
+    with patch("src.agent.embeddings.get_embeddings_model", return_value=model):
+        assert await registry.warm_up(config) is False
+
+    service = registry.get(config)
+    assert service.consecutive_failures == 1
+    samples = {s.name: s.value for metric in EmbeddingServiceCollector(registry).collect() for s in metric.samples if s.name.startswith("embedding_client")}
+    assert samples["embedding_client_up"] == 0
@@ -131,3 +131,22 @@ class TestHamsPrestartChecks:
 
         # Should be ready if no checks configured
         assert result is True
+
+
+class TestHamsReadiness:
+    """Test readiness reflects run scheduler saturation"""
+
+    def test_not_ready_when_run_queue_saturated(self, hams_config):
+        from src import keys
+        from src.agent.scheduler import RunScheduler
+
+        base_app = web.Application()
+        scheduler = RunScheduler(max_concurrent=1, max_queued=1, max_per_user=5)
+        base_app[keys.events] = scheduler
+        hams = Hams(hams_app=web.Application(), app=base_app, config=hams_config, registry=CollectorRegistry())
+
+        scheduler.reserve("a")
+        assert hams.ready() is True
+
+        scheduler.reserve("b")
+        assert hams.ready() is False
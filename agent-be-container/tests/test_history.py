@@ -0,0 +1,133 @@
+"""
+Tests for the incremental / conditional history endpoint
+"""
+import pytest
+import json
+from unittest.mock import MagicMock, AsyncMock, patch
+from aiohttp.test_utils import make_mocked_request
+from langchain_core.messages import HumanMessage, AIMessage
+from langgraph.checkpoint.memory import MemorySaver
+import sys
+import os
+
+# Add container root to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src import keys
+from src.agent import create_agent
+from src.agent.handler import LLMHandler
+from src.main import get_history, history_etag
+
+
+THREAD_ROW = {
+    "user_id": "u1",
+    "color": None,
+    "status_msg": None,
+    "status_updated_at": None,
+    "checkpoint_id": "cp-1",
+}
+
+
+@pytest.fixture
+def mock_pool():
+    pool = MagicMock()
+    conn = AsyncMock()
+    conn.fetchrow.return_value = THREAD_ROW
+    pool.acquire.return_value.__aenter__.return_value = conn
+    return pool
+
+
+async def _make_handler(sample_config) -> LLMHandler:
+    llm = MagicMock()
+    llm.bind_tools.return_value = llm
+    handler = LLMHandler(db_dsn="postgresql://localhost/fake", service_config=sample_config)
+    handler.agent = create_agent(llm, llm, checkpointer=MemorySaver())
+    config = {"configurable": {"thread_id": "t1"}}
+    await handler.agent.aupdate_state(config, {"messages": [
+        HumanMessage(content="first", id="h1"),
+        AIMessage(content="answer one", id="a1"),
+        HumanMessage(content="second", id="h2"),
+        AIMessage(content="answer two", id="a2"),
+    ]}, as_node="initial")
+    return handler
+
+
+def _request(sample_config, llm_handler, query: str = "", headers: dict | None = None):
+    app = {keys.config: sample_config, "llm_handler": llm_handler}
+    request = make_mocked_request("GET", f"/api/threads/t1/history{query}", headers=headers or {}, match_info={"thread_id": "t1"}, app=app)
+    request["user_id"] = "u1"
+    return request
+
+
+def test_history_etag_changes_with_checkpoint_and_status():
+    base = history_etag("cp-1", None, None)
+    assert base == history_etag("cp-1", None, None)
+    assert base != history_etag("cp-2", None, None)
+    assert base != history_etag("cp-1", "Running: llm...", None)
+    assert base != history_etag("cp-1", None, None, after="a1")
+
+
+@pytest.mark.asyncio
+async def test_history_returns_messages_after_cursor(sample_config, mock_pool):
+    llm_handler = await _make_handler(sample_config)
+    with patch("src.main.get_db_pool", new=AsyncMock(return_value=mock_pool)):
+        response = await get_history(_request(sample_config, llm_handler, "?after=a1"))
+
+    body = json.loads(response.body)
+    assert [m["id"] for m in body["messages"]] == ["h2", "a2"]
+    assert body["incremental"] is True
+    assert body["cursor"] == "a2"
+    assert response.headers["ETag"]
+
+
+@pytest.mark.asyncio
+async def test_history_unknown_cursor_returns_everything(sample_config, mock_pool):
+    llm_handler = await _make_handler(sample_config)
+    with patch("src.main.get_db_pool", new=AsyncMock(return_value=mock_pool)):
+        response = await get_history(_request(sample_config, llm_handler, "?after=missing"))
+
+    body = json.loads(response.body)
+    assert len(body["messages"]) == 4
+    assert body["incremental"] is False
+
+
+@pytest.mark.asyncio
+async def test_history_not_modified_skips_checkpoint_load(sample_config, mock_pool):
+    llm_handler = await _make_handler(sample_config)
+    etag = history_etag("cp-1", None, None)
+    llm_handler.get_thread_state = AsyncMock()
+
+    with patch("src.main.get_db_pool", new=AsyncMock(return_value=mock_pool)):
+        response = await get_history(_request(sample_config, llm_handler, headers={"If-None-Match": etag}))
+
+    assert response.status == 304
+    assert response.headers["ETag"] == etag
+    llm_handler.get_thread_state.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_history_full_etag_does_not_match_cursor_request(sample_config, mock_pool):
+    llm_handler = await _make_handler(sample_config)
+    full_etag = history_etag("cp-1", None, None)
+
+    with patch("src.main.get_db_pool", new=AsyncMock(return_value=mock_pool)):
+        response = await get_history(_request(sample_config, llm_handler, "?after=a1", headers={"If-None-Match": full_etag}))
+
+    # A 304 here would leave the client with the full list cached for an incremental request
+    assert response.status == 200
+    assert response.headers["ETag"] != full_etag
+
+
+@pytest.mark.asyncio
+async def test_history_exposes_partial_answer(sample_config, mock_pool):
+    llm_handler = await _make_handler(sample_config)
+    llm_handler.events.append_partial("t1", "run-1", "Half an ans")
+    stale_etag = history_etag("cp-1", None, None)
+
+    with patch("src.main.get_db_pool", new=AsyncMock(return_value=mock_pool)):
+        response = await get_history(_request(sample_config, llm_handler, headers={"If-None-Match": stale_etag}))
+
+    # New tokens change the ETag even though no checkpoint was written
+    assert response.status == 200
+    body = json.loads(response.body)
+    assert body["partial_answer"] == {"id": "run-1", "content": "Half an ans"}
@@ -0,0 +1,96 @@
+"""
+Tests for conversation history windowing and the rolling summary
+"""
+import pytest
+from unittest.mock import MagicMock, AsyncMock
+import sys
+import os
+from langchain_core.messages import HumanMessage, AIMessage, ToolMessage, SystemMessage
+from langchain_core.language_models import BaseChatModel
+from langgraph.checkpoint.memory import MemorySaver
+
+# Add container root to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.agent import create_agent, create_post_turn
+from src.agent.history import window_history
+from src.agent.structs import AgentState, FollowUpQuestions, HistorySummary
+
+
+def _turn(n, tool_output="ok"):
+    return [
+        HumanMessage(content=f"question {n}", id=f"h{n}"),
+        AIMessage(content="", id=f"c{n}", tool_calls=[{"name": "lookup", "args": {}, "id": f"t{n}", "type": "tool_call"}]),
+        ToolMessage(content=tool_output, tool_call_id=f"t{n}", name="lookup", id=f"r{n}"),
+        AIMessage(content=f"answer {n}", id=f"a{n}"),
+    ]
+
+
+def test_keeps_last_turns_and_trims_earlier_tool_output():
+    messages = _turn(1) + _turn(2, "x" * 400) + _turn(3, "y" * 400)
+
+    window = window_history(messages, HistorySummary(text="Asked about 1.", messages=4), keep_turns=2, max_tool_tokens=10, token_budget=10_000)
+
+    assert [m.id for m in window.messages][0] == "h2"
+    assert window.messages[2].content.startswith("x" * 40 + "\n[... 360 characters")
+    # The current turn's tool output is sent verbatim
+    assert window.messages[-2].content == "y" * 400
+    assert window.summary == "Asked about 1."
+    assert window.tokens_saved > 0
+
+
+def test_turns_not_yet_summarised_stay_in_the_window():
+    messages = _turn(1) + _turn(2) + _turn(3)
+
+    summarised = window_history(messages, None, keep_turns=1, max_tool_tokens=10, token_budget=10_000)
+    dropped = window_history(messages, None, keep_turns=1, max_tool_tokens=10, token_budget=10_000, summarised=False)
+
+    assert summarised.messages[0].id == "h1"
+    assert dropped.messages[0].id == "h3"
+
+
+def test_over_budget_drops_oldest_turns_but_never_the_current_one():
+    messages = _turn(1, "x" * 400) + _turn(2, "y" * 4000)
+
+    window = window_history(messages, None, keep_turns=5, max_tool_tokens=1000, token_budget=50)
+
+    assert window.messages[0].id == "h2"
+    assert window.messages[-2].content == "y" * 4000
+
+
+@pytest.mark.asyncio
+async def test_old_turns_are_summarised_and_left_out_of_the_prompt(sample_config):
+    sample_config.history.keep_turns = 1
+    llm = MagicMock(spec=BaseChatModel)
+    llm.bind_tools.return_value = llm
+    llm.ainvoke = AsyncMock(side_effect=lambda messages: AIMessage(
+        content="Summary of the thread", usage_metadata={"input_tokens": 1, "output_tokens": 1, "total_tokens": 2}
+    ))
+    structured = MagicMock()
+    structured.ainvoke = AsyncMock(return_value={
+        "parsed": FollowUpQuestions(follow_up_questions=["Q1", "Q2", "Q3"]),
+        "raw": MagicMock(usage_metadata=None),
+    })
+    llm.with_structured_output.return_value = structured
+
+    agent = create_agent(main_llm=llm, packager_llm=llm, checkpointer=MemorySaver())
+    post_turn = create_post_turn(llm)
+    config = {"configurable": {"thread_id": "window", "service_config": sample_config}}
+
+    async def turn(content):
+        await agent.ainvoke({"messages": [HumanMessage(content=content)]}, config=config)
+        state = await agent.aget_state(config)
+        await agent.aupdate_state(config, await post_turn(AgentState(**state.values), config), as_node="post_process")
+        return (await agent.aget_state(config)).values
+
+    await turn("Hi, tell me about budgets " * 20)
+    result = await turn("And contracts?")
+
+    main_call = next(c for c in llm.ainvoke.await_args_list if c.args[0][-1].content == "And contracts?")
+    prompt, *history = main_call.args[0]
+    assert isinstance(prompt, SystemMessage)
+    assert "### Earlier Conversation (summary):\nSummary of the thread" in prompt.content
+    assert [m.content for m in history] == ["And contracts?"]
+
+    assert result["history_summary"].messages == 4
+    assert result["messages"][-1].usage_metadata["history_tokens_saved"] > 0
@@ -133,3 +133,46 @@ async def test_handler_passes_bypass_flag(mock_get_pool, mock_llm):
     found_feedback = any("learning_mode_feedback" in m.additional_kwargs for m in ai_msgs)
     assert found_feedback is False
     assert any(m.content == "LLM Response" for m in ai_msgs)
+
+@pytest.mark.asyncio
+async def test_speculative_learning_mode_parks_an_answer(mock_llm, sample_config):
+    sample_config.learning_mode.speculative = True
+    mock_llm.ainvoke = AsyncMock(side_effect=lambda messages: AIMessage(content="Speculative answer"))
+    with patch("src.agent.agent_store.search_agent_definitions", new=AsyncMock(return_value=[])):
+        agent = create_agent(main_llm=mock_llm, packager_llm=mock_llm, checkpointer=MemorySaver())
+        config = {"configurable": {"thread_id": "test-speculative", "service_config": sample_config}}
+        await agent.aupdate_state(config, {"learning_mode_enabled": True})
+
+        result = await agent.ainvoke({"messages": [HumanMessage(content="Analyze this", id="h1")]}, config=config)
+
+        # Only the review is shown; the answer waits in the state
+        assert "learning_mode_feedback" in result["messages"][-1].additional_kwargs
+        assert not any(m.content == "Speculative answer" for m in result["messages"])
+        speculation = result["speculative_answer"]
+        assert speculation.query == "Analyze this" and speculation.human_id == "h1"
+        assert mock_llm.ainvoke.await_count == 1
+
+        # Keeping the original prompt shows the parked answer without another LLM call
+        kept = HumanMessage(content="Analyze this", additional_kwargs={"learning_mode_bypass": True})
+        result = await agent.ainvoke({"messages": [kept]}, config=config)
+
+    assert mock_llm.ainvoke.await_count == 1
+    assert result["messages"][-1].content == "Speculative answer"
+    assert result["messages"][-1].additional_kwargs["packaged"] is True
+    assert result["speculative_answer"] is None
+
+@pytest.mark.asyncio
+async def test_speculative_answer_not_used_for_a_changed_prompt(mock_llm, sample_config):
+    sample_config.learning_mode.speculative = True
+    mock_llm.ainvoke = AsyncMock(side_effect=lambda messages: AIMessage(content=f"Answer to {messages[-1].content}"))
+    with patch("src.agent.agent_store.search_agent_definitions", new=AsyncMock(return_value=[])):
+        agent = create_agent(main_llm=mock_llm, packager_llm=mock_llm, checkpointer=MemorySaver())
+        config = {"configurable": {"thread_id": "test-speculative-changed", "service_config": sample_config}}
+        await agent.aupdate_state(config, {"learning_mode_enabled": True})
+
+        await agent.ainvoke({"messages": [HumanMessage(content="Analyze this")]}, config=config)
+        improved = HumanMessage(content="Better prompt", additional_kwargs={"learning_mode_bypass": True})
+        result = await agent.ainvoke({"messages": [improved]}, config=config)
+
+    assert mock_llm.ainvoke.await_count == 2
+    assert result["messages"][-1].content == "Answer to Better prompt"
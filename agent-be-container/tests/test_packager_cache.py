@@ -0,0 +1,123 @@
+"""
+Tests for the exact-match cache of packager structured outputs
+"""
+import json
+import pytest
+from datetime import timedelta
+from unittest.mock import MagicMock, AsyncMock, patch
+import sys
+import os
+from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
+from langgraph.checkpoint.memory import MemorySaver
+
+# Add container root to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.agent import create_agent, packager_cache as packager_cache_module
+from src.agent.packager_cache import CachedStructuredOutput, PackagerCache, PackagerCacheCollector, request_key
+from src.agent.structs import PromptFeedback
+
+FEEDBACK = PromptFeedback(feedback_text="Good prompt", improved_prompt="Better prompt", alternatives=["Alt 1"])
+
+
+def _packager():
+    llm = MagicMock()
+    llm._identifying_params = {"model": "packager", "temperature": 0}
+    structured = MagicMock()
+    structured.ainvoke = AsyncMock(side_effect=lambda messages: {
+        "parsed": FEEDBACK.model_copy(),
+        "raw": AIMessage(content="", usage_metadata={"input_tokens": 10, "output_tokens": 20, "total_tokens": 30}),
+        "parsing_error": None,
+    })
+    llm.with_structured_output.return_value = structured
+    return llm, structured
+
+
+def test_request_key_depends_on_schema_model_and_messages():
+    messages = [SystemMessage(content="Review"), HumanMessage(content="Analyze this")]
+
+    assert request_key(PromptFeedback, {"model": "a"}, messages) == request_key(PromptFeedback, {"model": "a"}, list(messages))
+    assert request_key(PromptFeedback, {"model": "a"}, messages) != request_key(PromptFeedback, {"model": "b"}, messages)
+    assert request_key(PromptFeedback, {"model": "a"}, messages) != request_key(PromptFeedback, {"model": "a"}, messages[1:])
+
+
+@pytest.mark.asyncio
+async def test_lru_is_bounded_and_entries_expire():
+    cache = PackagerCache(max_size=2, ttl=timedelta(minutes=5))
+    for key in ("a", "b", "c"):
+        await cache.put(key, PromptFeedback, {"key": key})
+
+    assert len(cache) == 2
+    assert await cache.get("a") is None
+    assert await cache.get("c") == {"key": "c"}
+
+    cache.ttl = timedelta(seconds=-1)
+    await cache.put("d", PromptFeedback, {"key": "d"})
+    assert await cache.get("d") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+@pytest.mark.asyncio
+async def test_repeated_request_is_served_without_a_model_call():
+    llm, structured = _packager()
+    cached = CachedStructuredOutput(llm, PromptFeedback, PackagerCache(max_size=10))
+    messages = [SystemMessage(content="Review"), HumanMessage(content="Analyze this")]
+
+    first = await cached.ainvoke(messages)
+    second = await cached.ainvoke(messages)
+
+    structured.ainvoke.assert_awaited_once()
+    assert first["raw"].usage_metadata["total_tokens"] == 30
+    assert second["parsed"] == FEEDBACK
+    assert second["raw"].usage_metadata["total_tokens"] == 0
+
+
+@pytest.mark.asyncio
+async def test_disabled_cache_passes_through():
+    llm, structured = _packager()
+    cached = CachedStructuredOutput(llm, PromptFeedback, PackagerCache(max_size=0))
+    messages = [HumanMessage(content="Analyze this")]
+
+    await cached.ainvoke(messages)
+    await cached.ainvoke(messages)
+
+    assert structured.ainvoke.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_persisted_outputs_are_shared_through_the_table():
+    pool = MagicMock()
+    conn = AsyncMock()
+    conn.fetchrow.return_value = {"value": json.dumps(FEEDBACK.model_dump()), "remaining": 60.0}
+    pool.acquire.return_value.__aenter__.return_value = conn
+    llm, structured = _packager()
+    cache = PackagerCache(max_size=10, persist=True)
+
+    with patch("src.agent.packager_cache.get_db_pool", new=AsyncMock(return_value=pool)):
+        result = await CachedStructuredOutput(llm, PromptFeedback, cache).ainvoke([HumanMessage(content="Analyze this")])
+        # Now held in memory too
+        await CachedStructuredOutput(llm, PromptFeedback, cache).ainvoke([HumanMessage(content="Analyze this")])
+
+    structured.ainvoke.assert_not_awaited()
+    conn.fetchrow.assert_awaited_once()
+    assert result["parsed"] == FEEDBACK
+    assert (cache.hits, cache.db_hits, cache.misses) == (1, 1, 0)
+
+    metrics = {m.name: m for m in PackagerCacheCollector(cache).collect()}
+    assert [s.value for s in metrics["packager_cache_hits"].samples if s.name.endswith("_total")] == [1, 1]
+
+
+@pytest.mark.asyncio
+async def test_learning_mode_feedback_is_cached_across_threads():
+    llm, structured = _packager()
+    llm.bind_tools.return_value = llm
+
+    with patch.object(packager_cache_module, "packager_cache", PackagerCache(max_size=10)):
+        agent = create_agent(main_llm=llm, packager_llm=llm, checkpointer=MemorySaver())
+        for thread_id in ("first", "second"):
+            config = {"configurable": {"thread_id": thread_id}}
+            await agent.aupdate_state(config, {"learning_mode_enabled": True})
+            result = await agent.ainvoke({"messages": [HumanMessage(content="Analyze this")]}, config=config)
+            assert result["messages"][-1].additional_kwargs["learning_mode_feedback"]["feedback_text"] == "Good prompt"
+
+    structured.ainvoke.assert_awaited_once()
@@ -0,0 +1,183 @@
+"""
+Tests for the semantic response cache of the main LLM node
+"""
+import json
+import pytest
+from unittest.mock import MagicMock, AsyncMock, patch
+import sys
+import os
+from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.language_models import BaseChatModel
+from langgraph.checkpoint.memory import MemorySaver
+
+# Add container root to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.agent import create_agent, response_cache
+from src.agent.response_cache import (
+    CacheProbe,
+    ResponseCacheStats,
+    context_hash,
+    lookup_response,
+    store_response,
+    LOOKUP_SQL,
+    STORE_SQL,
+    entities,
+)
+
+
+@pytest.fixture
+def cache_db():
+    """Patches the database and embedding model used by response_cache with fresh stats."""
+    pool = MagicMock()
+    conn = AsyncMock()
+    conn.fetch.return_value = []
+    pool.acquire.return_value.__aenter__.return_value = conn
+    model = AsyncMock()
+    model.embed_query.return_value = [0.1, 0.2]
+
+    with patch.object(response_cache, "response_cache_stats", ResponseCacheStats()), \
+         patch("src.agent.response_cache.get_db_pool", new=AsyncMock(return_value=pool)), \
+         patch("src.agent.response_cache.get_embedding_service", return_value=model):
+        yield conn
+
+
+def test_context_hash_covers_prompt_and_earlier_messages():
+    earlier = [HumanMessage(content="Hi"), AIMessage(content="Hello")]
+
+    assert context_hash("prompt", earlier) == context_hash("prompt", list(earlier))
+    assert context_hash("prompt", earlier) != context_hash("other prompt", earlier)
+    assert context_hash("prompt", earlier) != context_hash("prompt", [])
+
+
+def _row(query, similarity, content="Finance does."):
+    return {"query": query, "content": json.dumps(content), "total_tokens": 120, "similarity": similarity}
+
+
+@pytest.mark.asyncio
+async def test_lookup_hits_only_above_min_similarity(cache_db, sample_config):
+    sample_config.response_cache.min_similarity = 0.9
+    messages = [HumanMessage(content="Who approves budgets?")]
+
+    cache_db.fetch.return_value = [_row("Who approves the budgets?", 0.95)]
+    hit = await lookup_response("prompt", messages, "a1", "u1", sample_config)
+    cache_db.fetch.return_value = [_row("Who approves the budgets?", 0.8)]
+    miss = await lookup_response("prompt", messages, "a1", "u1", sample_config)
+
+    # Entries are scoped to the asking user
+    assert cache_db.fetch.await_args.args == (LOOKUP_SQL, context_hash("prompt", []), "u1", "a1", [0.1, 0.2])
+    assert hit.hit and hit.message().content == "Finance does."
+    assert hit.message().usage_metadata["response_cache_tokens_saved"] == 120
+    assert not miss.hit
+    assert (response_cache.response_cache_stats.hits, response_cache.response_cache_stats.misses) == (1, 1)
+
+
+@pytest.mark.asyncio
+async def test_same_user_hits_repeat_question_in_another_thread(cache_db, sample_config):
+    sample_config.response_cache.context_turns = 1
+    question = HumanMessage(content="Who approves budgets?")
+    first_thread = [HumanMessage(content="Hi"), AIMessage(content="Hello"), question]
+    # A longer conversation that has just said the same
+    second_thread = [HumanMessage(content="Plot sales"), AIMessage(content="Done"), HumanMessage(content="Hi"), AIMessage(content="Hello"), question]
+
+    probe = await lookup_response("prompt", first_thread, "a1", "u1", sample_config)
+    await store_response(probe, AIMessage(content="Finance does."), sample_config)
+    stored_key = cache_db.execute.await_args_list[0].args[2]
+    cache_db.fetch.return_value = [_row("Who approves budgets?", 1.0)]
+    hit = await lookup_response("prompt", second_thread, "a1", "u1", sample_config)
+
+    assert cache_db.fetch.await_args.args[1] == stored_key
+    assert hit.hit and hit.content == "Finance does."
+
+
+@pytest.mark.asyncio
+async def test_lookup_failure_is_a_miss_not_an_error(cache_db, sample_config):
+    cache_db.fetch.side_effect = Exception("relation does not exist")
+
+    assert await lookup_response("prompt", [HumanMessage(content="Hi")], None, "u1", sample_config) is None
+    assert response_cache.response_cache_stats.errors == 1
+
+
+@pytest.mark.asyncio
+async def test_questions_about_other_entities_are_not_served(cache_db, sample_config):
+    sample_config.response_cache.min_similarity = 0.9
+    # Nearly identical embeddings, different order numbers
+    cache_db.fetch.return_value = [_row("What is the status of order 1234?", 0.99, "Order 1234 has shipped.")]
+
+    other = await lookup_response("prompt", [HumanMessage(content="What is the status of order 1235?")], None, "u1", sample_config)
+    same = await lookup_response("prompt", [HumanMessage(content="what's the status of Order 1234")], None, "u1", sample_config)
+
+    assert not other.hit
+    assert same.hit and same.content == "Order 1234 has shipped."
+    assert entities("Invoice INV-2026-17 from 2026-01-05?") == {"inv-2026-17", "2026-01-05"}
+
+
+@pytest.mark.asyncio
+async def test_questions_without_a_user_are_not_cached(cache_db, sample_config):
+    assert await lookup_response("prompt", [HumanMessage(content="Who approves budgets?")], None, None, sample_config) is None
+    cache_db.fetch.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_answers_that_call_tools_are_not_stored(cache_db, sample_config):
+    probe = CacheProbe(context_hash="k", user_id="u1", agent_id=None, query="Plot sales", embedding=[0.1])
+    tool_call = AIMessage(content="", tool_calls=[{"name": "add_visualization", "args": {}, "id": "t1", "type": "tool_call"}])
+
+    await store_response(probe, tool_call, sample_config)
+    cache_db.execute.assert_not_awaited()
+
+    await store_response(probe, AIMessage(content="Sales are up", usage_metadata={"input_tokens": 5, "output_tokens": 5, "total_tokens": 10}), sample_config)
+    sql, *args = cache_db.execute.await_args_list[0].args
+    assert sql == STORE_SQL
+    assert args[1:7] == ["k", "u1", None, "Plot sales", [0.1], json.dumps("Sales are up")]
+    assert args[7] == 10
+
+
+def _llm():
+    llm = MagicMock(spec=BaseChatModel)
+    llm.bind_tools.return_value = llm
+    llm.ainvoke = AsyncMock(side_effect=lambda messages: AIMessage(
+        content="LLM Response", usage_metadata={"input_tokens": 100, "output_tokens": 10, "total_tokens": 110}
+    ))
+    return llm
+
+
+@pytest.mark.asyncio
+async def test_llm_node_answers_repeat_question_from_cache(sample_config):
+    sample_config.response_cache.enabled = True
+    llm = _llm()
+    hit = CacheProbe(context_hash="k", user_id="u1", agent_id=None, query="Hi", embedding=[0.1], content="Cached", similarity=0.97, total_tokens=110)
+    with patch("src.agent.agent_store.search_agent_definitions", new=AsyncMock(return_value=[])), \
+         patch("src.agent.response_cache.lookup_response", new=AsyncMock(return_value=hit)) as lookup, \
+         patch("src.agent.response_cache.store_response", new=AsyncMock()) as store:
+        agent = create_agent(main_llm=llm, packager_llm=llm, checkpointer=MemorySaver())
+        config = {"configurable": {"thread_id": "cached", "user_id": "u1", "service_config": sample_config}}
+        result = await agent.ainvoke({"messages": [HumanMessage(content="Hi")]}, config=config)
+
+    llm.ainvoke.assert_not_awaited()
+    store.assert_not_awaited()
+    lookup.assert_awaited_once()
+    assert lookup.await_args.args[3] == "u1"
+    last = result["messages"][-1]
+    assert last.content == "Cached"
+    assert last.additional_kwargs["response_cache"] == {"similarity": 0.97}
+    assert last.usage_metadata["response_cache_tokens_saved"] == 110
+
+
+@pytest.mark.asyncio
+async def test_llm_node_stores_answer_on_miss(sample_config):
+    sample_config.response_cache.enabled = True
+    llm = _llm()
+    miss = CacheProbe(context_hash="k", user_id="u1", agent_id=None, query="Hi", embedding=[0.1])
+    with patch("src.agent.agent_store.search_agent_definitions", new=AsyncMock(return_value=[])), \
+         patch("src.agent.response_cache.lookup_response", new=AsyncMock(return_value=miss)), \
+         patch("src.agent.response_cache.store_response", new=AsyncMock()) as store:
+        agent = create_agent(main_llm=llm, packager_llm=llm, checkpointer=MemorySaver())
+        config = {"configurable": {"thread_id": "miss", "user_id": "u1", "service_config": sample_config}}
+        result = await agent.ainvoke({"messages": [HumanMessage(content="Hi")]}, config=config)
+
+    llm.ainvoke.assert_awaited_once()
+    stored_probe, stored_response, _ = store.await_args.args
+    assert stored_probe is miss
+    assert stored_response.content == "LLM Response"
+    assert result["messages"][-1].content == "LLM Response"
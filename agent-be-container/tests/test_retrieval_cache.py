@@ -0,0 +1,320 @@
+"""
+Tests for agent store ingestion and the retrieval cache
+"""
+import pytest
+from datetime import timedelta
+from unittest.mock import MagicMock, AsyncMock, patch, DEFAULT
+import sys
+import os
+
+# Add container root to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.agent import agent_store
+from src.agent.search_benchmark import run_search_benchmark
+from src.agent.agent_store import (
+    RetrievalCache,
+    RetrievalCacheCollector,
+    normalize_query,
+    search_agent_definitions,
+    delete_agent_definition,
+    save_agent_definition,
+    embed_changed_chunks,
+    content_hash,
+    AGENT_SEARCH_SQL,
+    LEXICAL_SEARCH_SQL,
+    fuse_rankings,
+)
+
+
+ROW = {
+    "id": "a1", "name": "Finance", "full_content": "Full", "top_chunk": "Chunk", "similarity": 0.9,
+    "chunk_indexes": [0], "chunk_contents": ["Chunk"], "chunk_scores": [0.9],
+}
+RESULT = {
+    "id": "a1", "name": "Finance", "full_content": "Full", "top_chunk": "Chunk", "similarity": 0.9, "rank": None,
+    "chunks": [{"index": 0, "content": "Chunk", "similarity": 0.9}],
+}
+
+
+@pytest.fixture
+def store():
+    """Patches the embedding model and database used by agent_store with a fresh cache."""
+    pool = MagicMock()
+    conn = AsyncMock()
+    conn.fetch.return_value = [ROW]
+    conn.lexical_rows = []
+
+    async def fetch(sql, *args):
+        # Full-text lookups find nothing unless a test sets conn.lexical_rows
+        return conn.lexical_rows if sql == LEXICAL_SEARCH_SQL else DEFAULT
+
+    conn.fetch.side_effect = fetch
+    conn.transaction = MagicMock()
+    pool.acquire.return_value.__aenter__.return_value = conn
+    model = AsyncMock()
+    model.embed_query.return_value = [0.1, 0.2]
+
+    with patch.object(agent_store, "retrieval_cache", RetrievalCache()), \
+         patch("src.agent.agent_store.get_db_pool", new=AsyncMock(return_value=pool)), \
+         patch("src.agent.agent_store.get_embedding_service", return_value=model):
+        yield conn, model
+
+
+def test_normalize_query():
+    assert normalize_query("  What is   Finance? ") == normalize_query("what is finance")
+
+
+def test_lru_eviction():
+    cache = RetrievalCache(max_size=2)
+    cache.put(("a", 1), [], cache.generation)
+    cache.put(("b", 1), [], cache.generation)
+    cache.get(("a", 1))
+    cache.put(("c", 1), [], cache.generation)
+
+    assert cache.get(("a", 1)) == []
+    assert cache.get(("b", 1)) is None
+    assert len(cache) == 2
+
+
+def test_ttl_expiry():
+    cache = RetrievalCache(ttl=timedelta(seconds=10))
+    with patch("src.agent.agent_store.time.monotonic", return_value=100.0):
+        cache.put(("a", 1), [ROW], cache.generation)
+    with patch("src.agent.agent_store.time.monotonic", return_value=105.0):
+        assert cache.get(("a", 1)) == [ROW]
+    with patch("src.agent.agent_store.time.monotonic", return_value=111.0):
+        assert cache.get(("a", 1)) is None
+    assert len(cache) == 0
+
+
+def test_stale_generation_is_not_stored():
+    cache = RetrievalCache()
+    generation = cache.generation
+    cache.invalidate()
+    cache.put(("a", 1), [ROW], generation)
+
+    assert cache.get(("a", 1)) is None
+
+
+@pytest.mark.asyncio
+async def test_repeat_search_skips_embedding_and_query(store, sample_config):
+    conn, model = store
+    config = sample_config
+
+    first = await search_agent_definitions("Finance help", config, limit=1)
+    second = await search_agent_definitions("finance help!", config, limit=1)
+
+    assert first == second == [RESULT]
+    model.embed_query.assert_called_once()
+    # One full-text lookup and one vector search, both only on the first call
+    assert conn.fetch.await_count == 2
+    assert (agent_store.retrieval_cache.hits, agent_store.retrieval_cache.misses) == (1, 1)
+
+
+@pytest.mark.asyncio
+async def test_search_uses_index_scan_with_configured_ef_search(store, sample_config):
+    conn, model = store
+    sample_config.embedding_client.search_candidates = 25
+    sample_config.embedding_client.hnsw_ef_search = 10
+
+    await search_agent_definitions("Finance help", sample_config, limit=3)
+
+    set_sql, ef_search = conn.execute.await_args.args
+    assert "hnsw.ef_search" in set_sql
+    # ef_search is raised to the candidate count so the index scan can return enough rows
+    assert ef_search == "25"
+    sql, vector, limit, candidates = conn.fetch.await_args.args
+    assert sql == AGENT_SEARCH_SQL
+    assert "ROW_NUMBER" not in sql
+    assert (vector, limit, candidates) == ([0.1, 0.2], 3, 25)
+
+
+def _lexical_row(id, name, rank, exact_name=False):
+    return {
+        "id": id, "name": name, "full_content": "Full", "top_chunk": "Chunk", "rank": rank, "exact_name": exact_name,
+        "chunk_indexes": None if exact_name else [0], "chunk_contents": None if exact_name else ["Chunk"],
+        "chunk_scores": None if exact_name else [rank],
+    }
+
+
+@pytest.mark.asyncio
+async def test_exact_agent_name_skips_embedding(store, sample_config):
+    conn, model = store
+    conn.lexical_rows = [_lexical_row("a2", "Legal", 0.0, exact_name=True), _lexical_row("a1", "Finance", 0.3)]
+
+    results = await search_agent_definitions("Legal", sample_config, limit=1)
+
+    assert [r["name"] for r in results] == ["Legal"]
+    # No cosine similarity was computed
+    assert results[0]["similarity"] is None
+    # Asked for by name, so the whole definition is offered rather than the matching chunks
+    assert results[0]["chunks"] == []
+    model.embed_query.assert_not_called()
+    sql, query, normalized, limit = conn.fetch.await_args.args
+    assert (query, normalized) == ("Legal", "legal")
+
+
+@pytest.mark.asyncio
+async def test_lexical_and_vector_results_are_fused(store, sample_config):
+    conn, model = store
+    conn.lexical_rows = [_lexical_row("a2", "Legal", 0.4), _lexical_row("a1", "Finance", 0.2)]
+
+    results = await search_agent_definitions("contract budget", sample_config, limit=2)
+
+    model.embed_query.assert_awaited_once()
+    # Finance is ranked by both retrievers, Legal only lexically
+    assert [r["id"] for r in results] == ["a1", "a2"]
+    assert (results[0]["similarity"], results[0]["rank"]) == (0.9, 0.2)
+    # Each score keeps its own scale: Legal has a full-text rank but no cosine similarity
+    assert (results[1]["similarity"], results[1]["rank"]) == (None, 0.4)
+    assert results[1]["chunks"] == [{"index": 0, "content": "Chunk", "rank": 0.4}]
+    assert "exact_name" not in results[1]
+
+
+@pytest.mark.asyncio
+async def test_strong_full_text_rank_skips_embedding(store, sample_config):
+    conn, model = store
+    conn.lexical_rows = [_lexical_row("a1", "Finance", 0.6)]
+
+    results = await search_agent_definitions("quarterly budget approval", sample_config, limit=1)
+
+    assert sample_config.embedding_client.lexical_skip_rank < 0.6
+    model.embed_query.assert_not_called()
+    assert (results[0]["similarity"], results[0]["rank"]) == (None, 0.6)
+
+
+@pytest.mark.asyncio
+async def test_hybrid_search_can_be_disabled(store, sample_config):
+    conn, model = store
+    sample_config.embedding_client.hybrid_search = False
+
+    await search_agent_definitions("Finance help", sample_config, limit=1)
+
+    assert all(c.args[0] != LEXICAL_SEARCH_SQL for c in conn.fetch.await_args_list)
+
+
+def test_fuse_rankings_prefers_agents_in_both_lists():
+    a, b, c = ({"id": x} for x in "abc")
+    fused = fuse_rankings([[a, b], [c, b]], k=60, limit=3)
+
+    assert [r["id"] for r in fused] == ["b", "a", "c"]
+    assert fused[0]["score"] == pytest.approx(1 / 62 + 1 / 62)
+
+
+def test_fuse_rankings_fills_scores_from_the_other_ranking():
+    vector = [{"id": "a", "similarity": 0.8, "rank": None, "chunks": []}]
+    lexical = [{"id": "a", "similarity": None, "rank": 0.3, "chunks": [{"index": 1, "content": "x", "rank": 0.3}]}]
+
+    fused = fuse_rankings([vector, lexical], k=60, limit=1)
+
+    assert (fused[0]["similarity"], fused[0]["rank"]) == (0.8, 0.3)
+    assert fused[0]["chunks"] == lexical[0]["chunks"]
+
+
+@pytest.mark.asyncio
+async def test_delete_invalidates(store, sample_config):
+    conn, model = store
+    config = sample_config
+
+    await search_agent_definitions("Finance help", config, limit=1)
+    await delete_agent_definition("a1")
+    await search_agent_definitions("Finance help", config, limit=1)
+
+    assert model.embed_query.call_count == 2
+
+
+def test_collector_reports_hit_ratio():
+    cache = RetrievalCache()
+    cache.put(("a", 1), [], cache.generation)
+    cache.get(("a", 1))
+    cache.get(("b", 1))
+    cache.get(("a", 1))
+
+    metrics = {m.name: m.samples[0].value for m in RetrievalCacheCollector(cache).collect()}
+
+    assert metrics["agent_retrieval_cache_hits"] == 2
+    assert metrics["agent_retrieval_cache_misses"] == 1
+    assert metrics["agent_retrieval_cache_hit_ratio"] == pytest.approx(2 / 3)
+    assert metrics["agent_retrieval_cache_entries"] == 1
+
+
+@pytest.mark.asyncio
+async def test_save_copies_chunks_in_one_call(store):
+    conn, model = store
+    model.embed_documents.return_value = [[0.1, 0.2], [0.3, 0.4]]
+    config = MagicMock()
+
+    with patch("src.agent.agent_store.RecursiveCharacterTextSplitter") as splitter:
+        splitter.return_value.split_text.return_value = ["chunk one", "chunk two"]
+        agent_id = await save_agent_definition("Finance", "chunk one chunk two", config)
+
+    conn.copy_records_to_table.assert_awaited_once()
+    table = conn.copy_records_to_table.call_args.args[0]
+    kwargs = conn.copy_records_to_table.call_args.kwargs
+    assert table == "agent_definition_chunks"
+    assert kwargs["columns"] == ["id", "agent_id", "chunk_index", "content", "embedding", "content_hash"]
+    records = kwargs["records"]
+    assert [(str(r[1]), r[2], r[3], r[4]) for r in records] == [
+        (agent_id, 0, "chunk one", [0.1, 0.2]),
+        (agent_id, 1, "chunk two", [0.3, 0.4]),
+    ]
+    # One upsert for the definition, one chunk DELETE and the response cache invalidation, no per-chunk statements
+    conn.executemany.assert_awaited_once()
+    assert conn.execute.await_count == 2
+    invalidate_sql, agent_ids = conn.execute.await_args.args
+    assert invalidate_sql.startswith("DELETE FROM llm_response_cache")
+    assert agent_ids == [agent_id]
+
+
+@pytest.mark.asyncio
+async def test_embed_changed_chunks_reuses_identical_text():
+    service = AsyncMock()
+    service.embed_documents.side_effect = lambda chunks: [[0.5] for _ in chunks]
+    existing = {content_hash("intro"): ["c-intro"], content_hash("outro"): ["c-outro"]}
+    definition = {"content": "ignored"}
+
+    with patch("src.agent.agent_store.split_definition", return_value=["new paragraph", "intro", "outro"]):
+        embedded = await embed_changed_chunks(definition, existing, service)
+
+    assert embedded == 1
+    service.embed_documents.assert_awaited_once_with(["new paragraph"])
+    assert definition["chunk_ids"] == [None, "c-intro", "c-outro"]
+    assert definition["embeddings"] == [[0.5], None, None]
+
+
+@pytest.mark.asyncio
+async def test_update_only_writes_changed_chunks(store):
+    conn, model = store
+    kept = "00000000-0000-0000-0000-000000000001"
+    agent_id = "00000000-0000-0000-0000-0000000000aa"
+    conn.fetch.return_value = [{"id": kept, "agent_id": agent_id, "content_hash": content_hash("unchanged")}]
+    model.embed_documents.side_effect = lambda chunks: [[0.9] for _ in chunks]
+
+    with patch("src.agent.agent_store.split_definition", return_value=["edited", "unchanged"]):
+        await save_agent_definition("Finance", "edited unchanged", MagicMock(), agent_id=agent_id)
+
+    model.embed_documents.assert_awaited_once_with(["edited"])
+    delete_sql, agent_ids, kept_ids = conn.execute.await_args_list[0].args
+    assert "NOT (id = ANY" in delete_sql
+    assert (agent_ids, [str(k) for k in kept_ids]) == ([agent_id], [kept])
+    renumber_sql, renumber_ids, renumber_indexes = conn.execute.await_args_list[1].args
+    assert "unnest" in renumber_sql
+    assert renumber_indexes == [1]
+    records = conn.copy_records_to_table.call_args.kwargs["records"]
+    assert [(r[2], r[3], r[5]) for r in records] == [(0, "edited", content_hash("edited"))]
+
+
+@pytest.mark.asyncio
+async def test_search_benchmark_reports_both_queries_and_cleans_up():
+    conn = AsyncMock()
+    conn.transaction = MagicMock()
+
+    results = await run_search_benchmark(conn, [200, 100], dimensions=4, agents=2, queries=3, baseline_queries=2)
+
+    assert [(r["chunks"], r["query"], r["samples"]) for r in results] == [
+        (100, "hnsw", 3), (100, "full-scan", 2), (200, "hnsw", 3), (200, "full-scan", 2),
+    ]
+    executed = [c.args[0] for c in conn.execute.await_args_list]
+    assert sum("CREATE INDEX" in sql for sql in executed) == 1
+    assert executed[-1].startswith("DROP SCHEMA IF EXISTS agent_search_bench")
@@ -0,0 +1,163 @@
+"""
+Tests for the durable run queue and resumption of interrupted graph runs
+"""
+import pytest
+import asyncio
+from datetime import timedelta
+from unittest.mock import MagicMock, AsyncMock, patch
+from langchain_core.messages import HumanMessage, AIMessage
+from langgraph.checkpoint.memory import MemorySaver
+import sys
+import os
+
+# Add container root to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.agent import create_agent
+from src.agent.handler import LLMHandler
+from src.agent.run_queue import RunQueue
+
+
+@pytest.fixture
+def mock_llm():
+    llm = MagicMock()
+    llm.bind_tools.return_value = llm
+    llm.ainvoke = AsyncMock(return_value=AIMessage(content="LLM Response"))
+    structured = MagicMock()
+    structured.ainvoke = AsyncMock(return_value={
+        "parsed": MagicMock(follow_up_questions=["Q1", "Q2", "Q3"]),
+        "raw": MagicMock(usage_metadata=None)
+    })
+    llm.with_structured_output.return_value = structured
+    return llm
+
+
+@pytest.fixture
+def mock_pool():
+    pool = MagicMock()
+    conn = AsyncMock()
+    pool.acquire.return_value.__aenter__.return_value = conn
+    return pool, conn
+
+
+def _handler(mock_llm) -> LLMHandler:
+    handler = LLMHandler(db_dsn="postgresql://localhost/fake", main_llm=mock_llm, packager_llm=mock_llm)
+    handler.agent = create_agent(mock_llm, mock_llm, checkpointer=MemorySaver())
+    handler.run_queue = AsyncMock()
+    handler.lease = AsyncMock()
+    return handler
+
+
+async def _seed_interrupted_thread(handler: LLMHandler, thread_id: str):
+    """Writes a human message the way chat_async does, leaving the graph pending."""
+    config = {"configurable": {"thread_id": thread_id}}
+    await handler.agent.aupdate_state(config, {"messages": [HumanMessage(content="Resume me", id="h1")]}, as_node="initial")
+
+
+class TestRunQueue:
+    """Test run queue SQL interactions"""
+
+    @pytest.mark.asyncio
+    async def test_claim_maps_rows(self, mock_pool):
+        pool, conn = mock_pool
+        conn.fetch.return_value = [{"run_id": "r1", "thread_id": "t1", "user_id": "u1", "attempts": 2}]
+        queue = RunQueue("worker-a", timedelta(seconds=30))
+
+        with patch("src.agent.run_queue.get_db_pool", new=AsyncMock(return_value=pool)):
+            runs = await queue.claim(3)
+
+        assert runs == [{"run_id": "r1", "thread_id": "t1", "user_id": "u1", "attempts": 2}]
+        sql, worker_id, lease, limit = conn.fetch.call_args.args
+        assert "FOR UPDATE SKIP LOCKED" in sql
+        assert (worker_id, lease, limit) == ("worker-a", timedelta(seconds=30), 3)
+
+    @pytest.mark.asyncio
+    async def test_purge_deletes_old_failed_and_orphaned_cancelled_runs(self, mock_pool):
+        pool, conn = mock_pool
+        conn.fetchval.return_value = 2
+        queue = RunQueue("worker-a", timedelta(seconds=30), timedelta(days=1))
+
+        with patch("src.agent.run_queue.get_db_pool", new=AsyncMock(return_value=pool)):
+            assert await queue.purge() == 2
+
+        sql, retention, lease = conn.fetchval.call_args.args
+        assert "status = 'failed' AND finished_at <" in sql
+        assert "status = 'cancelled' AND heartbeat_at <" in sql
+        assert (retention, lease) == (timedelta(days=1), timedelta(seconds=30))
+
+    @pytest.mark.asyncio
+    async def test_claim_without_capacity_skips_query(self, mock_pool):
+        pool, conn = mock_pool
+        queue = RunQueue("worker-a", timedelta(seconds=30))
+
+        with patch("src.agent.run_queue.get_db_pool", new=AsyncMock(return_value=pool)):
+            assert await queue.claim(0) == []
+
+        conn.fetch.assert_not_called()
+
+
+class TestRunResumption:
+    """Test LLMHandler resuming runs claimed from the queue"""
+
+    @pytest.mark.asyncio
+    @patch("src.agent.handler.get_db_pool", new_callable=AsyncMock)
+    async def test_resumes_from_checkpoint_and_completes(self, mock_get_pool, mock_llm, mock_pool):
+        mock_get_pool.return_value = mock_pool[0]
+        handler = _handler(mock_llm)
+        await _seed_interrupted_thread(handler, "t-resume")
+
+        await handler._resume_run({"run_id": "r1", "thread_id": "t-resume", "user_id": "u1", "attempts": 2})
+        await asyncio.sleep(0.5)
+
+        state = await handler.get_thread_state("t-resume")
+        assert any(isinstance(m, AIMessage) and m.content == "LLM Response" for m in state.values["messages"])
+        handler.run_queue.complete.assert_awaited_once_with("r1")
+        handler.lease.take_over.assert_awaited_once_with("t-resume")
+        handler.lease.release.assert_awaited_once_with("t-resume")
+        assert handler.scheduler.running == 0
+
+    @pytest.mark.asyncio
+    @patch("src.agent.handler.get_db_pool", new_callable=AsyncMock)
+    async def test_gives_up_after_max_attempts(self, mock_get_pool, mock_llm, mock_pool):
+        mock_get_pool.return_value = mock_pool[0]
+        handler = _handler(mock_llm)
+        await _seed_interrupted_thread(handler, "t-fail")
+
+        await handler._resume_run({"run_id": "r1", "thread_id": "t-fail", "user_id": "u1", "attempts": handler.max_run_attempts + 1})
+
+        handler.run_queue.fail.assert_awaited_once_with("r1")
+        mock_llm.ainvoke.assert_not_called()
+        assert handler.scheduler.waiting == 0
+
+    @pytest.mark.asyncio
+    @patch("src.agent.handler.get_db_pool", new_callable=AsyncMock)
+    async def test_finished_graph_is_only_marked_complete(self, mock_get_pool, mock_llm, mock_pool):
+        mock_get_pool.return_value = mock_pool[0]
+        handler = _handler(mock_llm)
+
+        await handler._resume_run({"run_id": "r1", "thread_id": "t-empty", "user_id": "u1", "attempts": 2})
+
+        handler.run_queue.complete.assert_awaited_once_with("r1")
+        mock_llm.ainvoke.assert_not_called()
+
+    @pytest.mark.asyncio
+    @patch("src.agent.handler.get_db_pool", new_callable=AsyncMock)
+    async def test_shutdown_hands_runs_back_without_completing(self, mock_get_pool, mock_llm, mock_pool):
+        mock_get_pool.return_value = mock_pool[0]
+        handler = _handler(mock_llm)
+        handler.run_queue.enqueue.return_value = "r1"
+
+        never = asyncio.Event()
+
+        async def hang(*args, **kwargs):
+            await never.wait()
+
+        mock_llm.ainvoke = AsyncMock(side_effect=hang)
+        await handler.chat_async("t-shutdown", "Slow question", user_id="u1")
+        await asyncio.sleep(0.2)
+
+        await handler.close()
+
+        handler.run_queue.enqueue.assert_awaited_once_with("t-shutdown", "u1")
+        handler.run_queue.complete.assert_not_called()
+        handler.run_queue.release_all.assert_awaited_once()
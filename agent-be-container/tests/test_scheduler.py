@@ -0,0 +1,114 @@
+"""
+Tests for admission control and the bounded background run scheduler
+"""
+import pytest
+import asyncio
+import sys
+import os
+
+# Add container root to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.agent.scheduler import RunScheduler, RunRejected
+
+
+def _blocking_run(started: list, name: str, gate: asyncio.Event):
+    async def run():
+        started.append(name)
+        await gate.wait()
+    return run
+
+
+class TestAdmission:
+    """Test capacity checks performed at reservation time"""
+
+    def test_rejects_when_global_capacity_exhausted(self):
+        scheduler = RunScheduler(max_concurrent=1, max_queued=1, max_per_user=5)
+        scheduler.reserve("a")
+        scheduler.reserve("b")
+
+        with pytest.raises(RunRejected) as exc:
+            scheduler.reserve("c")
+        assert exc.value.status == 503
+
+    def test_rejects_user_over_per_user_limit(self):
+        scheduler = RunScheduler(max_concurrent=5, max_queued=5, max_per_user=1)
+        scheduler.reserve("a")
+
+        with pytest.raises(RunRejected) as exc:
+            scheduler.reserve("a")
+        assert exc.value.status == 429
+        # Other users are unaffected
+        scheduler.reserve("b")
+
+    def test_release_returns_capacity(self):
+        scheduler = RunScheduler(max_concurrent=1, max_queued=0, max_per_user=1)
+        slot = scheduler.reserve("a")
+        assert not scheduler.spareCapacity()
+
+        slot.release()
+        slot.release()
+
+        assert scheduler.spareCapacity()
+        scheduler.reserve("a")
+
+
+class TestDispatch:
+    """Test bounded execution and fairness"""
+
+    @pytest.mark.asyncio
+    async def test_limits_concurrency_and_drains_queue(self):
+        scheduler = RunScheduler(max_concurrent=2, max_queued=5, max_per_user=5)
+        gate = asyncio.Event()
+        started = []
+
+        for i in range(4):
+            scheduler.reserve("a").start(_blocking_run(started, f"a{i}", gate))
+        await asyncio.sleep(0)
+
+        assert started == ["a0", "a1"]
+        assert scheduler.running == 2
+        assert scheduler.waiting == 2
+
+        gate.set()
+        for _ in range(10):
+            await asyncio.sleep(0)
+
+        assert started == ["a0", "a1", "a2", "a3"]
+        assert scheduler.running == 0
+        assert scheduler.waiting == 0
+
+    @pytest.mark.asyncio
+    async def test_round_robin_across_users(self):
+        scheduler = RunScheduler(max_concurrent=1, max_queued=10, max_per_user=5)
+        blocker = asyncio.Event()
+        gate = asyncio.Event()
+        started = []
+
+        scheduler.reserve("busy").start(_blocking_run(started, "first", blocker))
+        for i in range(3):
+            scheduler.reserve("busy").start(_blocking_run(started, f"busy{i}", gate))
+        scheduler.reserve("quiet").start(_blocking_run(started, "quiet0", gate))
+        await asyncio.sleep(0)
+
+        gate.set()
+        blocker.set()
+        for _ in range(20):
+            await asyncio.sleep(0)
+
+        # The quiet user's run is not stuck behind the busy user's backlog
+        assert started.index("quiet0") < started.index("busy1")
+
+    @pytest.mark.asyncio
+    async def test_failed_run_frees_its_worker(self):
+        scheduler = RunScheduler(max_concurrent=1, max_queued=1, max_per_user=2)
+
+        async def boom():
+            raise ValueError("boom")
+
+        scheduler.reserve("a").start(boom)
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+        assert scheduler.running == 0
+        assert scheduler.waiting == 0
@@ -0,0 +1,77 @@
+"""
+Tests for the in-memory thread status bus and its batched database flushes
+"""
+import pytest
+import asyncio
+from unittest.mock import MagicMock, AsyncMock, patch
+import sys
+import os
+
+# Add container root to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.agent.status import ThreadStatusBus
+
+
+@pytest.fixture
+def mock_pool():
+    pool = MagicMock()
+    conn = AsyncMock()
+    pool.acquire.return_value.__aenter__.return_value = conn
+    return pool, conn
+
+
+class TestThreadStatusBus:
+    """Test status coalescing and flushing"""
+
+    @pytest.mark.asyncio
+    async def test_rapid_updates_coalesce_into_one_write(self, mock_pool):
+        pool, conn = mock_pool
+        bus = ThreadStatusBus(flush_interval=0.05)
+
+        with patch("src.agent.status.get_db_pool", new=AsyncMock(return_value=pool)):
+            bus.set("t1", "Agent starting up...")
+            bus.set("t1", "Running: llm...")
+            bus.set("t2", "Executing tool: search...")
+            assert bus.get("t1")[0] == "Running: llm..."
+
+            await asyncio.sleep(0.15)
+
+        conn.executemany.assert_awaited_once()
+        rows = conn.executemany.call_args.args[1]
+        assert sorted((r[2], r[0]) for r in rows) == [
+            ("t1", "Running: llm..."),
+            ("t2", "Executing tool: search..."),
+        ]
+
+    @pytest.mark.asyncio
+    async def test_discard_drops_pending_write(self, mock_pool):
+        pool, conn = mock_pool
+        bus = ThreadStatusBus(flush_interval=0.05)
+
+        with patch("src.agent.status.get_db_pool", new=AsyncMock(return_value=pool)):
+            bus.set("t1", "Running: llm...")
+            bus.discard("t1")
+            await asyncio.sleep(0.15)
+
+        assert bus.get("t1") is None
+        conn.executemany.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_close_flushes_outstanding_status(self, mock_pool):
+        pool, conn = mock_pool
+        bus = ThreadStatusBus(flush_interval=60)
+
+        with patch("src.agent.status.get_db_pool", new=AsyncMock(return_value=pool)):
+            bus.set("t1", "Running: tools...")
+            await bus.close()
+
+        conn.executemany.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_flush_errors_are_swallowed(self):
+        bus = ThreadStatusBus(flush_interval=60)
+        with patch("src.agent.status.get_db_pool", new=AsyncMock(side_effect=Exception("Database pool not initialized"))):
+            bus.set("t1", "Running: llm...")
+            await bus.close()
+        assert bus.get("t1")[0] == "Running: llm..."
@@ -0,0 +1,276 @@
+"""
+Tests for the live thread event stream fed from LLMHandler
+"""
+import pytest
+import asyncio
+from unittest.mock import MagicMock, AsyncMock, patch
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langgraph.checkpoint.memory import MemorySaver
+import sys
+import os
+
+# Add container root to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.agent import create_agent, create_post_turn
+from src.agent.handler import LLMHandler
+from src.agent.events import ThreadEventBroker, message_to_dict, chunk_text, format_sse
+from src.main import add_cors_headers, auth_middleware, thread_events
+
+
+class StreamingFakeModel(GenericFakeChatModel):
+    """Fake chat model that streams its reply and ignores bound tools."""
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+@pytest.fixture
+def packager_llm():
+    llm = MagicMock()
+    structured = MagicMock()
+    structured.ainvoke = AsyncMock(return_value={
+        "parsed": MagicMock(follow_up_questions=["Q1", "Q2", "Q3"]),
+        "raw": MagicMock(usage_metadata=None)
+    })
+    llm.with_structured_output.return_value = structured
+    return llm
+
+
+async def _collect(queue: asyncio.Queue, timeout: float = 5.0) -> list[tuple[str, dict]]:
+    events = []
+    while True:
+        event, data = await asyncio.wait_for(queue.get(), timeout=timeout)
+        events.append((event, data))
+        if event == "done":
+            return events
+
+
+class TestThreadEventBroker:
+    """Test the in-process event fan-out"""
+
+    @pytest.mark.asyncio
+    async def test_publish_reaches_all_subscribers(self):
+        broker = ThreadEventBroker()
+        q1 = broker.subscribe("t1")
+        q2 = broker.subscribe("t1")
+        other = broker.subscribe("t2")
+
+        broker.publish("t1", "status", {"status_msg": "Running: llm..."})
+
+        assert q1.get_nowait() == ("status", {"status_msg": "Running: llm..."})
+        assert q2.get_nowait() == ("status", {"status_msg": "Running: llm..."})
+        assert other.empty()
+
+    @pytest.mark.asyncio
+    async def test_finish_marks_inactive_and_sends_done(self):
+        broker = ThreadEventBroker()
+        broker.start("t1")
+        queue = broker.subscribe("t1")
+        assert broker.is_active("t1")
+
+        broker.finish("t1")
+
+        assert not broker.is_active("t1")
+        assert queue.get_nowait() == ("done", {"thread_id": "t1"})
+
+    def test_partial_buffer_accumulates_and_resets_per_call(self):
+        broker = ThreadEventBroker()
+        broker.append_partial("t1", "run-1", "Hel")
+        broker.append_partial("t1", "run-1", "lo")
+        assert broker.get_partial("t1") == {"id": "run-1", "content": "Hello"}
+
+        # A new LLM call (e.g. after a tool round) starts a fresh buffer
+        broker.append_partial("t1", "run-2", "Next")
+        assert broker.get_partial("t1") == {"id": "run-2", "content": "Next"}
+
+        broker.finish("t1")
+        assert broker.get_partial("t1") is None
+
+    @pytest.mark.asyncio
+    async def test_unsubscribe_stops_delivery(self):
+        broker = ThreadEventBroker()
+        queue = broker.subscribe("t1")
+        broker.unsubscribe("t1", queue)
+        broker.publish("t1", "status", {"status_msg": "x"})
+        assert queue.empty()
+
+
+def test_chunk_text_handles_content_blocks():
+    chunk = MagicMock(content=[{"type": "text", "text": "Hel"}, "lo", {"type": "image_url"}])
+    assert chunk_text(chunk) == "Hello"
+    assert chunk_text(MagicMock(content="plain")) == "plain"
+
+
+def test_format_sse_frame():
+    assert format_sse("token", {"content": "hi"}) == b'event: token\ndata: {"content": "hi"}\n\n'
+
+
+def test_message_to_dict_includes_tool_calls_without_mutating():
+    msg = AIMessage(
+        content="",
+        id="m1",
+        tool_calls=[{"name": "add_visualization", "args": {"a": 1}, "id": "tc1"}],
+        additional_kwargs={"timestamp": "2026-01-01T00:00:00+00:00"},
+    )
+    msg_dict = message_to_dict(msg)
+
+    assert msg_dict["id"] == "m1"
+    assert msg_dict["created_at"] == "2026-01-01T00:00:00+00:00"
+    assert msg_dict["additional_kwargs"]["tool_calls"][0]["name"] == "add_visualization"
+    assert "tool_calls" not in msg.additional_kwargs
+
+
+@pytest.mark.asyncio
+@patch("src.agent.handler.get_db_pool", new_callable=AsyncMock)
+async def test_handler_streams_status_tokens_and_final_message(mock_get_pool, packager_llm):
+    mock_pool = MagicMock()
+    mock_pool.acquire.return_value.__aenter__.return_value = AsyncMock()
+    mock_get_pool.return_value = mock_pool
+
+    main_llm = StreamingFakeModel(messages=iter([AIMessage(content="streamed answer")]))
+    handler = LLMHandler(db_dsn="postgresql://localhost/fake", main_llm=main_llm, packager_llm=packager_llm)
+    handler.agent = create_agent(main_llm, packager_llm, checkpointer=MemorySaver())
+
+    queue = handler.events.subscribe("t-stream")
+    await handler.chat_async("t-stream", "Tell me something")
+    assert handler.events.is_active("t-stream")
+
+    events = await _collect(queue)
+    kinds = [e for e, _ in events]
+
+    assert "status" in kinds
+    tokens = "".join(d["content"] for e, d in events if e == "token")
+    assert tokens == "streamed answer"
+
+    final = [d for e, d in events if e == "message"]
+    assert final and final[-1]["type"] == "ai"
+    assert final[-1]["content"] == "streamed answer"
+    assert kinds[-1] == "done"
+    assert not handler.events.is_active("t-stream")
+    assert handler.events.get_partial("t-stream") is None
+
+
+async def _until_post_turn(handler: LLMHandler, thread_id: str) -> None:
+    while thread_id not in handler._post_turns:
+        await asyncio.sleep(0.01)
+
+
+def _post_turn_handler(packager_llm, answers: int = 1):
+    """Handler with a post-turn job whose follow-up call waits for the returned gate."""
+    main_llm = StreamingFakeModel(messages=iter([AIMessage(content=f"answer {i}") for i in range(answers)]))
+    handler = LLMHandler(db_dsn="postgresql://localhost/fake", main_llm=main_llm, packager_llm=packager_llm)
+    handler.agent = create_agent(main_llm, packager_llm, checkpointer=MemorySaver())
+    handler.lease = AsyncMock()
+    handler.lease.acquire.return_value = True
+
+    gate = asyncio.Event()
+    structured = packager_llm.with_structured_output.return_value
+    result = structured.ainvoke.return_value
+
+    async def wait_for_gate(messages):
+        await gate.wait()
+        return result
+
+    structured.ainvoke = AsyncMock(side_effect=wait_for_gate)
+    handler.post_turn = create_post_turn(packager_llm)
+    return handler, gate
+
+
+@pytest.mark.asyncio
+@patch("src.agent.handler.get_db_pool", new_callable=AsyncMock)
+async def test_follow_ups_are_attached_after_the_turn_finishes(mock_get_pool, packager_llm):
+    handler, gate = _post_turn_handler(packager_llm)
+    config = {"configurable": {"thread_id": "t-follow"}}
+
+    queue = handler.events.subscribe("t-follow")
+    await handler.chat_async("t-follow", "Tell me something")
+    await asyncio.wait_for(_until_post_turn(handler, "t-follow"), timeout=5.0)
+
+    # The answer is out and the thread released before follow-ups exist, but the stream stays open
+    published = [queue.get_nowait() for _ in range(queue.qsize())]
+    answer = [d for e, d in published if e == "message"][-1]
+    assert answer["additional_kwargs"]["follow_ups_pending"] is True
+    assert "follow_up_questions" not in answer["additional_kwargs"]
+    assert "done" not in [e for e, _ in published]
+    assert handler.events.is_active("t-follow")
+    handler.lease.release.assert_awaited_once_with("t-follow")
+
+    gate.set()
+    events = await _collect(queue)
+
+    message = (await handler.agent.aget_state(config)).values["messages"][-1]
+    assert message.additional_kwargs["follow_up_questions"] == ["Q1", "Q2", "Q3"]
+    assert "follow_ups_pending" not in message.additional_kwargs
+    handler.lease.acquire.assert_awaited_once_with("t-follow")
+    assert handler.lease.release.await_count == 2
+    # Subscribers get the follow-ups before the stream ends
+    assert [e for e, _ in events] == ["message", "done"]
+    assert events[0][1]["additional_kwargs"]["follow_up_questions"] == ["Q1", "Q2", "Q3"]
+    assert not handler.events.is_active("t-follow")
+
+
+@pytest.mark.asyncio
+@patch("src.agent.handler.get_db_pool", new_callable=AsyncMock)
+async def test_follow_ups_are_dropped_when_the_thread_is_busy_again(mock_get_pool, packager_llm):
+    handler, gate = _post_turn_handler(packager_llm)
+    handler.lease.acquire.return_value = False
+    config = {"configurable": {"thread_id": "t-busy"}}
+
+    queue = handler.events.subscribe("t-busy")
+    await handler.chat_async("t-busy", "Tell me something")
+    await asyncio.wait_for(_until_post_turn(handler, "t-busy"), timeout=5.0)
+    before = await handler.agent.aget_state(config)
+
+    gate.set()
+    events = await _collect(queue)
+
+    assert (await handler.agent.aget_state(config)).config == before.config
+    # Nothing to add, but the stream still ends
+    assert [d for e, d in events if e == "message"][-1]["additional_kwargs"]["follow_ups_pending"] is True
+
+
+@pytest.mark.asyncio
+@patch("src.agent.handler.get_db_pool", new_callable=AsyncMock)
+async def test_new_message_cancels_pending_follow_ups(mock_get_pool, packager_llm):
+    handler, gate = _post_turn_handler(packager_llm, answers=2)
+
+    queue = handler.events.subscribe("t-next")
+    await handler.chat_async("t-next", "Tell me something")
+    await asyncio.wait_for(_until_post_turn(handler, "t-next"), timeout=5.0)
+    pending = handler._post_turns["t-next"]
+
+    await handler.chat_async("t-next", "Tell me more")
+
+    assert pending.cancelled()
+    # The first turn's stream ended when its job was cancelled, the second has its own
+    assert [e for e, _ in await _collect(queue)][-1] == "done"
+    assert handler.events.is_active("t-next")
+    await asyncio.wait_for(_until_post_turn(handler, "t-next"), timeout=5.0)
+    handler._post_turns["t-next"].cancel()
+
+
+@pytest.mark.asyncio
+async def test_event_stream_gets_cors_headers_from_the_app():
+    pool = MagicMock()
+    conn = AsyncMock()
+    conn.fetchrow.return_value = {"user_id": "default-user"}
+    pool.acquire.return_value.__aenter__.return_value = conn
+
+    app = web.Application(middlewares=[auth_middleware])
+    app.on_response_prepare.append(add_cors_headers)
+    app["llm_handler"] = MagicMock(events=ThreadEventBroker())
+    app.router.add_get("/api/threads/{thread_id}/events", thread_events)
+
+    with patch("src.main.get_db_pool", new=AsyncMock(return_value=pool)):
+        async with TestClient(TestServer(app)) as client:
+            response = await client.get("/api/threads/t-cors/events")
+            body = await response.read()
+
+    # Streamed responses are prepared inside the handler, before the middleware sees them
+    assert response.headers["Access-Control-Allow-Origin"] == "*"
+    assert response.headers["Content-Type"] == "text/event-stream"
+    assert body.startswith(b"event: idle")
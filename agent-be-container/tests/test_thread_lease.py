@@ -0,0 +1,309 @@
+"""
+Tests for thread leases and cancelling in-progress runs
+"""
+import pytest
+import asyncio
+import json
+from datetime import timedelta
+from unittest.mock import MagicMock, AsyncMock, patch
+from aiohttp.test_utils import make_mocked_request
+from langchain_core.messages import AIMessage
+from langgraph.checkpoint.memory import MemorySaver
+import sys
+import os
+
+# Add container root to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.agent import create_agent
+from src.agent.handler import LLMHandler
+from src.agent.lease import ThreadLease
+from src.agent.scheduler import RunScheduler
+from src import keys
+from src.main import cancel_thread, chat_endpoint
+
+
+@pytest.fixture
+def hanging_llm():
+    """LLM whose calls block until released, so runs stay in progress."""
+    llm = MagicMock()
+    llm.bind_tools.return_value = llm
+    llm.release = asyncio.Event()
+
+    async def respond(*args, **kwargs):
+        await llm.release.wait()
+        return AIMessage(content="LLM Response")
+
+    llm.ainvoke = AsyncMock(side_effect=respond)
+    return llm
+
+
+def _handler(llm) -> LLMHandler:
+    handler = LLMHandler(db_dsn="postgresql://localhost/fake", main_llm=llm, packager_llm=llm)
+    handler.agent = create_agent(llm, llm, checkpointer=MemorySaver())
+    handler.run_queue = AsyncMock()
+    handler.run_queue.cancel.return_value = (0, 0)
+    handler.lease = AsyncMock()
+    handler.lease.force_release.return_value = False
+    return handler
+
+
+class TestThreadLease:
+    """Test lease SQL interactions"""
+
+    @pytest.mark.asyncio
+    async def test_admit_is_a_single_query(self):
+        conn = AsyncMock()
+        conn.fetchrow.return_value = {"allowed": True, "created": True, "locked": True, "learning_mode_enabled": True}
+        lease = ThreadLease("worker-a", timedelta(seconds=30))
+
+        admission = await lease.admit(conn, "t1", "u1", "Hello", "r1")
+
+        assert admission == {"allowed": True, "created": True, "locked": True, "learning_mode_enabled": True}
+        conn.fetchrow.assert_awaited_once()
+        conn.execute.assert_not_called()
+        sql, *args = conn.fetchrow.call_args.args
+        assert "locked_until < NOW()" in sql
+        assert "INSERT INTO run_queue" in sql
+        assert args == ["t1", "u1", "Hello", timedelta(seconds=30), "worker-a", "r1"]
+
+    @pytest.mark.asyncio
+    async def test_release_only_frees_own_lease(self):
+        pool = MagicMock()
+        conn = AsyncMock()
+        pool.acquire.return_value.__aenter__.return_value = conn
+        lease = ThreadLease("worker-a", timedelta(seconds=30))
+
+        with patch("src.agent.lease.get_db_pool", new=AsyncMock(return_value=pool)):
+            await lease.release("t1")
+
+        sql, thread_id, worker_id = conn.execute.call_args.args
+        assert "locked_by = $2" in sql
+        assert (thread_id, worker_id) == ("t1", "worker-a")
+
+
+class TestCancelRun:
+    """Test LLMHandler.cancel_run"""
+
+    @pytest.mark.asyncio
+    @patch("src.agent.handler.get_db_pool", new_callable=AsyncMock)
+    async def test_cancels_running_graph_and_releases(self, mock_get_pool, hanging_llm):
+        handler = _handler(hanging_llm)
+        handler.run_queue.enqueue.return_value = "r1"
+        queue = handler.events.subscribe("t1")
+
+        await handler.chat_async("t1", "Long question", user_id="u1")
+        await asyncio.sleep(0.2)
+        assert handler.scheduler.running == 1
+
+        assert await handler.cancel_run("t1") is True
+
+        assert handler.scheduler.running == 0
+        assert not handler.events.is_active("t1")
+        # The run let go of its own lease; nothing is forced
+        handler.lease.release.assert_awaited_once_with("t1")
+        handler.lease.force_release.assert_not_called()
+        handler.run_queue.cancel.assert_not_called()
+        handler.run_queue.complete.assert_awaited_once_with("r1")
+
+        events = []
+        while not queue.empty():
+            events.append(queue.get_nowait()[0])
+        assert events[-2:] == ["cancelled", "done"]
+
+    @pytest.mark.asyncio
+    @patch("src.agent.handler.get_db_pool", new_callable=AsyncMock)
+    async def test_cancelled_waiting_run_never_starts(self, mock_get_pool, hanging_llm):
+        handler = _handler(hanging_llm)
+        handler.scheduler = RunScheduler(max_concurrent=1, max_queued=5, max_per_user=5)
+
+        await handler.chat_async("t1", "First", user_id="u1", run_id="r1")
+        await handler.chat_async("t2", "Second", user_id="u1", run_id="r2")
+        await asyncio.sleep(0.2)
+        assert handler.scheduler.waiting == 1
+
+        assert await handler.cancel_run("t2") is True
+        hanging_llm.release.set()
+        await asyncio.sleep(0.5)
+
+        assert hanging_llm.ainvoke.await_count == 1
+        assert not handler.events.is_active("t2")
+        assert handler.scheduler.running == 0
+
+    @pytest.mark.asyncio
+    @patch("src.agent.handler.get_db_pool", new_callable=AsyncMock)
+    async def test_stale_waiting_run_leaves_the_next_run_alone(self, mock_get_pool, hanging_llm):
+        handler = _handler(hanging_llm)
+        handler.scheduler = RunScheduler(max_concurrent=1, max_queued=5, max_per_user=5)
+
+        await handler.chat_async("t1", "First", user_id="u1", run_id="r1")
+        await handler.chat_async("t2", "Second", user_id="u1", run_id="r2")
+        await asyncio.sleep(0.2)
+
+        assert await handler.cancel_run("t2") is True
+        # The cancel freed t2's lease and completed its run before returning
+        handler.lease.release.assert_awaited_once_with("t2")
+        handler.run_queue.complete.assert_awaited_once_with("r2")
+
+        # A new message is admitted on t2 while the cancelled run is still queued
+        await handler.chat_async("t2", "Again", user_id="u1", run_id="r3")
+        hanging_llm.release.set()
+        await asyncio.sleep(0.5)
+
+        # The cancelled run never started and the new one ran, releasing only its own lease
+        assert hanging_llm.ainvoke.await_count == 2
+        assert [c.args[0] for c in handler.run_queue.complete.await_args_list] == ["r2", "r1", "r3"]
+        assert [c.args[0] for c in handler.lease.release.await_args_list] == ["t2", "t1", "t2"]
+        assert handler.scheduler.running == 0
+
+    @pytest.mark.asyncio
+    async def test_remote_run_is_flagged_not_force_released(self, hanging_llm):
+        handler = _handler(hanging_llm)
+        handler.run_queue.cancel.return_value = (0, 1)
+
+        assert await handler.cancel_run("t1") is True
+
+        handler.run_queue.cancel.assert_awaited_once_with("t1")
+        handler.lease.force_release.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_queued_run_with_no_owner_frees_the_lease(self, hanging_llm):
+        handler = _handler(hanging_llm)
+        handler.run_queue.cancel.return_value = (1, 0)
+
+        assert await handler.cancel_run("t1") is True
+
+        handler.lease.force_release.assert_awaited_once_with("t1")
+
+    @pytest.mark.asyncio
+    async def test_nothing_to_cancel(self, hanging_llm):
+        handler = _handler(hanging_llm)
+
+        assert await handler.cancel_run("t1") is False
+        handler.run_queue.cancel.assert_awaited_once_with("t1")
+
+    @pytest.mark.asyncio
+    async def test_remote_cancel_of_finished_run_completes_row(self, hanging_llm):
+        handler = _handler(hanging_llm)
+        handler.run_queue.heartbeat.return_value = [{"run_id": "r9", "thread_id": "t9"}]
+        handler.run_queue.claim.return_value = []
+        handler.run_queue_interval = 10
+
+        task = asyncio.create_task(handler._run_queue_loop())
+        await asyncio.sleep(0.1)
+        task.cancel()
+
+        handler.lease.renew.assert_awaited()
+        handler.run_queue.complete.assert_awaited_once_with("r9")
+
+
+class TestCancelEndpoint:
+    """Test the cancel route"""
+
+    @pytest.mark.asyncio
+    async def test_denies_other_users(self, hanging_llm):
+        pool = MagicMock()
+        conn = AsyncMock()
+        conn.fetchrow.side_effect = [{"user_id": "owner"}, None]
+        pool.acquire.return_value.__aenter__.return_value = conn
+        handler = _handler(hanging_llm)
+
+        request = make_mocked_request("POST", "/api/threads/t1/cancel", match_info={"thread_id": "t1"}, app={"llm_handler": handler})
+        request["user_id"] = "intruder"
+        with patch("src.main.get_db_pool", new=AsyncMock(return_value=pool)):
+            response = await cancel_thread(request)
+
+        assert response.status == 404
+        handler.run_queue.cancel.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_reports_cancelled(self, hanging_llm):
+        pool = MagicMock()
+        conn = AsyncMock()
+        conn.fetchrow.return_value = {"user_id": "u1"}
+        pool.acquire.return_value.__aenter__.return_value = conn
+        handler = _handler(hanging_llm)
+        handler.run_queue.cancel.return_value = (0, 1)
+
+        request = make_mocked_request("POST", "/api/threads/t1/cancel", match_info={"thread_id": "t1"}, app={"llm_handler": handler})
+        request["user_id"] = "u1"
+        with patch("src.main.get_db_pool", new=AsyncMock(return_value=pool)):
+            response = await cancel_thread(request)
+
+        assert json.loads(response.body) == {"thread_id": "t1", "status": "cancelled"}
+
+
+class TestChatAdmission:
+    """Test the chat endpoint's admission path"""
+
+    def _request(self, sample_config, handler):
+        request = make_mocked_request("POST", "/api/chat", app={keys.config: sample_config, "llm_handler": handler})
+        request["user_id"] = "u1"
+        request.json = AsyncMock(return_value={"message": "Hello there", "thread_id": "t1"})
+        return request
+
+    def _pool(self, admission):
+        pool = MagicMock()
+        conn = AsyncMock()
+        pool.acquire.return_value.__aenter__.return_value = conn
+        handler_admission = AsyncMock(return_value=admission)
+        return pool, handler_admission
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("admission,status", [
+        ({"allowed": False, "created": False, "locked": False, "learning_mode_enabled": False}, 403),
+        ({"allowed": True, "created": False, "locked": False, "learning_mode_enabled": False}, 409),
+    ])
+    async def test_rejects_without_starting_run(self, sample_config, hanging_llm, admission, status):
+        handler = _handler(hanging_llm)
+        pool, handler.lease.admit = self._pool(admission)
+
+        with patch("src.main.get_db_pool", new=AsyncMock(return_value=pool)):
+            response = await chat_endpoint(self._request(sample_config, handler))
+
+        assert response.status == status
+        assert handler.scheduler.running == 0
+        assert handler.scheduler.waiting == 0
+
+    @pytest.mark.asyncio
+    @patch("src.agent.handler.get_db_pool", new_callable=AsyncMock)
+    async def test_new_thread_written_in_one_checkpoint(self, mock_get_pool, sample_config, hanging_llm):
+        handler = _handler(hanging_llm)
+        pool, handler.lease.admit = self._pool({"allowed": True, "created": True, "locked": True, "learning_mode_enabled": True})
+        checkpoint_writes = []
+        update_state = handler.agent.aupdate_state
+
+        async def record(config, values, **kwargs):
+            checkpoint_writes.append(values)
+            return await update_state(config, values, **kwargs)
+
+        handler.agent.aupdate_state = record
+
+        with patch("src.main.get_db_pool", new=AsyncMock(return_value=pool)):
+            response = await chat_endpoint(self._request(sample_config, handler))
+
+        assert response.status == 202
+        assert len(checkpoint_writes) == 1
+        assert checkpoint_writes[0]["learning_mode_enabled"] is True
+        assert checkpoint_writes[0]["messages"][0].content == "Hello there"
+
+        _, thread_id, user_id, title, run_id = handler.lease.admit.call_args.args
+        assert (thread_id, user_id, title) == ("t1", "u1", "Hello there")
+        handler.run_queue.enqueue.assert_not_called()
+
+        await handler.scheduler.cancel_all()
+
+    @pytest.mark.asyncio
+    async def test_failed_start_frees_lease_and_run(self, sample_config, hanging_llm):
+        handler = _handler(hanging_llm)
+        pool, handler.lease.admit = self._pool({"allowed": True, "created": False, "locked": True, "learning_mode_enabled": False})
+        handler.agent.aupdate_state = AsyncMock(side_effect=RuntimeError("checkpoint write failed"))
+
+        with patch("src.main.get_db_pool", new=AsyncMock(return_value=pool)), pytest.raises(RuntimeError):
+            await chat_endpoint(self._request(sample_config, handler))
+
+        run_id = handler.lease.admit.call_args.args[-1]
+        handler.lease.release.assert_awaited_once_with("t1")
+        handler.run_queue.complete.assert_awaited_once_with(run_id)
+        assert handler.scheduler.running == 0
+        assert handler.scheduler.waiting == 0
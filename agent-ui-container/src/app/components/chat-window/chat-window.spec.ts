@@ -3,7 +3,7 @@ import { ActivatedRoute, Router } from '@angular/router';
 import { ChatWindow } from './chat-window';
 import { ChatService, Message } from '../../services/chat.service';
 import { AudioService } from '../../services/audio.service';
-import { of } from 'rxjs';
+import { NEVER, of, Subject } from 'rxjs';
 import { By } from '@angular/platform-browser';
 import { ChangeDetectorRef } from '@angular/core';
 import { vi } from 'vitest';
@@ -18,6 +18,7 @@ describe('ChatWindow', () => {
   beforeEach(async () => {
     chatServiceSpy = {
       getHistory: vi.fn(),
+      threadEvents: vi.fn(),
       sendMessage: vi.fn(),
       notifyThreadCreated: vi.fn(),
       refreshThreads: vi.fn(),
@@ -35,6 +36,7 @@ describe('ChatWindow', () => {
 
     // Default mock returns
     chatServiceSpy.getHistory.mockReturnValue(of({ messages: [] }));
+    chatServiceSpy.threadEvents.mockReturnValue(NEVER);
 
     await TestBed.configureTestingModule({
       imports: [ChatWindow],
@@ -104,6 +106,41 @@ describe('ChatWindow', () => {
     expect(startPollingSpy).toHaveBeenCalledWith('new-thread');
   });
 
+  it('should stream tokens and end the turn on the published message', () => {
+    const events = new Subject<any>();
+    chatServiceSpy.threadEvents.mockReturnValue(events);
+    chatServiceSpy.getHistory.mockReturnValue(of({ messages: [{ type: 'human', content: 'Hi' }, { type: 'ai', content: 'Hello there' }] }));
+    component.threadId = 'thread-1';
+    component.messages = [{ type: 'human', content: 'Hi' }];
+
+    component.startPolling('thread-1');
+    events.next({ event: 'token', data: { id: 'r1', content: 'Hello' } });
+    events.next({ event: 'token', data: { id: 'r1', content: ' there' } });
+
+    expect(component.messages[1]).toMatchObject({ type: 'ai', content: 'Hello there' });
+    expect(component.sending).toBe(true);
+    expect(chatServiceSpy.getHistory).not.toHaveBeenCalled();
+
+    events.next({ event: 'message', data: { type: 'ai', content: 'Hello there' } });
+
+    expect(chatServiceSpy.getHistory).toHaveBeenCalledWith('thread-1');
+    expect(component.sending).toBe(false);
+    expect(audioServiceSpy.playBotReply).toHaveBeenCalled();
+    // Still listening for the follow-up questions
+    expect(component.eventsSubscription).toBeTruthy();
+  });
+
+  it('should poll the history when the run is not on the streaming replica', () => {
+    chatServiceSpy.threadEvents.mockReturnValue(of({ event: 'idle', data: { thread_id: 'thread-1' } }));
+    component.threadId = 'thread-1';
+
+    component.startPolling('thread-1');
+
+    expect(component.sending).toBe(true);
+    expect(component.pollingSubscription).toBeTruthy();
+    component.stopPolling();
+  });
+
   it('should conditionally render an image block if additional_kwargs.image_url is present', () => {
     const threadId = 'thread-image';
     const mockMessages: Message[] = [{
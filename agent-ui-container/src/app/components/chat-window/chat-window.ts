@@ -6,11 +6,11 @@ import { MatButtonModule } from '@angular/material/button';
 import { MatIconModule } from '@angular/material/icon';
 import { MatProgressSpinnerModule } from '@angular/material/progress-spinner';
 import { ActivatedRoute, Router } from '@angular/router';
-import { ChatService, Message } from '../../services/chat.service';
+import { ChatService, Message, ThreadEvent } from '../../services/chat.service';
 import { AudioService } from '../../services/audio.service';
 import { MarkdownPipe } from '../../pipes/markdown.pipe';
 import { interval, Subscription, of } from 'rxjs';
-import { catchError } from 'rxjs/operators';
+import { catchError, take } from 'rxjs/operators';
 
 import { MatTooltipModule } from '@angular/material/tooltip';
 
@@ -35,11 +35,16 @@ export class ChatWindow implements OnInit, AfterViewChecked, OnDestroy {
     loading: boolean = false;
     sending: boolean = false;
     pollingSubscription?: Subscription;
+    eventsSubscription?: Subscription;
+    followUpSubscription?: Subscription;
     durationSubscription?: Subscription;
     externalMessageSub?: Subscription;
     pollCount: number = 0;
     pollingError: string | null = null;
     serverOffset: number = 0;
+    private rawMessages: Message[] = [];
+    private streamingId: string | null = null;
+    private streamingContent = '';
 
     @ViewChild('scrollContainer') private scrollContainer!: ElementRef;
     private lastScrollHeight = 0;
@@ -108,6 +113,8 @@ export class ChatWindow implements OnInit, AfterViewChecked, OnDestroy {
 
     ngOnDestroy() {
         this.stopPolling();
+        this.stopEvents();
+        this.stopWatchingFollowUps();
         if (this.externalMessageSub) {
             this.externalMessageSub.unsubscribe();
         }
@@ -178,6 +185,9 @@ export class ChatWindow implements OnInit, AfterViewChecked, OnDestroy {
                         if (msg.additional_kwargs['follow_up_questions']) {
                             currentAiGroup.additional_kwargs!['follow_up_questions'] = msg.additional_kwargs['follow_up_questions'];
                         }
+                        if ('follow_ups_pending' in msg.additional_kwargs) {
+                            currentAiGroup.additional_kwargs!['follow_ups_pending'] = msg.additional_kwargs['follow_ups_pending'];
+                        }
                     }
 
                     // Sum usage
@@ -215,6 +225,8 @@ export class ChatWindow implements OnInit, AfterViewChecked, OnDestroy {
 
     loadHistory(threadId: string) {
         this.stopPolling();
+        this.stopEvents();
+        this.stopWatchingFollowUps();
         this.loading = true;
         this.cdr.detectChanges(); // Force update
 
@@ -224,6 +236,7 @@ export class ChatWindow implements OnInit, AfterViewChecked, OnDestroy {
                 this.currentStatusMsg = res.thread?.status_msg || null;
                 this.lastStatusUpdatedAtStr = res.thread?.status_updated_at || null;
 
+                this.rawMessages = res.messages;
                 this.messages = this.processMessages(res.messages);
 
                 this.loading = false;
@@ -291,6 +304,9 @@ export class ChatWindow implements OnInit, AfterViewChecked, OnDestroy {
 
         const content = this.newMessage;
         this.newMessage = '';
+        // The previous turn's stream may still be waiting for its follow-up questions
+        this.stopEvents();
+        this.stopWatchingFollowUps();
         this.sending = true;
         this.pollCount = 0;
         this.pollingError = null;
@@ -346,15 +362,139 @@ export class ChatWindow implements OnInit, AfterViewChecked, OnDestroy {
         });
     }
 
+    // Follows the turn over the thread's event stream, falling back to polling the history
+    // when the stream fails or the run is not on the replica serving it
     startPolling(threadId: string) {
         if (this.pollingSubscription && !this.pollingSubscription.closed) {
             return;
         }
+        this.stopEvents();
+        this.stopWatchingFollowUps();
         this.sending = true;
         this.pollCount = 0;
         this.pollingError = null;
         this.startDurationTimer();
 
+        this.eventsSubscription = this.chatService.threadEvents(threadId).subscribe({
+            next: (event) => this.handleThreadEvent(threadId, event),
+            error: (err) => {
+                console.warn('Event stream unavailable, polling history:', err);
+                this.eventsSubscription = undefined;
+                this.fallBackToPolling(threadId);
+            },
+            complete: () => {
+                this.eventsSubscription = undefined;
+                this.fallBackToPolling(threadId);
+            }
+        });
+    }
+
+    private handleThreadEvent(threadId: string, e: ThreadEvent) {
+        if (this.threadId !== threadId) return;
+
+        switch (e.event) {
+            case 'idle':
+                // Not running on this replica (or already over): the history has the rest
+                this.stopEvents();
+                this.fallBackToPolling(threadId);
+                break;
+            case 'status':
+                this.currentStatusMsg = e.data.status_msg || null;
+                this.stepStartTime = Date.now();
+                break;
+            case 'partial':
+                this.showStreamedAnswer(e.data.id, e.data.content, false);
+                break;
+            case 'token':
+                this.showStreamedAnswer(e.data.id, e.data.content, true);
+                break;
+            case 'message':
+                // The turn's answer, or later the same answer with its follow-up questions
+                this.refreshHistory(threadId);
+                break;
+            case 'cancelled':
+            case 'done':
+                this.stopEvents();
+                if (this.sending) {
+                    this.refreshHistory(threadId);
+                }
+                break;
+        }
+        this.cdr.detectChanges();
+    }
+
+    private showStreamedAnswer(id: string, content: string, append: boolean) {
+        if (this.streamingId !== id) {
+            this.streamingId = id;
+            this.streamingContent = '';
+        }
+        this.streamingContent = append ? this.streamingContent + content : content;
+
+        let lastMsg = this.messages[this.messages.length - 1];
+        if (!lastMsg || lastMsg.type !== 'ai') {
+            lastMsg = { type: 'ai', content: '' };
+            this.messages.push(lastMsg);
+        }
+        lastMsg.content = this.streamingContent;
+        this.scrollToBottom();
+    }
+
+    // One history fetch per published message; the first one while sending ends the turn
+    private refreshHistory(threadId: string) {
+        const finishing = this.sending;
+        const duration = this.totalDuration;
+        if (finishing) {
+            this.stopPolling();
+        }
+
+        this.chatService.getHistory(threadId).pipe(
+            catchError(err => {
+                console.error('Error loading history:', err);
+                return of(null);
+            })
+        ).subscribe(res => {
+            if (!res || this.threadId !== threadId) return;
+
+            const messages = this.processMessages(res.messages);
+            // Preserve local durations
+            for (let i = 0; i < messages.length; i++) {
+                if (this.messages[i] && this.messages[i].duration) {
+                    messages[i].duration = this.messages[i].duration;
+                }
+            }
+            this.rawMessages = res.messages;
+            this.messages = messages;
+            this.streamingId = null;
+
+            if (finishing && messages.length > 0) {
+                if (duration) {
+                    messages[messages.length - 1].duration = duration;
+                }
+                this.audioService.playBotReply();
+            }
+            this.scrollToBottom();
+            this.cdr.detectChanges();
+            this.focusInput();
+        });
+    }
+
+    private fallBackToPolling(threadId: string) {
+        if (this.threadId !== threadId) return;
+        if (this.sending) {
+            this.pollHistory(threadId);
+            return;
+        }
+        // The answer arrived but the stream ended before its follow-up questions
+        const lastMsg = this.messages[this.messages.length - 1];
+        if (lastMsg?.additional_kwargs?.['follow_ups_pending']) {
+            this.watchFollowUps(threadId, this.rawMessages);
+        }
+    }
+
+    private pollHistory(threadId: string) {
+        if (this.pollingSubscription && !this.pollingSubscription.closed) {
+            return;
+        }
         this.pollingSubscription = interval(2000).subscribe(() => {
             this.pollCount++;
             this.chatService.getHistory(threadId).pipe(
@@ -392,6 +532,7 @@ export class ChatWindow implements OnInit, AfterViewChecked, OnDestroy {
                 }
 
                 if (messages.length > 0) {
+                    this.rawMessages = res.messages;
                     this.messages = messages;
 
                     const lastMsg = messages[messages.length - 1];
@@ -403,6 +544,9 @@ export class ChatWindow implements OnInit, AfterViewChecked, OnDestroy {
                             }
                             this.stopPolling();
                             this.audioService.playBotReply();
+                            if (lastMsg.additional_kwargs?.['follow_ups_pending']) {
+                                this.watchFollowUps(threadId, res.messages);
+                            }
                         } else if (lastMsg.type === 'tool') {
                             if (this.totalDuration) {
                                 lastMsg.duration = this.totalDuration;
@@ -427,6 +571,7 @@ export class ChatWindow implements OnInit, AfterViewChecked, OnDestroy {
         const identifier = mfeId ? `MFE with ID: ${mfeId}` : 'inline MFE';
         const messageContent = `[System: User submitted data via ${event.action} action inside ${identifier}]\nData: ${JSON.stringify(event.payload, null, 2)}`;
         
+        this.stopEvents();
         this.sending = true;
         this.chatService.sendMessage(messageContent, this.threadId).subscribe({
             next: () => {
@@ -443,6 +588,57 @@ export class ChatWindow implements OnInit, AfterViewChecked, OnDestroy {
         msg.showTools = !msg.showTools;
     }
 
+    // Follow-up questions are attached by the backend after the answer is final. Only the
+    // current turn is fetched (after its human message) and unchanged polls are answered 304
+    watchFollowUps(threadId: string, rawMessages: Message[]) {
+        this.stopWatchingFollowUps();
+        const cursor = [...rawMessages].reverse().find(m => m.type === 'human')?.id;
+        let etag: string | null = null;
+        this.followUpSubscription = interval(2000).pipe(take(15)).subscribe(() => {
+            this.chatService.getHistoryChanges(threadId, cursor, etag).pipe(
+                catchError(() => of(null))
+            ).subscribe(changes => {
+                if (!changes || this.sending || this.threadId !== threadId) return;
+                etag = changes.etag;
+                const res = changes.history;
+                if (!res) return;
+
+                // An incremental response holds the turn's messages only; they replace its AI group
+                const messages = res.incremental
+                    ? [...this.messages.slice(0, -1), ...this.processMessages(res.messages)]
+                    : this.processMessages(res.messages);
+                const lastMsg = messages[messages.length - 1];
+                if (!lastMsg || lastMsg.type !== 'ai' || lastMsg.additional_kwargs?.['follow_ups_pending']) return;
+
+                // Preserve local durations
+                for (let i = 0; i < messages.length; i++) {
+                    if (this.messages[i] && this.messages[i].duration) {
+                        messages[i].duration = this.messages[i].duration;
+                    }
+                }
+                this.messages = messages;
+                this.stopWatchingFollowUps();
+                this.scrollToBottom();
+                this.cdr.detectChanges();
+            });
+        });
+    }
+
+    stopEvents() {
+        if (this.eventsSubscription) {
+            this.eventsSubscription.unsubscribe();
+            this.eventsSubscription = undefined;
+        }
+        this.streamingId = null;
+    }
+
+    stopWatchingFollowUps() {
+        if (this.followUpSubscription) {
+            this.followUpSubscription.unsubscribe();
+            this.followUpSubscription = undefined;
+        }
+    }
+
     stopPolling() {
         this.sending = false;
         this.pollCount = 0;
@@ -1,5 +1,5 @@
-import { ChatService, Thread, ChatResponse, HistoryResponse } from './chat.service';
-import { of } from 'rxjs';
+import { ChatService, Thread, ChatResponse, HistoryResponse, parseSseFrame } from './chat.service';
+import { of, throwError } from 'rxjs';
 import { vi } from 'vitest';
 
 describe('ChatService', () => {
@@ -112,6 +112,34 @@ describe('ChatService', () => {
         );
     });
 
+    it('should poll history changes after a cursor with the last ETag', () => {
+        const threadId = 'thread-1';
+        const mockHistory: HistoryResponse = { messages: [{ id: 'a1', type: 'ai', content: 'Hello' }] };
+        httpClientSpy.get.mockReturnValue(of({ body: mockHistory, headers: { get: () => '"v2"' } }));
+
+        service.getHistoryChanges(threadId, 'h1', '"v1"').subscribe(changes => {
+            expect(changes).toEqual({ etag: '"v2"', history: mockHistory });
+        });
+
+        const options = httpClientSpy.get.mock.calls.at(-1)[1];
+        expect(options.params.get('after')).toBe('h1');
+        expect(options.headers.get('If-None-Match')).toBe('"v1"');
+        expect(options.observe).toBe('response');
+    });
+
+    it('should report an unchanged history as null', () => {
+        httpClientSpy.get.mockReturnValue(throwError(() => ({ status: 304 })));
+
+        service.getHistoryChanges('thread-1', 'h1', '"v1"').subscribe(changes => {
+            expect(changes).toEqual({ etag: '"v1"', history: null });
+        });
+    });
+
+    it('should parse server-sent event frames', () => {
+        expect(parseSseFrame('event: token\ndata: {"id": "r1", "content": "Hi"}')).toEqual({ event: 'token', data: { id: 'r1', content: 'Hi' } });
+        expect(parseSseFrame(': keepalive')).toBeNull();
+    });
+
     it('should delete thread', () => {
         const threadId = '1';
         httpClientSpy.delete.mockReturnValue(of({ status: 'deleted' }));
@@ -1,6 +1,6 @@
 import { Injectable } from '@angular/core';
-import { HttpClient, HttpHeaders } from '@angular/common/http';
-import { Observable, BehaviorSubject, Subject, map, shareReplay, switchMap, tap } from 'rxjs';
+import { HttpClient, HttpErrorResponse, HttpHeaders, HttpParams } from '@angular/common/http';
+import { Observable, BehaviorSubject, Subject, catchError, map, of, shareReplay, switchMap, tap, throwError } from 'rxjs';
 import { AuthService } from './auth.service';
 
 export interface Thread {
@@ -32,6 +32,7 @@ export interface ChatResponse {
 }
 
 export interface Message {
+  id?: string;
   type: string;
   content: string;
   duration?: string;
@@ -56,9 +57,37 @@ export interface Message {
 export interface HistoryResponse {
   thread?: Thread;
   messages: Message[];
+  cursor?: string | null;
+  // Only the messages after the requested cursor
+  incremental?: boolean;
   visualizations?: Visualization[];
 }
 
+export interface ThreadEvent {
+  event: string;
+  data: any;
+}
+
+// Parses one Server-Sent Events frame; comment-only frames (keepalives) give null
+export function parseSseFrame(frame: string): ThreadEvent | null {
+  let event = 'message';
+  const data: string[] = [];
+  for (const line of frame.split('\n')) {
+    if (line.startsWith('event:')) {
+      event = line.slice(6).trim();
+    } else if (line.startsWith('data:')) {
+      data.push(line.slice(5).trimStart());
+    }
+  }
+  return data.length ? { event, data: JSON.parse(data.join('\n')) } : null;
+}
+
+export interface HistoryChanges {
+  etag: string | null;
+  // null when nothing changed since the ETag was issued
+  history: HistoryResponse | null;
+}
+
 export interface Visualization {
   id: string;
   thread_id: string;
@@ -158,6 +187,57 @@ export class ChatService {
     );
   }
 
+  // Conditional history poll: only messages after the cursor, and a 304 (history null) while the ETag still matches
+  getHistoryChanges(threadId: string, after?: string, etag?: string | null): Observable<HistoryChanges> {
+    return this.apiUrl$.pipe(
+      switchMap(apiUrl => {
+        const headers = etag ? this.getHeaders().set('If-None-Match', etag) : this.getHeaders();
+        const params = after ? new HttpParams().set('after', after) : undefined;
+        return this.http.get<HistoryResponse>(`${apiUrl}/threads/${threadId}/history`, { headers, params, observe: 'response' });
+      }),
+      map(res => ({ etag: res.headers.get('ETag'), history: res.body })),
+      catchError((err: HttpErrorResponse) => err.status === 304 ? of({ etag: etag ?? null, history: null }) : throwError(() => err))
+    );
+  }
+
+  // Live progress of the thread's run. fetch is used rather than EventSource, which cannot send the auth headers
+  threadEvents(threadId: string): Observable<ThreadEvent> {
+    return this.apiUrl$.pipe(
+      switchMap(apiUrl => new Observable<ThreadEvent>(subscriber => {
+        const controller = new AbortController();
+        const headers = this.getHeaders();
+        const init: RequestInit = {
+          headers: Object.fromEntries(headers.keys().map(key => [key, headers.get(key) || ''])),
+          signal: controller.signal
+        };
+
+        fetch(`${apiUrl}/threads/${threadId}/events`, init).then(async res => {
+          if (!res.ok || !res.body) {
+            throw new Error(`Event stream failed with status ${res.status}`);
+          }
+          const reader = res.body.pipeThrough(new TextDecoderStream()).getReader();
+          let buffer = '';
+          while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += value;
+            let end: number;
+            while ((end = buffer.indexOf('\n\n')) !== -1) {
+              const frame = parseSseFrame(buffer.slice(0, end));
+              buffer = buffer.slice(end + 2);
+              if (frame) subscriber.next(frame);
+            }
+          }
+          subscriber.complete();
+        }).catch(err => {
+          if (!controller.signal.aborted) subscriber.error(err);
+        });
+
+        return () => controller.abort();
+      }))
+    );
+  }
+
   deleteThread(threadId: string): Observable<any> {
     return this.apiUrl$.pipe(
       switchMap(apiUrl => this.http.delete(`${apiUrl}/threads/${threadId}`, { headers: this.getHeaders() }))